@@ -0,0 +1,340 @@
+#!/usr/bin/python3
+#
+# protoc-ng benchmark: generates synthetic .proto trees and times the compiler's phases
+# (scanner, parser, verify_type_references, set_cpp_type_names and codegen) separately.
+#
+#   bench/bench.py                          # stock scenarios, compared to bench/baseline.json
+#   bench/bench.py --save-baseline          # ... and store the results as the new baseline
+#   bench/bench.py --messages 500 --fields 30 --depth 2 --fanout 2 --import-depth 3
+#
+# The baseline holds the best-of-N wall time of every phase in seconds. It is only
+# meaningful for the machine it was recorded on, so it is not checked in: save one locally
+# before the change to measure. Without it the results are only reported.
+#
+import argparse, collections, contextlib, importlib.util, io, json, os, shutil, sys, tempfile, time
+from collections import namedtuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import nodes, scanner
+
+Scenario = namedtuple('Scenario', ['name', 'messages', 'fields', 'depth', 'enums', 'enum_values',
+                                   'fanout', 'import_depth', 'extensions'])
+
+scenarios = [
+    #        name          msgs  fields depth enums values fanout imp-depth ext
+    Scenario("flat",        200,    10,    0,    4,     8,     0,      0,     0),
+    Scenario("wide",         20,   100,    0,    4,     8,     0,      0,     0),
+    Scenario("nested",       40,     8,    4,    4,     8,     0,      0,     0),
+    Scenario("enums",        20,    10,    0,   50,   100,     0,      0,     0),
+    Scenario("imports",      20,    10,    1,    2,     8,     3,      3,     0),
+    Scenario("extensions",   50,    10,    0,    2,     8,     2,      2,    10),
+]
+
+phases = ["scanner", "parser", "verify_type_references", "set_cpp_type_names", "codegen"]
+
+#
+# Synthetic schema generator
+#
+
+# Field types cycled through by the generated messages.
+builtin_types = ['int32', 'uint32', 'int64', 'uint64', 'double', 'float', 'bool',
+                 'string', 'bytes']
+
+def file_name(level, index):
+    return "l%d_f%d.proto" % (level, index)
+
+def type_prefix(level, index):
+    return "L%dF%d" % (level, index)
+
+# Writes one file. File #i of level N imports files #i*fanout..#i*fanout+fanout-1 of
+# level N+1, so the import graph is a tree.
+def generate_file(sc, out_dir, level, index):
+    prefix = type_prefix(level, index)
+    imports = []
+    if level < sc.import_depth:
+        imports = [(level + 1, index * sc.fanout + i) for i in range(sc.fanout)]
+
+    lines = ['syntax = "proto3";', "", "package bench;", ""]
+    for imp in imports:
+        lines.append('import "' + file_name(*imp) + '";')
+    lines.append("")
+
+    enums = [prefix + "_Enum" + str(e) for e in range(sc.enums)]
+    for e, enum in enumerate(enums):
+        lines.append("enum " + enum + " {")
+        for v in range(sc.enum_values):
+            # File-scope enum values share the C++ namespace, hence the prefix.
+            lines.append("  %s_E%d_V%d = %d;" % (prefix, e, v, v))
+        lines.append("}")
+        lines.append("")
+
+    imported_msgs = [type_prefix(*imp) + "_M0" for imp in imports]
+
+    def field_decls(indent, msg_index, count, local_msgs):
+        decls = []
+        for f in range(count):
+            fid = f + 1
+            kind = f % 12
+            if kind < len(builtin_types):
+                decl = builtin_types[kind]
+            elif kind == 9 and enums:
+                decl = enums[f % len(enums)]
+            elif kind == 10 and local_msgs:
+                # A reference to the next message is a forward declaration.
+                decl = local_msgs[(msg_index + 1) % len(local_msgs)]
+            elif kind == 11 and imported_msgs:
+                decl = imported_msgs[f % len(imported_msgs)]
+            elif kind == 11 and msg_index > 0 and local_msgs:
+                decl = "map<int32, " + local_msgs[msg_index - 1] + ">"
+            else:
+                decl = "repeated string"
+            if f % 5 == 4 and decl in builtin_types:
+                decl = "repeated " + decl
+            decls.append(indent + "%s field_%d = %d;" % (decl, fid, fid))
+        return decls
+
+    msgs = [prefix + "_M" + str(m) for m in range(sc.messages)]
+    for m, msg in enumerate(msgs):
+        lines.append("message " + msg + " {")
+        if sc.extensions > 0:
+            lines.append("  extensions 100 to max;")
+        lines += field_decls("  ", m, sc.fields, msgs)
+
+        # A chain of nested messages, each one referenced by its parent.
+        indent = "  "
+        for d in range(sc.depth):
+            lines.append(indent + "Nested" + str(d) + " nested_" + str(d) + " = " +
+                         str(sc.fields + 1) + ";")
+            lines.append(indent + "message Nested" + str(d) + " {")
+            indent += "  "
+            lines += field_decls(indent, m, sc.fields, [])
+        for d in reversed(range(sc.depth)):
+            indent = indent[0:-2]
+            lines.append(indent + "}")
+        lines.append("}")
+        lines.append("")
+
+    # protoc-ng keeps one file-scope "extend" block per file.
+    if sc.extensions > 0 and imported_msgs:
+        lines.append("extend " + imported_msgs[0] + " {")
+        for e in range(sc.extensions):
+            lines.append("  %s %s_ext%d = %d;" % (msgs[e % len(msgs)], prefix, e, 100 + e))
+        lines.append("}")
+
+    with open(os.path.join(out_dir, file_name(level, index)), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return len(lines)
+
+# Generates the whole tree and returns (root file name, list of file names, line count).
+def generate_schema(sc, out_dir):
+    if sc.fanout == 0:
+        sc = sc._replace(import_depth = 0)
+
+    names = []
+    line_count = 0
+    for level in range(sc.import_depth + 1):
+        for index in range(sc.fanout ** level):
+            line_count += generate_file(sc, out_dir, level, index)
+            names.append(file_name(level, index))
+    return names[0], names, line_count
+
+#
+# Phase timing
+#
+
+def load_protoc():
+    spec = importlib.util.spec_from_file_location("protoc_ng",
+                                                  os.path.join(ROOT_DIR, "protoc-ng.py"))
+    protoc = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(protoc)
+    return protoc
+
+def count_fields(msg):
+    count = len(msg.fields)
+    for _, sub_msg in list(msg.messages.items()) + list(msg.extends.items()):
+        count += count_fields(sub_msg)
+    return count
+
+# A scanner that tokenizes the whole file up front so that the parser's own time can be
+# told apart from the scanner's.
+BaseScanner = scanner.Scanner
+class PrescannedScanner(BaseScanner):
+    elapsed = 0.0
+
+    def __init__(self, file_path, flags = 0):
+        start = time.perf_counter()
+        BaseScanner.__init__(self, file_path, flags)
+        count = 1
+        while BaseScanner.get(self, count - 1).type != scanner.Token.Type.EoF:
+            count += 1
+        self.tokens = collections.deque(BaseScanner.get(self, idx) for idx in range(count))
+        PrescannedScanner.elapsed += time.perf_counter() - start
+
+    def get(self, idx = 0):
+        return self.tokens[idx]
+
+    def pop(self):
+        assert(not self.reached_eof())
+        return self.tokens.popleft()
+
+# Wraps File.<method> so that the time spent in it is accumulated in timers[method].
+@contextlib.contextmanager
+def timed_methods(cls, methods, timers):
+    originals = {}
+
+    def wrap(name, method):
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                timers[name] += time.perf_counter() - start
+        return wrapper
+
+    for name in methods:
+        originals[name] = getattr(cls, name)
+        timers[name] = 0.0
+        setattr(cls, name, wrap(name, originals[name]))
+    try:
+        yield
+    finally:
+        for name, method in originals.items():
+            setattr(cls, name, method)
+
+# Runs every phase once over the schema in the current directory and returns
+# ({phase: seconds}, field count).
+def run_once(protoc, root, out_dir):
+    timings = {}
+
+    # 1. Scanner and 2. parser: the post-parse passes are timed on their own and the
+    #    parser gets what remains.
+    scanner.Context.global_file_dict.clear()
+    PrescannedScanner.elapsed = 0.0
+    scanner.Scanner = PrescannedScanner
+    timers = {}
+    try:
+        with timed_methods(nodes.File, ["verify_type_references", "set_cpp_type_names"], timers):
+            start = time.perf_counter()
+            protoc.parse_file(root)
+            total = time.perf_counter() - start
+    finally:
+        scanner.Scanner = BaseScanner
+    timings.update(timers)
+    timings["scanner"] = PrescannedScanner.elapsed
+    timings["parser"] = total - timings["scanner"] - sum(timers.values())
+
+    # 3. Codegen
+    files = list(scanner.Context.global_file_dict.values())
+    start = time.perf_counter()
+    for file_ast in files:
+        file_ast.generate(out_dir)
+    timings["codegen"] = time.perf_counter() - start
+
+    fields = 0
+    for file_ast in files:
+        for _, msg in list(file_ast.messages.items()) + list(file_ast.extends.items()):
+            fields += count_fields(msg)
+    return timings, fields
+
+def run_scenario(protoc, sc, repeat):
+    work_dir = tempfile.mkdtemp(prefix="protoc-ng-bench-")
+    cwd = os.getcwd()
+    try:
+        root, names, lines = generate_schema(sc, work_dir)
+        out_dir = os.path.join(work_dir, "out")
+        protoc.set_args(protoc.parse_args(["-I", ".", "--cpp_out", out_dir, root]))
+
+        os.chdir(work_dir)
+        best = None
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(repeat):
+                timings, fields = run_once(protoc, root, out_dir)
+                if best is None:
+                    best = timings
+                else:
+                    best = {p: min(best[p], timings[p]) for p in phases}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+    return {"files": len(names), "lines": lines, "fields": fields, "phases": best}
+
+def rate(count, seconds):
+    if seconds <= 0:
+        return "-"
+    return "{:,.0f}".format(count / seconds)
+
+# Prints the results and returns the phases that regressed against the baseline.
+def report(name, result, baseline, tolerance):
+    regressions = []
+    print("[%s] %d files, %s lines, %s fields" %
+          (name, result["files"], "{:,}".format(result["lines"]),
+           "{:,}".format(result["fields"])))
+    print("  %-24s %10s %12s %12s %12s" % ("phase", "time", "lines/s", "fields/s", "vs baseline"))
+    for phase in phases:
+        seconds = result["phases"][phase]
+        vs = ""
+        if baseline and phase in baseline:
+            ratio = seconds / baseline[phase] if baseline[phase] > 0 else 1.0
+            vs = "%.2fx" % ratio
+            # Sub-millisecond phases are too noisy to judge by the ratio alone.
+            if ratio > 1.0 + tolerance and seconds - baseline[phase] > 0.001:
+                vs += " !"
+                regressions.append(name + "/" + phase)
+        print("  %-24s %8.2fms %12s %12s %12s" %
+              (phase, seconds * 1000, rate(result["lines"], seconds),
+               rate(result["fields"], seconds), vs))
+    print("")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="protoc-ng benchmark")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per scenario; the best time of each phase is reported")
+    parser.add_argument("--scenario", action="append",
+                        help="run only the named stock scenario(s)")
+    parser.add_argument("--baseline", default=os.path.join(ROOT_DIR, "bench", "baseline.json"),
+                        help="baseline file to compare against (or to save into)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown reported as a regression (default: 0.25)")
+
+    group = parser.add_argument_group("Custom scenario (replaces the stock ones)")
+    for field in Scenario._fields[1:]:
+        group.add_argument("--" + field.replace("_", "-"), type=int, dest=field)
+    args = parser.parse_args()
+
+    selected = scenarios
+    custom = {f: getattr(args, f) for f in Scenario._fields[1:] if getattr(args, f) is not None}
+    if custom:
+        base = Scenario("custom", 100, 10, 0, 2, 8, 0, 0, 0)
+        selected = [base._replace(**custom)]
+    elif args.scenario:
+        selected = [sc for sc in scenarios if sc.name in args.scenario]
+
+    baseline = {}
+    if os.path.isfile(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    protoc = load_protoc()
+    results = {}
+    regressions = []
+    for sc in selected:
+        results[sc.name] = run_scenario(protoc, sc, args.repeat)
+        regressions += report(sc.name, results[sc.name], baseline.get(sc.name), args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({name: r["phases"] for name, r in results.items()}, f,
+                      indent=2, sort_keys=True)
+            f.write("\n")
+        print("Saved the baseline to " + args.baseline)
+    elif regressions:
+        sys.exit("Regressed by more than %d%%: %s" %
+                 (args.tolerance * 100, ", ".join(regressions)))
+
+if __name__ == "__main__":
+    main()
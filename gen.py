@@ -2,7 +2,7 @@ from collections import namedtuple
 from utils import writeln, write_blank_if, log
 from template import Templates
 
-import os
+import os, sys
 
 Filename = namedtuple('Filename', ['cc', 'h'])
 
@@ -34,23 +34,212 @@ def get_cpp_file_paths(file_ast, out_path):
     return Filename(out_path + ".".join(parts) + ".cc",
                     out_path + ".".join(parts) + ".h")
 
+# The C++ types of the integer types.
+cpp_integer_types = {
+    "int32": "int32_t",
+    "uint32": "uint32_t",
+    "int64": "int64_t",
+    "uint64": "uint64_t",
+    "sint32": "int32_t",
+    "sint64": "int64_t",
+    "fixed32": "uint32_t",
+    "fixed64": "uint64_t",
+    "sfixed32": "int32_t",
+    "sfixed64": "int64_t",
+}
+
 def cpp_arg_type(proto_type):
     if proto_type == "string" or proto_type == "bytes":
         return "const std::string&"
     elif proto_type == "wstring":
         return "const std::wstring&"
-    elif proto_type[-2:] == "32" or proto_type[-2:] == "64":
-        return proto_type + "_t"
+    elif proto_type in cpp_integer_types:
+        return cpp_integer_types[proto_type]
     else:
         return proto_type.replace(".", "::")
 
+# The wire types of the built-in types and protozero's get_*() suffixes for them.
+wire_formats = {
+    "int32": ("varint", "int32"),
+    "uint32": ("varint", "uint32"),
+    "int64": ("varint", "int64"),
+    "uint64": ("varint", "uint64"),
+    "sint32": ("varint", "sint32"),
+    "sint64": ("varint", "sint64"),
+    "fixed32": ("fixed32", "fixed32"),
+    "fixed64": ("fixed64", "fixed64"),
+    "sfixed32": ("fixed32", "sfixed32"),
+    "sfixed64": ("fixed64", "sfixed64"),
+    "bool": ("varint", "bool"),
+    "double": ("fixed64", "double"),
+    "float": ("fixed32", "float"),
+    "string": ("length_delimited", None),
+    "bytes": ("length_delimited", None),
+    "wstring": ("length_delimited", None),
+}
+
+# Returns the wire type and the protozero getter for values of the given type. Strings and
+# sub-messages have no getter, they are decoded from views.
+def wire_format(proto_type, is_enum):
+    if proto_type in wire_formats:
+        return wire_formats[proto_type]
+    if is_enum:
+        return ("varint", "enum")
+    return ("length_delimited", None)
+
+# Emits the statement that decodes the value under 'reader' into 'target', or appends it
+# to 'target' (a vector).
+def generate_decode(file, indent, getter, cpp_type, target, reader, append = False):
+    if getter:
+        value = reader + ".get_" + getter + "()"
+        if getter == "enum":
+            value = "static_cast<" + cpp_type + ">(" + value + ")"
+        if append:
+            writeln(file, target + ".push_back(" + value + ");", indent)
+        else:
+            writeln(file, target + " = " + value + ";", indent)
+        return
+
+    if append:
+        writeln(file, target + ".emplace_back();", indent)
+        target += ".back()"
+    writeln(file, "Decode(" + target + ", " + reader + ".get_view());", indent)
+
+def varint_size(value):
+    size = 1
+    while value >= 0x80:
+        value >>= 7
+        size += 1
+    return size
+
+# The size of a field's key on the wire.
+def key_size(id):
+    return varint_size(id << 3)
+
+# Returns the C++ expression for the encoded size of 'value' (sans the key). Sub-messages
+# either compute (and cache) their sizes or return the cached ones.
+def encoded_size(proto_type, is_enum, value, cached = False):
+    wire_type, getter = wire_format(proto_type, is_enum)
+    if wire_type == "fixed64":
+        return "8"
+    elif wire_type == "fixed32":
+        return "4"
+    elif getter == "bool":
+        return "1"
+    elif getter == "int32" or getter == "enum":
+        # Negative values are sign-extended to 64 bits.
+        return "VarintSize(static_cast<int64_t>(" + value + "))"
+    elif getter == "sint32" or getter == "sint64":
+        return "VarintSize(protozero::encode_zigzag64(" + value + "))"
+    elif getter:
+        return "VarintSize(" + value + ")"
+    elif proto_type == "wstring":
+        return "LengthDelimitedSize(" + value + ".size() * sizeof(wchar_t))"
+    elif proto_type == "string" or proto_type == "bytes":
+        return "LengthDelimitedSize(" + value + ".size())"
+    elif cached:
+        return "LengthDelimitedSize(" + value + "._CachedSize())"
+    return "LengthDelimitedSize(" + value + ".ByteSizeLong())"
+
+# Emits the statement that appends 'value' as field 'tag' to 'output', an ArrayWriter.
+def generate_encode(file, indent, proto_type, is_enum, tag, value):
+    _, getter = wire_format(proto_type, is_enum)
+    if getter:
+        writeln(file, "output.add_" + getter + "(" + str(tag) + ", " + value + ");", indent)
+    elif proto_type == "wstring":
+        writeln(file,
+                "output.add_bytes(" + str(tag) + ", reinterpret_cast<const char*>(" + value +
+                    ".data()), " + value + ".size() * sizeof(wchar_t));",
+                indent)
+    elif proto_type == "string" or proto_type == "bytes":
+        writeln(file,
+                "output.add_string(" + str(tag) + ", " + value + ".data(), " + value +
+                    ".size());",
+                indent)
+    else:
+        writeln(file, "AppendMessage(output, " + str(tag) + ", " + value + ");", indent)
+
+# Prints 'value' as the field 'name' of the text format.
+def generate_debug_field(file, indent, name, value, depth, is_message):
+    function = "SubMessage" if is_message else "Field"
+    writeln(file,
+            "::proto_ng::debug::" + function + "(out, " + depth + ', single_line, "' + name +
+                '", ' + value + ");",
+            indent)
+
+# The engine's kinds of the built-in types in the "--table-driven" code.
+table_kinds = {
+    "int32": "kInt32",
+    "uint32": "kUInt32",
+    "int64": "kInt64",
+    "uint64": "kUInt64",
+    "sint32": "kSInt32",
+    "sint64": "kSInt64",
+    "fixed32": "kFixed32",
+    "fixed64": "kFixed64",
+    "sfixed32": "kSFixed32",
+    "sfixed64": "kSFixed64",
+    "bool": "kBool",
+    "double": "kDouble",
+    "float": "kFloat",
+    "string": "kString",
+    "bytes": "kBytes",
+    "wstring": "kWString",
+}
+
+def table_kind(proto_type, is_enum):
+    if proto_type in table_kinds:
+        return table_kinds[proto_type]
+    return "kEnum" if is_enum else "kMessage"
+
+# The "--views" decoders of the built-in types (see infra_view.h).
+view_decoders = {
+    "int32": "Int32",
+    "uint32": "UInt32",
+    "int64": "Int64",
+    "uint64": "UInt64",
+    "sint32": "SInt32",
+    "sint64": "SInt64",
+    "fixed32": "Fixed32",
+    "fixed64": "Fixed64",
+    "sfixed32": "SFixed32",
+    "sfixed64": "SFixed64",
+    "bool": "Bool",
+    "double": "Double",
+    "float": "Float",
+    "string": "String",
+    "bytes": "String",
+    "wstring": "WString",
+}
+
+def view_decoder(proto_type, resolved_type, is_enum):
+    if proto_type in view_decoders:
+        return "::proto_ng::view::" + view_decoders[proto_type]
+    elif is_enum:
+        return "::proto_ng::view::EnumOf<::" + resolved_type.fq_cpp_ref() + ">"
+    return "::proto_ng::view::MessageOf<::" + resolved_type.fq_cpp_ref() + "View>"
+
+# The members of the Representations are laid out by decreasing alignment, so that they
+# need no padding but at the end: the 8-byte scalars, the inline messages (which hold at
+# least a size_t), the pointer-aligned library types, the presence bits (whose words may be
+# narrower than pointers), the 4-byte scalars and then the bools.
+layout_ranks = {"8-byte": 0, "inline": 1, "pointer": 2, "presence": 3, "4-byte": 4, "bool": 5}
+
+# The namespace of the library types that hold the fields: "--pmr" makes them
+# allocator-aware.
+def std_ns():
+    return "std::pmr::" if args.pmr else "std::"
+
+def camel_case(name):
+    return "".join(part.capitalize() for part in name.split("_"))
+
 def cpp_impl_type(proto_type):
     if proto_type == "string" or proto_type == "bytes":
-        return "std::string"
+        return std_ns() + "string"
     elif proto_type == "wstring":
-        return "std::wstring"
-    elif proto_type[-2:] == "32" or proto_type[-2:] == "64":
-        return proto_type + "_t"
+        return std_ns() + "wstring"
+    elif proto_type in cpp_integer_types:
+        return cpp_integer_types[proto_type]
     else:
         return proto_type.replace(".", "::")
 
@@ -69,6 +258,12 @@ class File:
 
         file = open_file(args.cpp_out + "/infra.h")
         writeln(file, Templates.infra)
+        if args.table_driven:
+            file = open_file(args.cpp_out + "/infra_table.h")
+            writeln(file, Templates.infra_table)
+        if args.views:
+            file = open_file(args.cpp_out + "/infra_view.h")
+            writeln(file, Templates.infra_view)
 
     def count_extends(self):
         count = len(self.extends)
@@ -76,16 +271,33 @@ class File:
             count += msg.count_extends()
         return count
 
+    def has_inline_messages(self):
+        return any(msg.has_inline_messages() for _, msg in self.messages.items())
+
     def generate_header(self, fname):
         file = open_file(fname)
 
         writeln(file, "#pragma once\n")
         writeln(file, "#include <cstdint>")
+        writeln(file, "#include <iosfwd>")
         writeln(file, "#include <map>")
         writeln(file, "#include <memory>")
         writeln(file, "#include <string>")
+        writeln(file, "#if __cplusplus >= 201703L")
+        writeln(file, "#include <string_view>")
+        writeln(file, "#endif")
+        writeln(file, "#include <unordered_map>")
         writeln(file, "#include <vector>")
         writeln(file, "#include <infra.h>")
+        if args.views:
+            writeln(file, "#include <infra_view.h>")
+        if self.has_inline_messages():
+            # The Representations are in the header.
+            writeln(file, "#include <bitset>")
+            if args.table_driven:
+                writeln(file, "#include <infra_table.h>")
+            for _, file_ast in self.imports.items():
+                writeln(file, "#include <" + file_ast.cpp_include_path() + ">")
         writeln(file, "")
 
         # Generate and print forward type declarations bunched by their namespace
@@ -100,8 +312,18 @@ class File:
         extend_count = self.count_extends()
 
         # Messages.
+        emitted = {}
         for _, msg in self.messages.items():
-            msg.generate_header(file, self.namespace)
+            msg.generate_header(file, self.namespace, emitted)
+
+        # Views
+        if args.views and len(self.messages) > 0:
+            writeln(file, "// Views")
+            for _, msg in self.messages.items():
+                msg.generate_view_forward_declarations(file)
+            writeln(file, "")
+            for _, msg in self.messages.items():
+                msg.generate_view_declaration(file)
 
         # Extension declarations
         if len(self.extends) > 0:
@@ -161,6 +383,8 @@ class File:
         file = open_file(fname)
 
         writeln(file, Templates.impl)
+        if args.table_driven:
+            writeln(file, "#include <infra_table.h>")
 
         # Include directives. At this point we need every generated type that comes from
         # every "import" statement.
@@ -181,6 +405,11 @@ class File:
         for _, enum in self.enums.items():
             enum.generate_definition(file)
 
+        # Views
+        if args.views:
+            for _, msg in self.messages.items():
+                msg.generate_view_definition(file)
+
         for ns in reversed(self.namespace.split(".")):
             writeln(file, "}  // " + ns)
 
@@ -222,6 +451,8 @@ class Enum:
         for id, value in self.values.items():
             writeln(file, self.decorate(value) + " = " + str(id) + ",", 1)
         writeln(file, "};")
+        writeln(file, "// The name of the value, or nullptr if unknown.")
+        writeln(file, "const char* EnumName(" + self.impl_cpp_type + ");")
         writeln(file, "std::ostream& operator<<(std::ostream&, " + self.impl_cpp_type + ");")
 
     def generate_shortcut_declarations(self, file, indent):
@@ -236,16 +467,18 @@ class Enum:
 
     def generate_definition(self, file):
         writeln(file, "// Enum: " + self.fq_name)
-        writeln(file, "std::ostream& operator<<(std::ostream& st, " + self.impl_cpp_type + " val) {")
+        writeln(file, "const char* EnumName(" + self.impl_cpp_type + " val) {")
         writeln(file, "switch (val) {", 1)
         for id, value in self.values.items():
             writeln(file, "case " + self.cpp_value_prefix() + value + ': // [' + str(id) + ']' , 1)
-            writeln(file, 'st << "' + value + '";', 2)
-            writeln(file, 'break;', 2)
-        writeln(file, "default:", 1)
-        writeln(file, 'st << "<unrecignized>";', 2)
+            writeln(file, 'return "' + value + '";', 2)
         writeln(file, "}", 1)
-        writeln(file, "return st;", 1)
+        writeln(file, "return nullptr;", 1)
+        writeln(file, "}")
+        writeln(file, "std::ostream& operator<<(std::ostream& st, " + self.impl_cpp_type + " val) {")
+        writeln(file, "if (const char* name = EnumName(val))", 1)
+        writeln(file, "return st << name;", 2)
+        writeln(file, "return st << static_cast<int>(val);", 1)
         writeln(file, "}")
         writeln(file, "")
 
@@ -268,7 +501,13 @@ class Message:
     def __init__(self, *args, **kwargs):
         super(Message, self).__init__(*args, **kwargs)
 
-    def generate_header(self, file, ns, indent = 0):
+    # 'emitted' maps the fq names of the messages started so far to whether their classes
+    # are complete.
+    def generate_header(self, file, ns, emitted, indent = 0):
+        if self.fq_name in emitted:
+            return
+        emitted[self.fq_name] = False
+
         forwards = self.generate_forward_declarations(file)
         if forwards > 0:
             writeln(file, "")
@@ -281,6 +520,9 @@ class Message:
         if len(self.enums) > 0:
             writeln(file, "")
 
+        if self.is_inline():
+            self.generate_header_dependencies(file, ns, emitted)
+
         # Start the C++ class.
         writeln(file, "class " + self.impl_cpp_type + " {", indent)
         writeln(file, "public:", indent)
@@ -290,14 +532,35 @@ class Message:
         writeln(file, self.impl_cpp_type + "();", indent + 1)
         writeln(file, self.impl_cpp_type + "(const " + self.impl_cpp_type + "&);",
                 indent + 1)
-        writeln(file, self.impl_cpp_type + "(" + self.impl_cpp_type + "&&);",
-                indent + 1)
+        if args.pmr:
+            # Allocator-aware: the containers pass their allocators to the messages in them.
+            writeln(file, "using allocator_type = ::proto_ng::Allocator;", indent + 1)
+            writeln(file, "explicit " + self.impl_cpp_type + "(const allocator_type&);",
+                    indent + 1)
+            writeln(file,
+                    self.impl_cpp_type + "(const " + self.impl_cpp_type +
+                        "&, const allocator_type&);",
+                    indent + 1)
+            writeln(file, self.impl_cpp_type + "(" + self.impl_cpp_type + "&&) noexcept;",
+                    indent + 1)
+            writeln(file,
+                    self.impl_cpp_type + "(" + self.impl_cpp_type + "&&, const allocator_type&);",
+                    indent + 1)
+            writeln(file, "allocator_type get_allocator() const;", indent + 1)
+        else:
+            writeln(file, self.impl_cpp_type + "(" + self.impl_cpp_type + "&&) noexcept;",
+                    indent + 1)
         writeln(file, self.impl_cpp_type + "& " + "operator=(const " + \
             self.impl_cpp_type + "&);",
             indent + 1)
-        writeln(file, self.impl_cpp_type + "& " + "operator=(" + \
-            self.impl_cpp_type + "&&);",
-            indent + 1)
+        if args.pmr:
+            writeln(file, self.impl_cpp_type + "& " + "operator=(" + \
+                self.impl_cpp_type + "&&);",
+                indent + 1)
+        else:
+            writeln(file, self.impl_cpp_type + "& " + "operator=(" + \
+                self.impl_cpp_type + "&&) noexcept;",
+                indent + 1)
         writeln(file, "~" + self.impl_cpp_type + "();", indent + 1)
         writeln(file, "")
 
@@ -308,74 +571,95 @@ class Message:
                 indent + 1)
         writeln(file, "void Clear();", indent + 1)
         writeln(file, "bool ParseFromString(const std::string& input_data);", indent + 1)
+        writeln(file, "#if __cplusplus >= 201703L")
+        writeln(file, "bool ParseFromString(std::string_view input_data);", indent + 1)
+        writeln(file, "#endif")
+        writeln(file, "bool ParseFromArray(const char* data, size_t size);", indent + 1)
         writeln(file, "std::string SerializeAsString() const;", indent + 1)
-        writeln(file, 'std::string DebugString(std::string prefix = "") const;', indent + 1)
+        writeln(file, "bool SerializeToString(std::string* output) const;", indent + 1)
+        writeln(file, "bool SerializeToArray(char* data, size_t size) const;", indent + 1)
+        writeln(file, "bool AppendToString(std::string* output) const;", indent + 1)
+        writeln(file, "size_t ByteSizeLong() const;", indent + 1)
+        writeln(file, "std::string DebugString() const;", indent + 1)
         writeln(file, "std::string ShortDebugString() const;", indent + 1)
+        writeln(file,
+                "// Appends the text format, indented by 'depth' levels or on a single line.",
+                indent + 1)
+        writeln(file,
+                "void PrintDebugTo(std::string& out, int depth = 0, bool single_line = false) const;",
+                indent + 1)
+        writeln(file,
+                "void PrintDebugTo(std::ostream& out, int depth = 0, bool single_line = false) const;",
+                indent + 1)
         writeln(file, "")
 
-        # Equality
-        writeln(file, "// This type is Regular and totally ordered.", indent + 1)
-        writeln(file, "bool operator<(const " + self.impl_cpp_type + "&) const;", indent + 1)
-        writeln(file,
-                "friend bool operator>=(const " + self.impl_cpp_type + "& a, " +
-                    "const " + self.impl_cpp_type + "& b) { return !(a < b); }",
-                    indent + 1)
+        # Equality and ordering
         writeln(file,
-                "friend bool operator>(const " + self.impl_cpp_type + "& a, " +
-                    "const " + self.impl_cpp_type + "& b) { return b < a; }",
+                "// This type is Regular and totally ordered: Compare() returns <0, 0 or >0.",
+                indent + 1)
+        writeln(file, "int Compare(const " + self.impl_cpp_type + "&) const;", indent + 1)
+        writeln(file, "// Hashes all the fields, consistent with ==.", indent + 1)
+        if self.caches_hash():
+            writeln(file,
+                    "// Cached: every setter and mutable accessor call drops the cache, but the",
                     indent + 1)
-        writeln(file,
-                "friend bool operator<=(const " + self.impl_cpp_type + "& a, " +
-                    "const " + self.impl_cpp_type + "& b) { return !(b > a); }",
+            writeln(file,
+                    "// writes through a reference kept from before the last Hash() need",
                     indent + 1)
+            writeln(file, "// ClearCachedHash().", indent + 1)
+        writeln(file, "uint64_t Hash() const;", indent + 1)
+        if self.caches_hash():
+            writeln(file, "void ClearCachedHash();", indent + 1)
         writeln(file,
-                "friend bool operator==(const " + self.impl_cpp_type + "& a, " +
-                    "const " + self.impl_cpp_type + "& b) { return !(a > b) && !(a < b); }",
-                    indent + 1)
+                "friend bool operator==(const " + self.impl_cpp_type + "&, " +
+                    "const " + self.impl_cpp_type + "&);",
+                indent + 1)
         writeln(file,
                 "friend bool operator!=(const " + self.impl_cpp_type + "& a, " +
                     "const " + self.impl_cpp_type + "& b) { return !(a == b); }",
+                indent + 1)
+        for op in ["<", ">", "<=", ">="]:
+            writeln(file,
+                    "friend bool operator" + op + "(const " + self.impl_cpp_type + "& a, " +
+                        "const " + self.impl_cpp_type + "& b) { return a.Compare(b) " + op +
+                        " 0; }",
                     indent + 1)
         writeln(file, "")
 
         # Extension support
-        if self.min_extension_id:
+        if self.has_extensions():
+            helper = "typename ::proto_ng::detail::Helper<Extension>"
+            resolve = "::proto_ng::detail::ResolveField(ext)"
             writeln(file, "// Extension API (the base type's part)", indent + 1)
             writeln(file, "template<class Extension>", indent + 1)
             writeln(file, "bool HasExtension(Extension ext) const {", indent + 1)
-            writeln(file, "return _HasField(::proto_ng::detail::ResolveField(ext));", indent + 2)
+            writeln(file, "return _Extensions().Has(" + resolve + ");", indent + 2)
             writeln(file, "}", indent + 1)
 
             writeln(file, "template<class Extension>", indent + 1)
+            writeln(file, helper + "::ref GetExtension(Extension ext) const {", indent + 1)
+            writeln(file, "using Type = " + helper + "::type;", indent + 2)
             writeln(file,
-                    "typename ::proto_ng::detail::Helper<Extension>::mutable_ptr " +
-                        "MutableExtension(Extension ext) {",
-                    indent + 1)
-            writeln(file, "if (!HasExtension(ext)) return nullptr;", indent + 2)
-            writeln(file,
-                    "return reinterpret_cast<typename ::proto_ng::detail::Helper<Extension>::mutable_ptr>(",
+                    "const Type* value = _Extensions().template Get<Type>(" + resolve + ");",
                     indent + 2)
-            writeln(file, "_GetField(::proto_ng::detail::ResolveField(ext)));", indent + 3)
+            writeln(file, "return value ? *value : Type::default_instance();", indent + 2)
             writeln(file, "}", indent + 1)
 
             writeln(file, "template<class Extension>", indent + 1)
+            writeln(file, helper + "::mutable_ptr MutableExtension(Extension ext) {", indent + 1)
             writeln(file,
-                    "typename ::proto_ng::detail::Helper<Extension>::ref " +
-                        "GetExtension(Extension ext) const {",
-                    indent + 1)
-            writeln(file, "assert(HasExtension(ext));", indent + 2)
-            writeln(file,
-                    "auto ptr = reinterpret_cast<typename ::proto_ng::detail::Helper<Extension>::ptr>(",
+                    "return _MutableExtensions().template Mutable<" + helper + "::type>(" +
+                        resolve + ");",
                     indent + 2)
-            writeln(file, "_GetField(::proto_ng::detail::ResolveField(ext)));", indent + 3)
-            writeln(file,
-                    "return *ptr;", indent + 2)
+            writeln(file, "}", indent + 1)
 
+            writeln(file, "template<class Extension>", indent + 1)
+            writeln(file, "void ClearExtension(Extension ext) {", indent + 1)
+            writeln(file, "_MutableExtensions().Clear(" + resolve + ");", indent + 2)
             writeln(file, "}", indent + 1)
 
-            writeln(file, "bool _HasField(int id) const { return false; }", indent + 1)
-            writeln(file, "void* _GetField(int id) { return nullptr; }", indent + 1)
-            writeln(file, "const void* _GetField(int id) const { return nullptr; }", indent + 1)
+            writeln(file, "const ::proto_ng::ExtensionSet& _Extensions() const;", indent + 1)
+            writeln(file, "::proto_ng::ExtensionSet& _MutableExtensions();", indent + 1)
             writeln(file, "")
 
         # Extensions
@@ -398,16 +682,43 @@ class Message:
         for _, enum in self.enums.items():
             enum.generate_shortcut_declarations(file, 1)
 
+        # Oneofs
+        for _, oneof in self.oneofs.items():
+            oneof.generate_accessor_declarations(file, indent + 1)
+
         # Fields
         for id, field in self.fields.items():
             field.generate_accessor_declarations(file, indent + 1)
 
+        # Parsing support: merges the encoded message into this one, throws on malformed
+        # input.
+        writeln(file, "void _MergeFromArray(const char* data, size_t size);", indent + 1)
+        # Serialization support: encodes with the sizes cached by the last ByteSizeLong().
+        writeln(file, "size_t _CachedSize() const;", indent + 1)
+        writeln(file, "void _AppendTo(::proto_ng::ArrayWriter& output) const;", indent + 1)
+        # Debug output support: what both PrintDebugTo() overloads print with.
+        writeln(file,
+                "void _PrintDebugTo(::proto_ng::debug::Output& out, int depth, " +
+                    "bool single_line) const;",
+                indent + 1)
+        if args.table_driven:
+            writeln(file, "static const ::proto_ng::table::Message _table;", indent + 1)
+        writeln(file, "")
+
         # Implementation
         writeln(file, " private:", indent)
-        writeln(file, "struct Representation;", indent + 1)
-        writeln(file, "std::unique_ptr<Representation> rep_;", indent + 1)
+        if self.is_inline():
+            self.generate_representation(file, "Representation", indent + 1)
+            writeln(file, "::proto_ng::Inline<Representation> rep_;", indent + 1)
+        elif args.pmr:
+            writeln(file, "struct Representation;", indent + 1)
+            writeln(file, "::proto_ng::ResourcePtr<Representation> rep_;", indent + 1)
+        else:
+            writeln(file, "struct Representation;", indent + 1)
+            writeln(file, "std::unique_ptr<Representation> rep_;", indent + 1)
 
         writeln(file, "};\n", indent)
+        emitted[self.fq_name] = True
 
         # Sub-messages
         #
@@ -415,7 +726,64 @@ class Message:
         # allow forward declarations Outer::Inner. So, just pre-order DFS to flatten out
         # the tree.
         for _, sub_msg in self.messages.items():
-            sub_msg.generate_header(file, ns)
+            sub_msg.generate_header(file, ns, emitted)
+
+    # An inline Representation needs the enums and the (singular) message types of its
+    # fields to be complete, so the ones from this file go first. The containers are fine
+    # with incomplete types and the imported types come from the included headers.
+    def generate_header_dependencies(self, file, ns, emitted):
+        for _, field in self.fields.items():
+            if field.is_builtin or field.is_map:
+                continue
+            dependency = field.resolved_type
+            if field.is_enum:
+                # Emitted along with its message, ahead of the class.
+                dependency = dependency.parent
+            elif field.is_container():
+                continue
+            if not isinstance(dependency, Message) or \
+                    dependency.containing_file() is not self.containing_file():
+                continue
+
+            if dependency.fq_name not in emitted:
+                dependency.generate_header(file, ns, emitted)
+            elif not emitted[dependency.fq_name] and not field.is_enum:
+                sys.exit("Error: the inline " + self.fq_name + " cannot hold field \"" +
+                         field.name + "\" of type " + dependency.fq_name +
+                         " by value, as the latter depends on " + self.fq_name + ".")
+
+    def containing_file(self):
+        node = self.parent
+        while not isinstance(node, File):
+            node = node.parent
+        return node
+
+    # Inline messages ("--inline-representation" or an "inline" message or file option)
+    # hold their fields in the object itself: no allocation per message and no pointer to
+    # chase, at the price of a bigger object and of a header that needs the field types.
+    # "--pmr" messages keep their memory resource in the pointer, so the option is ignored.
+    def is_inline(self):
+        if args.inline_representation:
+            return True
+        if args.pmr:
+            return False
+        for node in [self, self.containing_file()]:
+            for option in node.options:
+                if option.name.find("inline") >= 0:
+                    return option.value != "false"
+        return False
+
+    # The "cache_hash" option keeps the result of Hash() in the Representation.
+    def caches_hash(self):
+        for option in self.options:
+            if option.name.find("cache_hash") >= 0:
+                return option.value != "false"
+        return False
+
+    # Every setter and mutable accessor drops the cached hash.
+    def generate_hash_reset(self, file, indent):
+        if self.caches_hash():
+            writeln(file, "rep_->_hash.store(0);", indent)
 
     def generate_hasher(self, file, indent = 0):
         with_hashing = False
@@ -480,6 +848,240 @@ class Message:
         writeln(file, "}  // std", indent)
         writeln(file, "")
 
+    def generate_parser(self, file):
+        writeln(file,
+                "bool " + self.impl_cpp_type + "::ParseFromString(const std::string& input_data) {")
+        writeln(file, "return ParseFromArray(input_data.data(), input_data.size());", 1)
+        writeln(file, "}")
+        writeln(file, "#if __cplusplus >= 201703L")
+        writeln(file,
+                "bool " + self.impl_cpp_type + "::ParseFromString(std::string_view input_data) {")
+        writeln(file, "return ParseFromArray(input_data.data(), input_data.size());", 1)
+        writeln(file, "}")
+        writeln(file, "#endif")
+        writeln(file,
+                "bool " + self.impl_cpp_type + "::ParseFromArray(const char* data, size_t size) {")
+        writeln(file, "Clear();", 1)
+        writeln(file, "try {", 1)
+        writeln(file, "_MergeFromArray(data, size);", 2)
+        writeln(file, "} catch (const protozero::exception&) {", 1)
+        writeln(file, "return false;", 2)
+        writeln(file, "}", 1)
+        writeln(file, "return true;", 1)
+        writeln(file, "}")
+        writeln(file, "")
+
+        writeln(file,
+                "void " + self.impl_cpp_type + "::_MergeFromArray(const char* data, size_t size) {")
+        if args.table_driven:
+            writeln(file, "::proto_ng::table::Merge(_table, rep_.get(), data, size);", 1)
+            writeln(file, "}")
+            writeln(file, "")
+            return
+        self.generate_hash_reset(file, 1)
+        writeln(file, "protozero::pbf_reader reader(data, size);", 1)
+        writeln(file, "while (reader.next()) {", 1)
+        writeln(file, "switch (FieldKey(reader)) {", 2)
+        for _, field in self.fields.items():
+            field.generate_parse_case(file, 2)
+        writeln(file, "default:", 2)
+        if self.has_extensions():
+            # Only the sub-message extensions are kept.
+            writeln(file,
+                    "if (reader.wire_type() == WireType::length_delimited && (" +
+                        self.extension_test("reader.tag()") + ")) {",
+                    3)
+            writeln(file, "auto view = reader.get_view();", 4)
+            writeln(file,
+                    "rep_->_extensions.Merge(reader.tag(), view.data(), view.size());", 4)
+            writeln(file, "} else {", 3)
+            writeln(file, "reader.skip();", 4)
+            writeln(file, "}", 3)
+        else:
+            writeln(file, "reader.skip();", 3)
+        writeln(file, "}", 2)
+        writeln(file, "}", 1)
+        writeln(file, "}")
+        writeln(file, "")
+
+    def generate_serializer(self, file):
+        fields = [self.fields[id] for id in sorted(self.fields.keys())]
+
+        # The size pass caches the size of every message on the way.
+        writeln(file, "size_t " + self.impl_cpp_type + "::ByteSizeLong() const {")
+        if args.table_driven:
+            writeln(file, "return ::proto_ng::table::ByteSize(_table, rep_.get());", 1)
+        else:
+            writeln(file, "size_t size = 0;", 1)
+            for field in fields:
+                field.generate_size(file, 1)
+            if self.has_extensions():
+                writeln(file, "size += rep_->_extensions.ByteSize();", 1)
+            writeln(file, "rep_->_cached_size.store(size);", 1)
+            writeln(file, "return size;", 1)
+        writeln(file, "}")
+        writeln(file, "size_t " + self.impl_cpp_type + "::_CachedSize() const {")
+        writeln(file, "return rep_->_cached_size.load();", 1)
+        writeln(file, "}")
+        writeln(file, "")
+
+        writeln(file,
+                "void " + self.impl_cpp_type + "::_AppendTo(::proto_ng::ArrayWriter& output) const {")
+        if args.table_driven:
+            writeln(file, "::proto_ng::table::Encode(_table, rep_.get(), output);", 1)
+        else:
+            for field in fields:
+                field.generate_encode(file, 1)
+            if self.has_extensions():
+                writeln(file, "rep_->_extensions.Encode(output);", 1)
+        writeln(file, "}")
+        writeln(file, "")
+
+        writeln(file, "std::string " + self.impl_cpp_type + "::SerializeAsString() const {")
+        writeln(file, "std::string output;", 1)
+        writeln(file, "AppendToString(&output);", 1)
+        writeln(file, "return output;", 1)
+        writeln(file, "}")
+        writeln(file,
+                "bool " + self.impl_cpp_type + "::SerializeToString(std::string* output) const {")
+        writeln(file, "output->clear();", 1)
+        writeln(file, "return AppendToString(output);", 1)
+        writeln(file, "}")
+        writeln(file,
+                "bool " + self.impl_cpp_type + "::AppendToString(std::string* output) const {")
+        writeln(file, "const size_t size = output->size();", 1)
+        writeln(file, "output->resize(size + ByteSizeLong());", 1)
+        writeln(file, "::proto_ng::ArrayWriter writer(&(*output)[0] + size);", 1)
+        writeln(file, "_AppendTo(writer);", 1)
+        writeln(file, "return true;", 1)
+        writeln(file, "}")
+        writeln(file,
+                "bool " + self.impl_cpp_type + "::SerializeToArray(char* data, size_t size) const {")
+        writeln(file, "if (ByteSizeLong() > size)", 1)
+        writeln(file, "return false;", 2)
+        writeln(file, "::proto_ng::ArrayWriter writer(data);", 1)
+        writeln(file, "_AppendTo(writer);", 1)
+        writeln(file, "return true;", 1)
+        writeln(file, "}")
+        writeln(file, "")
+
+    # Maps the ids of the fields with presence to dense bit indices, so that sparse or
+    # high (e.g. extension range) ids cost no more than low ones.
+    def presence_slots(self):
+        slots = {}
+        for id in sorted(self.fields.keys()):
+            if self.fields[id].has_presence():
+                slots[id] = len(slots)
+        return slots
+
+    # Clears the fields in place, keeping the capacity of the strings and containers (and
+    # the cold part), so that reusing a message for similar input allocates nothing.
+    def generate_clear(self, file):
+        self.generate_hash_reset(file, 1)
+        cold_fields = []
+        for id in sorted(self.fields.keys()):
+            field = self.fields[id]
+            if field.is_cold():
+                cold_fields.append(field)
+            elif field.oneof:
+                if field.oneof_index() == 1:
+                    writeln(file, field.oneof.member() + ".reset();", 1)
+            else:
+                field.generate_clear(file, 1, "rep_->" + field.name)
+        if len(cold_fields) > 0:
+            writeln(file, "if (rep_->_cold.has_value()) {", 1)
+            writeln(file, "Representation::Cold& cold = rep_->_cold.mutable_value();", 2)
+            for field in cold_fields:
+                field.generate_clear(file, 2, "cold." + field.name)
+            writeln(file, "}", 1)
+        if self.has_extensions():
+            writeln(file, "rep_->_extensions.Clear();", 1)
+        if len(self.presence_slots()) > 0:
+            writeln(file, "rep_->_Presence.reset();", 1)
+
+    # The field table that drives the "--table-driven" code.
+    def generate_table(self, file):
+        if self.has_extensions():
+            writeln(file,
+                    "const uint32_t " + self.impl_cpp_type +
+                        "::Representation::_extension_ranges[] = {")
+            for first, last in self.extension_ranges:
+                writeln(file, str(first) + ", " + str(last) + ",", 1)
+            writeln(file, "};")
+        if len(self.fields) > 0:
+            writeln(file,
+                    "const ::proto_ng::table::Field " + self.impl_cpp_type +
+                        "::Representation::_fields[] = {")
+            for id in sorted(self.fields.keys()):
+                self.fields[id].generate_table_entry(file, 1)
+            writeln(file, "};")
+        writeln(file,
+                "const ::proto_ng::table::Message " + self.impl_cpp_type + "::_table = {")
+        if len(self.fields) > 0:
+            writeln(file,
+                    "Representation::_fields, " + str(len(self.fields)) + ",", 1)
+        else:
+            writeln(file, "nullptr, 0,", 1)
+        writeln(file,
+                "offsetof(Representation, _Presence), sizeof(Representation::_Presence),", 1)
+        hash_offset = "::proto_ng::table::kNoHash"
+        if self.caches_hash():
+            hash_offset = "offsetof(Representation, _hash)"
+        writeln(file, "offsetof(Representation, _cached_size), " + hash_offset + ",", 1)
+        if self.has_extensions():
+            writeln(file,
+                    "offsetof(Representation, _extensions), Representation::_extension_ranges, " +
+                        str(len(self.extension_ranges)) + ",",
+                    1)
+            writeln(file, "&::proto_ng::ExtensionRegistry::Of<" + self.impl_cpp_type + ">,", 1)
+        else:
+            writeln(file, "::proto_ng::table::kNoExtensions, nullptr, 0, nullptr,", 1)
+        writeln(file, "&Representation::Rep", 1)
+        writeln(file, "};")
+        writeln(file, "")
+
+    def generate_view_forward_declarations(self, file):
+        writeln(file, "class " + self.impl_cpp_type + "View;")
+        for _, sub_msg in self.messages.items():
+            sub_msg.generate_view_forward_declarations(file)
+
+    # Views decode fields on demand straight from a serialized message (which must outlive
+    # them), so inspecting a message neither copies nor allocates. Malformed data makes the
+    # accessors throw protozero exceptions.
+    def generate_view_declaration(self, file):
+        view = self.impl_cpp_type + "View"
+        writeln(file, "// Read-only view of a serialized " + self.fq_name)
+        writeln(file, "class " + view + " {")
+        writeln(file, "public:")
+        writeln(file, view + "() = default;", 1)
+        writeln(file, view + "(const char* data, size_t size) : data_(data, size) {}", 1)
+        writeln(file, "explicit " + view + "(protozero::data_view data) : data_(data) {}", 1)
+        writeln(file,
+                "explicit " + view + "(const std::string& data) : data_(data.data(), data.size()) {}",
+                1)
+        writeln(file, "")
+        writeln(file, "protozero::data_view data() const { return data_; }", 1)
+        writeln(file, "")
+
+        for _, field in self.fields.items():
+            field.generate_view_accessor_declarations(file, 1)
+
+        writeln(file, " private:")
+        writeln(file, "protozero::data_view data_;", 1)
+        writeln(file, "};")
+        writeln(file, "")
+
+        for _, sub_msg in self.messages.items():
+            sub_msg.generate_view_declaration(file)
+
+    def generate_view_definition(self, file):
+        writeln(file, "// " + self.fq_name + " view")
+        for _, field in self.fields.items():
+            field.generate_view_accessor_definitions(file)
+
+        for _, sub_msg in self.messages.items():
+            sub_msg.generate_view_definition(file)
+
     def generate_forward_declarations(self, file):
         # Forward declarations for sub-messages and enums.
         forwards = 0
@@ -489,7 +1091,7 @@ class Message:
 
         # Forward declarations for the implicitly declared (forward-declared) local messages.
         for _, field in self.fields.items():
-            if field.is_forward_decl:
+            if field.is_forward_decl and not field.is_enum:
                 writeln(file, "class " + "_".join(field.raw_type.split(".")) + ";")
                 forwards += 1
 
@@ -503,6 +1105,8 @@ class Message:
         assert(self.impl_cpp_type)
         if self.fq_name in imported_set:
             decl_set.add("class " + self.impl_cpp_type.split("::")[-1] + ";")
+            if args.views:
+                decl_set.add("class " + self.impl_cpp_type.split("::")[-1] + "View;")
 
         for _, enum in self.enums.items():
             enum.generate_forward_declaration(imported_set, decl_set)
@@ -517,6 +1121,24 @@ class Message:
             count += msg.count_extends()
         return count
 
+    # The messages with "extensions" ranges hold an ExtensionSet.
+    def has_extensions(self):
+        return len(self.extension_ranges) > 0
+
+    # The C++ condition of the field id 'id' being in an extension range.
+    def extension_test(self, id):
+        tests = []
+        for first, last in self.extension_ranges:
+            if last == (1 << 29) - 1:
+                tests.append(id + " >= " + str(first))
+            else:
+                tests.append("(" + id + " >= " + str(first) + " && " + id + " <= " + str(last) + ")")
+        return " || ".join(tests)
+
+    def has_inline_messages(self):
+        return self.is_inline() or \
+            any(msg.has_inline_messages() for _, msg in self.messages.items())
+
     def generate_extend_declarations(self, file, indent):
         assert(self.is_extend)
 
@@ -546,39 +1168,45 @@ class Message:
     def generate_extend_definition(self, file):
         if self.is_extend:
             for id, field in self.fields.items():
+                # The sub-message ones register with the extended type, for its Compare().
+                initializer = str(id)
+                if isinstance(field.resolved_type, Message) and self.base_type.has_extensions():
+                    initializer = "::proto_ng::ExtensionRegistry::Of<::" + \
+                        self.base_type.fq_cpp_ref() + ">().Add(" + initializer + \
+                        ", ::proto_ng::ExtensionOps<::" + field.resolved_type.fq_cpp_ref() + ">::ops)"
                 writeln(file,
                         "const ::" + field.parent.cpp_extend_namespace() + "::" + field.name + "_t " +
                             field.parent.cpp_extend_namespace() + "::" +
-                            field.name + "{" + str(id) + "};")
+                            field.name + "{" + initializer + "};")
 
         for _, extend in self.extends.items():
             extend.generate_extend_definition(file)
         for _, msg in self.messages.items():
             msg.generate_extend_definition(file)
 
-    def generate_source(self, file, ns):
-        # Implementation
-        writeln(file, "//")
-        writeln(file, "// " + self.fq_name)
-        writeln(file, "//")
-        writeln(file, "struct " + self.impl_cpp_type + "::Representation {")
-        for id, field in self.fields.items():
-            field.generate_implementation_definition(file)
-        writeln(file, "")
-        if len(self.fields) > 0:
+    def generate_constructors(self, file):
+        if self.is_inline():
+            # The fields are members, so everything is member-wise.
+            cpp_type = self.impl_cpp_type
+            writeln(file, cpp_type + "::" + cpp_type + "() = default;")
+            writeln(file, cpp_type + "::" + cpp_type + "(const " + cpp_type + "&) = default;")
+            writeln(file, cpp_type + "::" + cpp_type + "(" + cpp_type + "&&) noexcept = default;")
             writeln(file,
-                    "std::bitset<" + str(sorted(self.fields.keys())[-1] + 1) + "> _Presence;",
-                    1)
-        writeln(file, "};\n")
+                    cpp_type + "& " + cpp_type + "::operator=(const " + cpp_type + "&) = default;")
+            writeln(file,
+                    cpp_type + "& " + cpp_type + "::operator=(" + cpp_type +
+                        "&&) noexcept = default;")
+            writeln(file, cpp_type + "::~" + cpp_type + "() = default;")
+            writeln(file, "")
+            return
 
-        # Construction, copying and assigment
         writeln(file, self.impl_cpp_type + "::" + self.impl_cpp_type +
                 "() : rep_(std::make_unique<Representation>()) {}")
         writeln(file,
                 self.impl_cpp_type + "::" + self.impl_cpp_type +
                     "(const " + self.impl_cpp_type + "& arg) : rep_(new Representation(*arg.rep_)) {}")
         writeln(file, self.impl_cpp_type + "::" + self.impl_cpp_type +
-                "(" + self.impl_cpp_type + "&&) = default;")
+                "(" + self.impl_cpp_type + "&&) noexcept = default;")
         writeln(file,
                 self.impl_cpp_type + "& " + self.impl_cpp_type + "::operator=(" +
                     "const " + self.impl_cpp_type + "& arg) { ")
@@ -586,43 +1214,343 @@ class Message:
         writeln(file, "return *this;", 1)
         writeln(file, "}")
         writeln(file, self.impl_cpp_type + "& " + self.impl_cpp_type + "::operator=(" +
-                self.impl_cpp_type + "&&) = default;")
+                self.impl_cpp_type + "&&) noexcept = default;")
         writeln(file, self.impl_cpp_type + "::~" + self.impl_cpp_type + "() = default;")
         writeln(file, "")
 
+    # "--pmr": the Representation comes from the allocator's memory resource, so do the
+    # fields' allocations. Moves between different resources copy.
+    def generate_allocator_aware_constructors(self, file):
+        cpp_type = self.impl_cpp_type
+        writeln(file, cpp_type + "::" + cpp_type + "() : " + cpp_type + "(allocator_type()) {}")
+        writeln(file, cpp_type + "::" + cpp_type + "(const allocator_type& allocator)")
+        writeln(file, ": rep_(::proto_ng::MakeResourcePtr<Representation>(allocator)) {}", 2)
+        writeln(file,
+                cpp_type + "::" + cpp_type + "(const " + cpp_type + "& arg) : " + cpp_type +
+                    "(arg, allocator_type()) {}")
+        writeln(file,
+                cpp_type + "::" + cpp_type + "(const " + cpp_type +
+                    "& arg, const allocator_type& allocator)")
+        writeln(file,
+                ": rep_(::proto_ng::MakeResourcePtr<Representation>(allocator, *arg.rep_)) {}",
+                2)
+        writeln(file, cpp_type + "::" + cpp_type + "(" + cpp_type + "&&) noexcept = default;")
+        writeln(file,
+                cpp_type + "::" + cpp_type + "(" + cpp_type +
+                    "&& arg, const allocator_type& allocator)")
+        writeln(file, ": rep_(arg.get_allocator() == allocator ? std::move(arg.rep_) :", 2)
+        writeln(file,
+                "::proto_ng::MakeResourcePtr<Representation>(allocator, *arg.rep_)) {}",
+                3)
+        writeln(file, cpp_type + "& " + cpp_type + "::operator=(const " + cpp_type + "& arg) {")
+        writeln(file, "if (this != &arg) *rep_ = *arg.rep_;", 1)
+        writeln(file, "return *this;", 1)
+        writeln(file, "}")
+        writeln(file, cpp_type + "& " + cpp_type + "::operator=(" + cpp_type + "&& arg) {")
+        writeln(file, "if (get_allocator() == arg.get_allocator())", 1)
+        writeln(file, "rep_.swap(arg.rep_);", 2)
+        writeln(file, "else", 1)
+        writeln(file, "*rep_ = *arg.rep_;", 2)
+        writeln(file, "return *this;", 1)
+        writeln(file, "}")
+        writeln(file, cpp_type + "::~" + cpp_type + "() = default;")
+        writeln(file, cpp_type + "::allocator_type " + cpp_type + "::get_allocator() const {")
+        writeln(file, "return rep_.get_deleter().resource;", 1)
+        writeln(file, "}")
+        writeln(file, "")
+
+    # The members of the Representation, in their order: [(name, declaration)]. The hot
+    # fields and the bookkeeping go first, then the cold ones; each group is ordered by
+    # layout_ranks and then by field id.
+    #
+    # With 'cold', the members of the struct of the cold fields.
+    def layout(self, cold = False):
+        fields = [f for _, f in self.fields.items() if f.is_cold() == cold]
+        has_hot_fields = any(field.is_hot() for field in fields)
+        members = []
+        if not cold:
+            members.append((0, layout_ranks["pointer"], 0, "_cached_size",
+                            "::proto_ng::Cached<size_t> _cached_size;"))
+            if self.caches_hash():
+                members.append((0, layout_ranks["8-byte"], 0, "_hash",
+                                "::proto_ng::Cached<uint64_t> _hash;"))
+            slot_count = len(self.presence_slots())
+            if args.table_driven:
+                # The engine needs to know the layout of the presence bits.
+                members.append((0, layout_ranks["4-byte"], 0, "_Presence",
+                                "::proto_ng::table::Presence<" + str(max(slot_count, 1)) +
+                                    "> _Presence;"))
+            elif slot_count > 0:
+                members.append((0, layout_ranks["presence"], 0, "_Presence",
+                                "std::bitset<" + str(slot_count) + "> _Presence;"))
+            if self.has_cold_fields():
+                members.append((1 if has_hot_fields else 0, layout_ranks["pointer"], 0, "_cold",
+                                "::proto_ng::ColdPtr<Cold> _cold;"))
+            if self.has_extensions():
+                members.append((1 if has_hot_fields else 0, layout_ranks["pointer"],
+                                self.extension_ranges[0][0], "_extensions",
+                                "::proto_ng::ExtensionSet _extensions;"))
+
+        for field in fields:
+            group = 0 if field.is_hot() or not has_hot_fields else 1
+            for rank, name, decl in field.representation_members():
+                members.append((group, rank, field.id, name, decl))
+        if not cold:
+            for _, oneof in self.oneofs.items():
+                group = 0 if oneof.is_hot() or not has_hot_fields else 1
+                members.append((group, oneof.layout_rank(), oneof.fields_by_id()[0].id,
+                                oneof.member_name(), oneof.cpp_type() + " " +
+                                    oneof.member_name() + ";"))
+        return [(name, decl) for _, _, _, name, decl in sorted(members, key=lambda m: m[0:3])]
+
+    def has_cold_fields(self):
+        return any(field.is_cold() for _, field in self.fields.items())
+
+    # Checks that the layout has no avoidable padding: none but before the cold fields and
+    # at the end.
+    def generate_layout_assert(self, file, indent):
+        fields = [f for _, f in self.fields.items() if not f.is_cold()]
+        groups = 1
+        if any(f.is_hot() for f in fields) and (not all(f.is_hot() for f in fields) or
+                                                 self.has_cold_fields()):
+            groups = 2
+        sizes = ["sizeof(Representation::" + name + ")" for name, _ in self.layout()]
+        writeln(file, "// No avoidable padding between the fields.", indent)
+        writeln(file, "static_assert(sizeof(Representation) <=", indent)
+        for i in range(0, len(sizes), 2):
+            writeln(file, " + ".join(sizes[i:i + 2]) + " +", indent + 2)
+        writeln(file, str(groups) + " * (alignof(Representation) - 1),", indent + 2)
+        writeln(file, '"Unexpected padding in ' + self.impl_cpp_type + '::Representation");',
+                indent + 2)
+
+    # The struct that holds the fields: in the .cc or, for the inline messages, in the class.
+    def generate_representation(self, file, name, indent):
+        writeln(file, "struct " + name + " {", indent)
+        if args.pmr:
+            self.generate_representation_constructors(file)
+        if self.has_cold_fields():
+            writeln(file, "struct Cold {", indent + 1)
+            for _, decl in self.layout(cold=True):
+                writeln(file, decl, indent + 2)
+            writeln(file, "};", indent + 1)
+            writeln(file, "")
+        for _, decl in self.layout():
+            writeln(file, decl, indent + 1)
+        if args.table_driven:
+            writeln(file, "")
+            writeln(file, "static void* Rep(const void* message) {", indent + 1)
+            writeln(file,
+                    "return static_cast<const " + self.impl_cpp_type + "*>(message)->rep_.get();",
+                    indent + 2)
+            writeln(file, "}", indent + 1)
+            if len(self.fields) > 0:
+                writeln(file, "static const ::proto_ng::table::Field _fields[];", indent + 1)
+            if self.has_extensions():
+                writeln(file, "static const uint32_t _extension_ranges[];", indent + 1)
+        writeln(file, "};\n", indent)
+
+    # The fields take the allocator, the copies keep theirs.
+    def generate_representation_constructors(self, file):
+        writeln(file, "using allocator_type = ::proto_ng::Allocator;", 1)
+        allocator_aware = set()
+        for _, field in self.fields.items():
+            if field.is_allocator_aware():
+                allocator_aware.add(field.name)
+        for _, oneof in self.oneofs.items():
+            allocator_aware.add(oneof.member_name())
+        members = [name for name, _ in self.layout() if name in allocator_aware]
+        if len(members) > 0:
+            writeln(file, "explicit Representation(const allocator_type& allocator)", 1)
+            for i, member in enumerate(members):
+                line = (": " if i == 0 else "  ") + member + "(allocator)"
+                writeln(file, line + ("," if i + 1 < len(members) else " {}"), 2)
+        else:
+            writeln(file, "explicit Representation(const allocator_type&) {}", 1)
+        writeln(file,
+                "Representation(const Representation& arg, const allocator_type& allocator)", 1)
+        writeln(file, ": Representation(allocator) {", 2)
+        writeln(file, "*this = arg;", 2)
+        writeln(file, "}", 1)
+        writeln(file, "")
+
+    def generate_source(self, file, ns):
+        # Implementation
+        writeln(file, "//")
+        writeln(file, "// " + self.fq_name)
+        writeln(file, "//")
+        if not self.is_inline():
+            self.generate_representation(file, self.impl_cpp_type + "::Representation", 0)
+        if args.table_driven:
+            self.generate_table(file)
+
+        # Construction, copying and assigment
+        if args.pmr:
+            self.generate_allocator_aware_constructors(file)
+        else:
+            self.generate_constructors(file)
+
         writeln(file, "const " + self.impl_cpp_type + "& " + self.impl_cpp_type + "::default_instance() {")
+        self.generate_layout_assert(file, 1)
         writeln(file, "static " + self.impl_cpp_type + " obj;", 1)
         writeln(file, "return obj;", 1)
         writeln(file, "}")
         writeln(file, "")
 
         writeln(file, "void " + self.impl_cpp_type + "::Clear() {")
-        writeln(file, "*this = default_instance();", 1)
-        writeln(file, "rep_->_Presence.reset();", 1)
+        if args.table_driven:
+            writeln(file, "::proto_ng::table::Clear(_table, rep_.get());", 1)
+        else:
+            self.generate_clear(file)
         writeln(file, "}")
         writeln(file, "")
 
-        # The key comparison operator on which Regular semantics are built
+        self.generate_parser(file)
+        self.generate_serializer(file)
+
+        if args.table_driven:
+            writeln(file,
+                    "int " + self.impl_cpp_type + "::Compare(const " + self.impl_cpp_type +
+                        "& arg) const {")
+            writeln(file,
+                    "return ::proto_ng::table::Compare(_table, rep_.get(), arg.rep_.get());", 1)
+            writeln(file, "}")
+            writeln(file,
+                    "bool operator==(const " + self.impl_cpp_type + "& a, const " +
+                        self.impl_cpp_type + "& b) {")
+            writeln(file, "return a.Compare(b) == 0;", 1)
+            writeln(file, "}")
+            writeln(file, "")
+
+            self.generate_hash(file)
+
+            self.generate_debug_string(file)
+            writeln(file,
+                    "void " + self.impl_cpp_type + "::_PrintDebugTo(" +
+                        "::proto_ng::debug::Output& out, int depth, bool single_line) const {")
+            writeln(file,
+                    "::proto_ng::table::Print(_table, rep_.get(), out, depth, single_line);", 1)
+            writeln(file, "}")
+            writeln(file, "")
+            self.generate_source_tail(file, ns)
+            return
+
+        # The three-way comparison on which the ordering is built: lexicographic, by id.
         writeln(file,
-                "bool " + self.impl_cpp_type + "::operator<(const " + self.impl_cpp_type +
+                "int " + self.impl_cpp_type + "::Compare(const " + self.impl_cpp_type +
                     "& arg) const {")
-        for _, field in self.fields.items():
-            field.generate_less_check(file, 1)
-        writeln(file, "return false;", 1)
+        for id in sorted(self.fields.keys()):
+            self.fields[id].generate_compare(file, 1)
+        if self.has_extensions():
+            writeln(file,
+                    "if (int rv = rep_->_extensions.Compare(arg.rep_->_extensions, " +
+                        "::proto_ng::ExtensionRegistry::Of<" + self.impl_cpp_type + ">()))",
+                    1)
+            writeln(file, "return rv;", 2)
+        writeln(file, "return 0;", 1)
         writeln(file, "}")
         writeln(file, "")
 
-        # Debug helper functions
+        # Equality stops at the first difference.
         writeln(file,
-                "std::string " + self.impl_cpp_type + "::DebugString(std::string prefix) const {")
-        writeln(file, "std::stringstream ss;", 1)
+                "bool operator==(const " + self.impl_cpp_type + "& a, const " +
+                    self.impl_cpp_type + "& b) {")
+        for id in sorted(self.fields.keys()):
+            self.fields[id].generate_equality_check(file, 1)
+        if self.has_extensions():
+            writeln(file,
+                    "if (a.rep_->_extensions.Compare(b.rep_->_extensions, " +
+                        "::proto_ng::ExtensionRegistry::Of<" + self.impl_cpp_type + ">()) != 0)",
+                    1)
+            writeln(file, "return false;", 2)
+        writeln(file, "return true;", 1)
+        writeln(file, "}")
         writeln(file, "")
+
+        self.generate_hash(file)
+
+        # Debug helper functions
+        self.generate_debug_string(file)
+        writeln(file,
+                "void " + self.impl_cpp_type + "::_PrintDebugTo(" +
+                    "::proto_ng::debug::Output& out, int depth, bool single_line) const {")
         for _, field in self.fields.items():
             field.generate_debug_output(file, 1)
-        writeln(file, "return ss.str();", 1)
+        if self.has_extensions():
+            writeln(file, "rep_->_extensions.Print(out, depth, single_line);", 1)
+        writeln(file, "}")
+        writeln(file, "")
+
+        self.generate_source_tail(file, ns)
+
+    # The wrappers around _PrintDebugTo().
+    def generate_debug_string(self, file):
+        writeln(file, "std::string " + self.impl_cpp_type + "::DebugString() const {")
+        writeln(file, "std::string out;", 1)
+        writeln(file, "PrintDebugTo(out);", 1)
+        writeln(file, "return out;", 1)
+        writeln(file, "}")
+        writeln(file, "")
+        writeln(file, "std::string " + self.impl_cpp_type + "::ShortDebugString() const {")
+        writeln(file, "std::string out;", 1)
+        writeln(file, "PrintDebugTo(out, 0, true);", 1)
+        writeln(file, "if (!out.empty())", 1)
+        writeln(file, "out.pop_back();  // the last separator", 2)
+        writeln(file, "return out;", 1)
+        writeln(file, "}")
+        writeln(file, "")
+        for stream in ["std::string", "std::ostream"]:
+            writeln(file,
+                    "void " + self.impl_cpp_type + "::PrintDebugTo(" + stream +
+                        "& out, int depth, bool single_line) const {")
+            writeln(file, "::proto_ng::debug::Output output(out);", 1)
+            writeln(file, "_PrintDebugTo(output, depth, single_line);", 1)
+            writeln(file, "}")
+            writeln(file, "")
+
+    # Folds every field, in id order, into the hash.
+    def generate_hash(self, file):
+        writeln(file, "uint64_t " + self.impl_cpp_type + "::Hash() const {")
+        if self.caches_hash():
+            writeln(file, "if (uint64_t hash = rep_->_hash.load())", 1)
+            writeln(file, "return hash;", 2)
+        if args.table_driven:
+            writeln(file, "uint64_t hash = ::proto_ng::table::Hash(_table, rep_.get());", 1)
+        else:
+            writeln(file, "uint64_t hash = 0;", 1)
+            for id in sorted(self.fields.keys()):
+                self.fields[id].generate_hash(file, 1)
+            if self.has_extensions():
+                writeln(file, "hash = rep_->_extensions.Hash(hash);", 1)
+        if self.caches_hash():
+            writeln(file, "rep_->_hash.store(hash);", 1)
+        writeln(file, "return hash;", 1)
         writeln(file, "}")
         writeln(file, "")
 
+        if self.caches_hash():
+            writeln(file, "void " + self.impl_cpp_type + "::ClearCachedHash() {")
+            self.generate_hash_reset(file, 1)
+            writeln(file, "}")
+            writeln(file, "")
+
+    # Accessors, enums and sub-messages.
+    def generate_source_tail(self, file, ns):
+        if self.has_extensions():
+            writeln(file,
+                    "const ::proto_ng::ExtensionSet& " + self.impl_cpp_type +
+                        "::_Extensions() const {")
+            writeln(file, "return rep_->_extensions;", 1)
+            writeln(file, "}")
+            writeln(file,
+                    "::proto_ng::ExtensionSet& " + self.impl_cpp_type + "::_MutableExtensions() {")
+            self.generate_hash_reset(file, 1)
+            writeln(file, "return rep_->_extensions;", 1)
+            writeln(file, "}")
+            writeln(file, "")
+
+        for _, oneof in self.oneofs.items():
+            oneof.generate_accessor_definitions(file)
+
         # Field accessors for the given message
         for id, field in self.fields.items():
             field.generate_accessor_definitions(file)
@@ -640,6 +1568,91 @@ class Message:
             sub_msg.generate_source(file, ns)
 
 
+#
+# Oneof
+#
+# The fields of a oneof share a single proto_ng::OneOf member: a union of their types
+# and the index of the set one. They have no presence bits and are never cold or lazy.
+#
+class Oneof:
+    def __init__(self, *args, **kwargs):
+        super(Oneof, self).__init__(*args, **kwargs)
+
+    def fields_by_id(self):
+        return sorted(self.fields, key=lambda field: field.id)
+
+    def member_name(self):
+        return "_" + self.name
+
+    def member(self, rep = "rep_"):
+        return rep + "->" + self.member_name()
+
+    def cpp_type(self):
+        return "::proto_ng::" + ("pmr::" if args.pmr else "") + "OneOf<" + \
+            ", ".join(field.cpp_type_ref() for field in self.fields_by_id()) + ">"
+
+    # Aligned as the widest field, and at least as the index.
+    def layout_rank(self):
+        return min(min(field.layout_rank() for field in self.fields), layout_ranks["4-byte"])
+
+    def is_hot(self):
+        return any(field.is_hot() for field in self.fields)
+
+    def case_enum(self):
+        return camel_case(self.name) + "Case"
+
+    def case_name(self, field):
+        return "k" + camel_case(field.name)
+
+    def generate_accessor_declarations(self, file, indent):
+        writeln(file, "// oneof " + self.name, indent)
+        writeln(file, "enum " + self.case_enum() + " : uint32_t {", indent)
+        for field in self.fields_by_id():
+            writeln(file, self.case_name(field) + " = " + str(field.id) + ",", indent + 1)
+        writeln(file, self.name.upper() + "_NOT_SET = 0,", indent + 1)
+        writeln(file, "};", indent)
+        writeln(file, self.case_enum() + " " + self.name + "_case() const;", indent)
+        writeln(file, "void clear_" + self.name + "();", indent)
+        writeln(file, "")
+
+    def generate_accessor_definitions(self, file):
+        impl = self.parent.impl_cpp_type
+        writeln(file, "// oneof " + self.name)
+        writeln(file,
+                impl + "::" + self.case_enum() + " " + impl + "::" + self.name + "_case() const {")
+        writeln(file, "static const " + self.case_enum() + " cases[] = {", 1)
+        writeln(file, self.name.upper() + "_NOT_SET,", 2)
+        for field in self.fields_by_id():
+            writeln(file, self.case_name(field) + ",", 2)
+        writeln(file, "};", 1)
+        writeln(file, "return cases[" + self.member() + ".index()];", 1)
+        writeln(file, "}")
+        writeln(file, "void " + impl + "::clear_" + self.name + "() {")
+        writeln(file, self.member() + ".reset();", 1)
+        self.parent.generate_hash_reset(file, 1)
+        writeln(file, "}")
+        writeln(file, "")
+
+    # These compare and hash which field is set, then its value.
+    def generate_compare(self, file, indent):
+        writeln(file, "// oneof " + self.name, indent)
+        writeln(file,
+                "if (int rv = CompareValues(" + self.member() + ", " + self.member("arg.rep_") +
+                    "))",
+                indent)
+        writeln(file, "return rv;", indent + 1)
+
+    def generate_hash(self, file, indent):
+        writeln(file, "// oneof " + self.name, indent)
+        writeln(file, "hash = HashValues(hash, " + self.member() + ");", indent)
+
+    def generate_equality_check(self, file, indent):
+        writeln(file, "// oneof " + self.name, indent)
+        writeln(file, "if (" + self.member("a.rep_") + " != " + self.member("b.rep_") + ")",
+                indent)
+        writeln(file, "return false;", indent + 1)
+
+
 #
 # Field
 #
@@ -651,12 +1664,40 @@ class Field:
     def cpp_type_ref(self):
         def repeated(type):
             if self.is_map:
-                return "std::map<" + type + ">"
+                container = self.map_container()
+                if container == "unordered":
+                    return std_ns() + "unordered_map<" + type + ">"
+                elif container == "flat":
+                    return "::proto_ng::" + ("pmr::" if args.pmr else "") + "FlatMap<" + \
+                        type + ">"
+                return std_ns() + "map<" + type + ">"
             elif self.is_repeated:
-                return "std::vector<" + type + ">"
+                return std_ns() + "vector<" + type + ">"
             return type
         return repeated(self.base_cpp_type_ref())
 
+    # The C++ container of a map field: "ordered" (std::map), "unordered" (std::unordered_map)
+    # or "flat" (proto_ng::FlatMap), as set by a "map_container" option of the field or, for
+    # all the maps in it, of the file.
+    def map_container(self):
+        assert(self.is_map)
+        value = None
+        for name, option_value in self.options.items():
+            if name.find("map_container") >= 0:
+                value = option_value
+        if value is None:
+            for option in self.parent.containing_file().options:
+                if option.name.find("map_container") >= 0:
+                    value = option.value
+        if value is None:
+            return "ordered"
+        value = value.strip('"').lower()
+        if value not in ["ordered", "unordered", "flat"]:
+            sys.exit("Error: unknown map_container '" + value + "' for " +
+                     self.parent.fq_name + "." + self.name +
+                     ", expected ORDERED, UNORDERED or FLAT")
+        return value
+
     # Returns the C++ type of the field disregarding the "repeated" tag's presence.
     def base_cpp_type_ref(self):
         if self.is_builtin:
@@ -675,6 +1716,76 @@ class Field:
         else:
             return self.resolved_type.impl_cpp_type
 
+    # Repeated scalars and enums may come packed: all the values in one length-delimited
+    # record.
+    def is_packable(self):
+        return self.is_repeated and not self.is_map and \
+            wire_format(self.raw_type, self.is_enum)[1] is not None
+
+    # Packed fields are also encoded so: the "packed" option or, in proto3 files, by default.
+    def is_packed(self):
+        if not self.is_packable():
+            return False
+        if "packed" in self.options:
+            return self.options["packed"] == "true"
+        syntax = self.parent.containing_file().syntax
+        return syntax is not None and syntax.syntax_id == "proto3"
+
+    # Lazy sub-messages ("--lazy-submessages" or a "lazy" option) keep their encoded bytes
+    # until first accessed, see proto_ng::Lazy.
+    def is_lazy(self):
+        if self.is_builtin or self.is_enum or self.is_map or self.oneof:
+            return False
+        if args.lazy_submessages:
+            return True
+        for name, value in self.options.items():
+            if name.find("lazy") >= 0:
+                return value != "false"
+        return False
+
+    # The singular string, bytes and wstring fields.
+    def is_string(self):
+        return self.is_builtin and not self.is_algebraic and not self.is_container()
+
+    def char_type(self):
+        return "wchar_t" if self.raw_type == "wstring" else "char"
+
+    def string_view_type(self):
+        return "std::wstring_view" if self.raw_type == "wstring" else "std::string_view"
+
+    # "--string-view-getters" trades the reference for a view.
+    def string_getter_type(self):
+        if args.string_view_getters:
+            return self.string_view_type()
+        return "const " + self.cpp_type_ref() + "&"
+
+    # The singular fields have presence bits. The containers are present when not empty,
+    # except for the lazy ones: their bits tell the pending bytes from the decoded values.
+    # The oneof fields are present when set in their oneof.
+    def has_presence(self):
+        return self.oneof is None and (not self.is_container() or self.is_lazy())
+
+    def presence_slot(self):
+        return self.parent.presence_slots()[self.id]
+
+    # The C++ condition of a singular field being present in 'rep'.
+    def presence_test(self, rep = "rep_"):
+        if self.oneof:
+            return self.oneof.member(rep) + ".index() == " + str(self.oneof_index())
+        return rep + "->_Presence.test(" + str(self.presence_slot()) + ")"
+
+    def generate_presence_set(self, file, indent):
+        if self.has_presence():
+            writeln(file, "rep_->_Presence.set(" + str(self.presence_slot()) + ");", indent)
+
+    # The position of the field in its oneof, counting from 1 (see proto_ng::BasicOneOf).
+    def oneof_index(self):
+        return self.oneof.fields_by_id().index(self) + 1
+
+    # Whether the field's C++ type takes a "--pmr" allocator.
+    def is_allocator_aware(self):
+        return self.is_container() or not (self.is_algebraic or self.is_enum)
+
     def generate_extend_helpers(self, file):
         # TODO(Oleg): get base types working here.
         if not self.resolved_type:
@@ -689,6 +1800,7 @@ class Field:
         writeln(file, "template<>")
         writeln(file,
                 "struct Helper<::" + self.parent.cpp_extend_namespace() + "::" + self.name + "_t> {")
+        writeln(file, "using type = ::" + self.resolved_type.fq_cpp_ref() + ";", 1)
         writeln(file, "using ref = const ::" + self.resolved_type.fq_cpp_ref() + "&;", 1)
         writeln(file, "using ptr = const ::" + self.resolved_type.fq_cpp_ref() + "*;", 1)
         writeln(file, "using mutable_ptr = ::" + self.resolved_type.fq_cpp_ref() + "*;", 1)
@@ -707,7 +1819,29 @@ class Field:
 
     def generate_accessor_declarations(self, file, indent):
         writeln(file, "// [" + str(self.id) + "] " + self.name, indent)
-        if self.is_builtin and not self.is_container():
+        if self.is_string():
+            # Read by reference (or view), written by copy, move or view, and mutated in place.
+            writeln(file, self.string_getter_type() + " " + self.name + "() const;", indent)
+            writeln(file,
+                    "void set_" + self.name + "(const " + self.cpp_type_ref() + "&);",
+                    indent)
+            writeln(file, "void set_" + self.name + "(" + self.cpp_type_ref() + "&&);", indent)
+            writeln(file,
+                    "void set_" + self.name + "(const " + self.char_type() + "*);",
+                    indent)
+            writeln(file, "#if __cplusplus >= 201703L", 0)
+            writeln(file,
+                    "void set_" + self.name + "(" + self.string_view_type() + ");",
+                    indent)
+            writeln(file, "#endif", 0)
+            writeln(file, self.cpp_type_ref() + "& mutable_" + self.name + "();", indent)
+            writeln(file, self.cpp_type_ref() + " release_" + self.name + "();", indent)
+            if not args.omit_deprecated:
+                writeln(file,
+                        "/* deprecated */ void set_allocated_" + self.name + "(" +
+                            self.cpp_type_ref() + "*);",
+                        indent)
+        elif self.is_builtin and not self.is_container():
             # These accessors take built-in args by value.
             writeln(file,
                     self.cpp_type_ref() + " " + self.name + "() const;",
@@ -775,60 +1909,126 @@ class Field:
 
     def generate_accessor_definitions(self, file):
         writeln(file, "// [" + str(self.id) + "] " + self.name)
-        if self.is_builtin and not self.is_container():
+        if self.is_string():
+            impl = self.parent.impl_cpp_type
+            writeln(file,
+                    self.string_getter_type() + " " + impl + "::" + self.name + "() const {")
+            writeln(file, "return " + self.value_or_default() + ";", 1)
+            writeln(file, "}")
+            for arg_type, value in [("const " + self.cpp_type_ref() + "&", "val"),
+                                    (self.cpp_type_ref() + "&&", "std::move(val)"),
+                                    ("const " + self.char_type() + "*", "val"),
+                                    (self.string_view_type(), None)]:
+                if value is None:
+                    writeln(file, "#if __cplusplus >= 201703L")
+                writeln(file,
+                        "void " + impl + "::set_" + self.name + "(" + arg_type + " val) {")
+                if value is None:
+                    writeln(file, self.member(write=True) + ".assign(val.data(), val.size());", 1)
+                else:
+                    writeln(file, self.member(write=True) + " = " + value + ";", 1)
+                self.generate_presence_set(file, 1)
+                self.parent.generate_hash_reset(file, 1)
+                writeln(file, "}")
+                if value is None:
+                    writeln(file, "#endif")
+            writeln(file, self.cpp_type_ref() + "& " + impl + "::mutable_" + self.name + "() {")
+            self.generate_presence_set(file, 1)
+            self.parent.generate_hash_reset(file, 1)
+            writeln(file, "return " + self.member(write=True) + ";", 1)
+            writeln(file, "}")
+            # Moves the value out, leaving the field cleared.
+            writeln(file, self.cpp_type_ref() + " " + impl + "::release_" + self.name + "() {")
+            writeln(file, self.cpp_type_ref() + " rv;", 1)
+            writeln(file, "if (has_" + self.name + "()) {", 1)
+            writeln(file, "rv = std::move(" + self.member(write=True) + ");", 2)
+            writeln(file, "clear_" + self.name + "();", 2)
+            writeln(file, "}", 1)
+            writeln(file, "return rv;", 1)
+            writeln(file, "}")
+            if not args.omit_deprecated:
+                # Takes ownership of 'val' (a null one clears the field).
+                writeln(file,
+                        "/* deprecated */ void " + impl + "::set_allocated_" + self.name + "(" +
+                            self.cpp_type_ref() + "* val) {")
+                writeln(file, "std::unique_ptr<" + self.cpp_type_ref() + "> owned(val);", 1)
+                writeln(file, "if (owned)", 1)
+                writeln(file, "set_" + self.name + "(std::move(*owned));", 2)
+                writeln(file, "else", 1)
+                writeln(file, "clear_" + self.name + "();", 2)
+                writeln(file, "}")
+        elif self.is_builtin and not self.is_container():
             writeln(file,
                     self.cpp_type_ref() + " " \
                         + self.parent.impl_cpp_type + "::" + self.name + "() const {")
-            writeln(file, "return rep_->" + self.name + ";", 1)
+            writeln(file, "return " + self.value_or_default() + ";", 1)
             writeln(file, "}")
             writeln(file,
                     "void " + self.parent.impl_cpp_type + "::set_" + self.name + \
                         "(" + self.cpp_type_ref() + " val) {")
-            writeln(file, "rep_->" + self.name + " = val;", 1)
-            writeln(file, "rep_->_Presence.set(" + str(self.id) + ");", 1)
+            writeln(file, self.member(write=True) + " = val;", 1)
+            self.generate_presence_set(file, 1)
+            self.parent.generate_hash_reset(file, 1)
             writeln(file, "}")
         elif self.is_enum and not self.is_container():
             writeln(file,
                     self.cpp_type_ref() + " " \
                         + self.parent.impl_cpp_type + "::" + self.name + "() const {")
-            writeln(file, "return rep_->" + self.name + ";", 1)
+            writeln(file, "return " + self.value_or_default() + ";", 1)
             writeln(file, "}")
             writeln(file,
                     "void " + self.parent.impl_cpp_type + "::set_" + self.name + \
                         "(" + self.cpp_type_ref() + " val) {")
-            writeln(file, "rep_->" + self.name + " = val;", 1)
-            writeln(file, "rep_->_Presence.set(" + str(self.id) + ");", 1)
+            writeln(file, self.member(write=True) + " = val;", 1)
+            self.generate_presence_set(file, 1)
+            self.parent.generate_hash_reset(file, 1)
             writeln(file, "}")
         else:
             writeln(file,
                     "const " + self.cpp_type_ref() + "& " + \
                         self.parent.impl_cpp_type + "::" + self.name + "() const {")
-            writeln(file, "return rep_->" + self.name + ";", 1)
+            writeln(file, "return " + self.value_or_default() + ";", 1)
             writeln(file, "}")
             writeln(file,
                     self.cpp_type_ref() + "& " + \
                         self.parent.impl_cpp_type + "::" + self.name + "() {")
-            writeln(file, "rep_->_Presence.set(" + str(self.id) + ");", 1)
-            writeln(file, "return rep_->" + self.name + ";", 1)
+            self.generate_presence_set(file, 1)
+            self.parent.generate_hash_reset(file, 1)
+            writeln(file, "return " + self.member(write=True) + ";", 1)
             writeln(file, "}")
 
-        if not self.is_container():
+        if self.oneof:
             writeln(file,
                     "void " + self.parent.impl_cpp_type + "::clear_" + self.name + "() {")
-            if self.is_algebraic:
-                writeln(file, "rep_->" + self.name + " = 0;", 1)
-            elif self.is_builtin:
+            writeln(file, "if (" + self.presence_test() + ")", 1)
+            writeln(file, self.oneof.member() + ".reset();", 2)
+            self.parent.generate_hash_reset(file, 1)
+            writeln(file, "}")
+
+            writeln(file,
+                    "bool " + self.parent.impl_cpp_type + "::has_" + self.name + "() const {")
+            writeln(file, "return " + self.presence_test() + ";", 1)
+            writeln(file, "}")
+        elif not self.is_container():
+            writeln(file,
+                    "void " + self.parent.impl_cpp_type + "::clear_" + self.name + "() {")
+            if self.is_lazy():
                 writeln(file, "rep_->" + self.name + ".clear();", 1)
+            elif self.is_algebraic:
+                writeln(file, self.member(write=True) + " = 0;", 1)
+            elif self.is_builtin:
+                writeln(file, self.member(write=True) + ".clear();", 1)
             elif self.is_enum:
-                writeln(file, "rep_->" + self.name + " = " + self.initializer() + ";", 1)
+                writeln(file, self.member(write=True) + " = " + self.initializer() + ";", 1)
             else:
-                writeln(file, "rep_->" + self.name + ".Clear();", 1)
-            writeln(file, "rep_->_Presence.reset(" + str(self.id) + ");", 1)
+                writeln(file, self.member(write=True) + ".Clear();", 1)
+            writeln(file, "rep_->_Presence.reset(" + str(self.presence_slot()) + ");", 1)
+            self.parent.generate_hash_reset(file, 1)
             writeln(file, "}")
 
             writeln(file,
                     "bool " + self.parent.impl_cpp_type + "::has_" + self.name + "() const {")
-            writeln(file, "return rep_->_Presence.test(" + str(self.id) + ");", 1)
+            writeln(file, "return rep_->_Presence.test(" + str(self.presence_slot()) + ");", 1)
             writeln(file, "}")
 
         if self.is_repeated and not args.omit_deprecated:
@@ -865,85 +2065,453 @@ class Field:
                 writeln(file, "}")
         writeln(file, "")
 
-    def generate_implementation_definition(self, file):
-        if self.is_algebraic and not self.is_container():
-            writeln(file, cpp_impl_type(self.raw_type) + " " + self.name + " = 0;", 1)
+    # The members of the field in the Representation: (layout rank, name, declaration).
+    def representation_members(self):
+        if self.oneof:
+            return []
+        elif self.is_algebraic and not self.is_container():
+            decl = cpp_impl_type(self.raw_type) + " " + self.name + " = 0;"
         elif self.is_builtin and not self.is_container():
-            writeln(file, cpp_impl_type(self.raw_type) + " " + self.name + ";", 1)
+            decl = cpp_impl_type(self.raw_type) + " " + self.name + ";"
         elif self.is_enum and not self.is_container():
-            writeln(file, self.cpp_type_ref() + " " + self.name + " = " + \
-                self.initializer() + ";", 1)
+            decl = self.cpp_type_ref() + " " + self.name + " = " + self.initializer() + ";"
+        elif self.is_lazy():
+            return [(layout_ranks["pointer"], self.name,
+                     "::proto_ng::Lazy<" + self.cpp_type_ref() + ", " + std_ns() + "string> " +
+                         self.name + ";")]
         else:
-            writeln(file, self.cpp_type_ref() + " " + self.name + ";", 1)
+            decl = self.cpp_type_ref() + " " + self.name + ";"
+        return [(self.layout_rank(), self.name, decl)]
+
+    def layout_rank(self):
+        if self.is_container() or self.raw_type in ["string", "bytes", "wstring"]:
+            return layout_ranks["pointer"]
+        elif self.is_enum or cpp_impl_type(self.raw_type) in ["int32_t", "uint32_t", "float"]:
+            return layout_ranks["4-byte"]
+        elif self.raw_type == "bool":
+            return layout_ranks["bool"]
+        elif self.is_builtin:
+            return layout_ranks["8-byte"]
+        elif self.resolved_type.is_inline():
+            return layout_ranks["inline"]
+        return layout_ranks["pointer"]
+
+    # Hot fields (the "hot" option or listed by "--hot-fields") go first, ahead of the
+    # padding-minimizing order.
+    def is_hot(self):
+        if args.hot_fields and self.name in args.hot_fields.get(self.parent.fq_name, []):
+            return True
+        for name, value in self.options.items():
+            if name.find("hot") >= 0:
+                return value != "false"
+        return False
+
+    # Cold fields (the "cold" option, or left out of a message listed by "--hot-fields")
+    # live in a separate struct, allocated when one of them is first written. The lazy
+    # fields stay: they are cheap until decoded. The "--pmr" and "--table-driven" code keeps
+    # all the fields in the Representation.
+    def is_cold(self):
+        if args.pmr or args.table_driven or self.is_lazy() or self.oneof:
+            return False
+        for name, value in self.options.items():
+            if name.find("cold") >= 0:
+                return value != "false"
+        if args.hot_fields and self.parent.fq_name in args.hot_fields:
+            return self.name not in args.hot_fields[self.parent.fq_name]
+        return False
+
+    # The expression of the field in 'rep', a pointer to the Representation. Until they are
+    # written, the cold fields are read from a shared default instance. The oneof fields
+    # must be set to be read, and are set by being written.
+    def member(self, rep = "rep_", write = False):
+        if self.oneof:
+            return self.oneof.member(rep) + (".emplace<" if write else ".get<") + \
+                str(self.oneof_index()) + ">()"
+        elif self.is_lazy():
+            # Decoded on the way (see proto_ng::Lazy).
+            return rep + "->" + self.name + (".mutable_get()" if write else ".get()")
+        elif not self.is_cold():
+            return rep + "->" + self.name
+        elif write:
+            return rep + "->_cold.mutable_value()." + self.name
+        return rep + "->_cold.value()." + self.name
+
+    # The value of a singular field for its getter: the default one for the oneof fields
+    # that are not set.
+    def value_or_default(self):
+        if not self.oneof:
+            return self.member()
+        if self.is_enum:
+            default = self.initializer()
+        elif self.is_algebraic:
+            default = self.cpp_type_ref() + "()"
+        else:
+            default = "::proto_ng::DefaultValue<" + self.cpp_type_ref() + ">()"
+        return self.presence_test() + " ? " + self.member() + " : " + default
+
+    # Clears 'value' (the field in the Representation) for Clear().
+    def generate_clear(self, file, indent, value):
+        if self.is_lazy():
+            writeln(file, value + ".clear();", indent)
+        elif self.is_container() or (self.is_builtin and not self.is_algebraic):
+            writeln(file, value + ".clear();", indent)
+        elif self.is_algebraic:
+            writeln(file, value + " = 0;", indent)
+        elif self.is_enum:
+            writeln(file, value + " = " + self.initializer() + ";", indent)
+        else:
+            # Only the present sub-messages may hold anything.
+            writeln(file, "if (" + self.presence_test() + ")", indent)
+            writeln(file, value + ".Clear();", indent + 1)
 
-    def generate_less_check(self, file, indent):
+    def generate_parse_case(self, file, indent):
         writeln(file, "// [" + str(self.id) + "] " + self.name, indent)
+        if self.is_map:
+            self.generate_map_entry_parser(file, indent)
+            return
 
-        '''
-        # This may be used to implement equality that takes presence into account
-        if not self.is_container() and self.is_enum:
+        wire_type, getter = wire_format(self.raw_type, self.is_enum)
+        writeln(file,
+                "case FieldKey(" + str(self.id) + ", WireType::" + wire_type + "):",
+                indent)
+        if self.is_lazy():
+            # Once decoded (or set), the field merges the new occurrences right away.
             writeln(file,
-                    "if (rep_->_Presence.test(" + str(self.id) +
-                        ") != arg.rep_->_Presence.test(" + str(self.id) + "))",
+                    "if (rep_->_Presence.test(" + str(self.presence_slot()) + ") && rep_->" +
+                        self.name + ".bytes().empty()) {",
+                    indent + 1)
+            generate_decode(file, indent + 2, getter, self.base_cpp_type_ref(),
+                            self.member(write=True), "reader", self.is_repeated)
+            writeln(file, "} else {", indent + 1)
+            writeln(file,
+                    "AppendLazy(rep_->" + self.name + ".pending_bytes(), " + str(self.id) +
+                        ", reader.get_view());",
+                    indent + 2)
+            writeln(file, "}", indent + 1)
+            writeln(file, "rep_->_Presence.set(" + str(self.presence_slot()) + ");", indent + 1)
+            writeln(file, "break;", indent + 1)
+            return
+        generate_decode(file, indent + 1, getter, self.base_cpp_type_ref(),
+                        self.member(write=True), "reader", self.is_repeated)
+        self.generate_presence_set(file, indent + 1)
+        writeln(file, "break;", indent + 1)
+
+        # Either encoding is accepted, whatever the field's own.
+        if self.is_packable():
+            writeln(file,
+                    "case FieldKey(" + str(self.id) + ", WireType::length_delimited):",
                     indent)
-            writeln(file, "return arg.rep_->_Presence.test(" + str(self.id) + ");",
+            if wire_type == "varint":
+                writeln(file,
+                        "AppendPacked(" + self.member(write=True) + ", reader.get_packed_" +
+                            getter + "());",
+                        indent + 1)
+            else:
+                writeln(file,
+                        "DecodePackedFixed(" + self.member(write=True) + ", reader.get_view());",
+                        indent + 1)
+            writeln(file, "break;", indent + 1)
+
+    # Map entries are sub-messages with the key as field 1 and the value as field 2.
+    def generate_map_entry_parser(self, file, indent):
+        container = "decltype(" + self.member(write=True) + ")"
+        key_wire_type, key_getter = wire_format(self.raw_type, False)
+        if self.resolved_type:
+            value_cpp_type = self.resolved_type.fq_cpp_ref()
+            value_wire_type, value_getter = wire_format(None, self.is_enum)
+        else:
+            value_cpp_type = cpp_impl_type(self.mapped_type)
+            value_wire_type, value_getter = wire_format(self.mapped_type, False)
+
+        writeln(file,
+                "case FieldKey(" + str(self.id) + ", WireType::length_delimited): {",
+                indent)
+        writeln(file, "protozero::pbf_reader entry = reader.get_message();", indent + 1)
+        # The allocator-aware keys and values get the container's allocator.
+        key_init = value_init = "{}"
+        if args.pmr:
+            if not key_getter:
+                key_init = "(" + self.member(write=True) + ".get_allocator())"
+            if not value_getter:
+                value_init = "(" + self.member(write=True) + ".get_allocator())"
+        writeln(file, container + "::key_type key" + key_init + ";", indent + 1)
+        writeln(file, container + "::mapped_type value" + value_init + ";", indent + 1)
+        writeln(file, "while (entry.next()) {", indent + 1)
+        writeln(file, "switch (FieldKey(entry)) {", indent + 2)
+        writeln(file, "case FieldKey(1, WireType::" + key_wire_type + "):", indent + 2)
+        generate_decode(file, indent + 3, key_getter, None, "key", "entry")
+        writeln(file, "break;", indent + 3)
+        writeln(file, "case FieldKey(2, WireType::" + value_wire_type + "):", indent + 2)
+        generate_decode(file, indent + 3, value_getter, value_cpp_type, "value", "entry")
+        writeln(file, "break;", indent + 3)
+        writeln(file, "default:", indent + 2)
+        writeln(file, "entry.skip();", indent + 3)
+        writeln(file, "}", indent + 2)
+        writeln(file, "}", indent + 1)
+        writeln(file, self.member(write=True) + "[std::move(key)] = std::move(value);",
+                indent + 1)
+        writeln(file, "break;", indent + 1)
+        writeln(file, "}", indent)
+
+    # The type of the map's values.
+    def mapped_proto_type(self):
+        assert(self.is_map)
+        if self.resolved_type and not self.is_enum:
+            return self.resolved_type.fq_name
+        return self.mapped_type
+
+    # The C++ expression for the size of a map entry (i.e. sans the map field's key).
+    def map_entry_size(self, cached):
+        return "2 + " + encoded_size(self.raw_type, False, "entry.first") + " + " + \
+            encoded_size(self.mapped_proto_type(), self.is_enum, "entry.second", cached)
+
+    def generate_size(self, file, indent):
+        writeln(file, "// [" + str(self.id) + "] " + self.name, indent)
+        if self.is_lazy():
+            writeln(file, "if (!rep_->" + self.name + ".bytes().empty()) {", indent)
+            writeln(file, "size += rep_->" + self.name + ".bytes().size();", indent + 1)
+            writeln(file, "} else {", indent)
+            indent += 1
+        if self.is_map:
+            writeln(file, "for (const auto& entry : " + self.member() + ")", indent)
+            writeln(file,
+                    "size += " + str(key_size(self.id)) + " + LengthDelimitedSize(" +
+                        self.map_entry_size(False) + ");",
                     indent + 1)
-        '''
+        elif self.is_packed():
+            wire_type, getter = wire_format(self.raw_type, self.is_enum)
+            if getter == "sint32" or getter == "sint64":
+                payload = "PackedZigZagSize(" + self.member() + ")"
+            elif wire_type == "varint":
+                payload = "PackedVarintSize(" + self.member() + ")"
+            else:
+                payload = self.member() + ".size() * " + ("8" if wire_type == "fixed64" else "4")
+            writeln(file, "if (!" + self.member() + ".empty())", indent)
+            writeln(file,
+                    "size += " + str(key_size(self.id)) + " + LengthDelimitedSize(" + payload +
+                        ");",
+                    indent + 1)
+        elif self.is_repeated:
+            value_size = encoded_size(self.raw_type, self.is_enum, "value")
+            if value_size.isdigit():
+                # The fixed-width elements need no loop.
+                writeln(file,
+                        "size += " + self.member() + ".size() * (" + str(key_size(self.id)) +
+                            " + " + value_size + ");",
+                        indent)
+            else:
+                writeln(file, "for (const auto& value : " + self.member() + ")", indent)
+                writeln(file, "size += " + str(key_size(self.id)) + " + " + value_size + ";",
+                        indent + 1)
+        else:
+            writeln(file, "if (" + self.presence_test() + ")", indent)
+            writeln(file,
+                    "size += " + str(key_size(self.id)) + " + " +
+                        encoded_size(self.raw_type, self.is_enum, self.member()) + ";",
+                    indent + 1)
+        if self.is_lazy():
+            writeln(file, "}", indent - 1)
+
+    def generate_encode(self, file, indent):
+        writeln(file, "// [" + str(self.id) + "] " + self.name, indent)
+        if self.is_lazy():
+            # Untouched sub-messages are copied as they came.
+            writeln(file, "if (!rep_->" + self.name + ".bytes().empty()) {", indent)
+            writeln(file,
+                    "output.append(rep_->" + self.name + ".bytes().data(), rep_->" + self.name +
+                        ".bytes().size());",
+                    indent + 1)
+            writeln(file, "} else {", indent)
+            indent += 1
+        if self.is_map:
+            writeln(file, "for (const auto& entry : " + self.member() + ") {", indent)
+            writeln(file,
+                    "AppendLengthPrefix(output, " + str(self.id) + ", " +
+                        self.map_entry_size(True) + ");",
+                    indent + 1)
+            generate_encode(file, indent + 1, self.raw_type, False, 1, "entry.first")
+            generate_encode(file, indent + 1, self.mapped_proto_type(), self.is_enum, 2,
+                            "entry.second")
+            writeln(file, "}", indent)
+        elif self.is_packed():
+            wire_type, getter = wire_format(self.raw_type, self.is_enum)
+            if getter == "sint32" or getter == "sint64":
+                append = "AppendPackedZigZag"
+            elif wire_type == "varint":
+                append = "AppendPackedVarints"
+            else:
+                append = "AppendPackedFixed"
+            writeln(file,
+                    append + "(output, " + str(self.id) + ", " + self.member() + ");", indent)
+        elif self.is_repeated:
+            writeln(file, "for (const auto& value : " + self.member() + ")", indent)
+            generate_encode(file, indent + 1, self.raw_type, self.is_enum, self.id, "value")
+        else:
+            writeln(file, "if (" + self.presence_test() + ")", indent)
+            generate_encode(file, indent + 1, self.raw_type, self.is_enum, self.id,
+                            self.member())
+        if self.is_lazy():
+            writeln(file, "}", indent - 1)
 
+    def generate_table_entry(self, file, indent):
+        if self.is_map:
+            kind = table_kind(self.mapped_proto_type(), self.is_enum)
+            key_kind = table_kind(self.raw_type, False)
+            label = "kMap"
+            container = "&::proto_ng::table::Mapped<decltype(Representation::" + self.name + \
+                ")>::ops"
+        else:
+            kind = key_kind = table_kind(self.raw_type, self.is_enum)
+            label = "kSingular"
+            container = "nullptr"
+            if self.is_repeated:
+                label = "kPacked" if self.is_packed() else "kRepeated"
+                # The lazy ones hold the vector in their proto_ng::Lazy.
+                vector = self.cpp_type_ref() if self.is_lazy() else \
+                    "decltype(Representation::" + self.name + ")"
+                container = "&::proto_ng::table::Repeated<" + vector + ">::ops"
+
+        default_value = "0"
+        sub = "nullptr"
+        append_enum = "nullptr"
+        presence = "::proto_ng::table::kNoPresence"
+        if self.has_presence():
+            presence = str(self.presence_slot())
+        lazy = "nullptr"
+        if self.is_lazy():
+            lazy = "&::proto_ng::table::LazyField<decltype(Representation::" + self.name + \
+                ")>::ops"
+        offset = self.name
+        oneof = "nullptr, 0"
+        if self.oneof:
+            offset = self.oneof.member_name()
+            oneof = "&::proto_ng::table::Union<decltype(Representation::" + offset + \
+                ")>::ops, " + str(self.oneof_index())
+        if kind == "kEnum":
+            default_value = self.initializer()
+            append_enum = "&::proto_ng::table::AppendEnum<" + self.resolved_type.fq_cpp_ref() + ">"
+        elif kind == "kMessage":
+            sub = "&" + self.resolved_type.fq_cpp_ref() + "::_table"
+
+        writeln(file, "// [" + str(self.id) + "] " + self.name, indent)
         writeln(file,
-                "if (rep_->" + self.name + " < arg.rep_->" + self.name + ")",
+                "{" + str(self.id) + ", " + presence + ", offsetof(Representation, " +
+                    offset + "), " +
+                    "::proto_ng::table::" + kind + ", ::proto_ng::table::" + key_kind + ", " +
+                    "::proto_ng::table::" + label + ",",
                 indent)
-        writeln(file, "return true;", indent + 1)
+        writeln(file,
+                " " + default_value + ', "' + self.name + '", ' + sub + ", " + container + ", " +
+                    append_enum + ", " + lazy + ", " + oneof + "},",
+                indent)
+
+    # Returns the view decoder and the return type of the view accessor.
+    def view_types(self):
+        if self.is_map:
+            decoder = "::proto_ng::view::Map<" + view_decoder(self.raw_type, None, False) + \
+                ", " + view_decoder(self.mapped_type, self.resolved_type, self.is_enum) + ">"
+            return decoder, decoder
+
+        decoder = view_decoder(self.raw_type, self.resolved_type, self.is_enum)
+        if self.is_repeated:
+            return decoder, "::proto_ng::view::Repeated<" + decoder + ">"
+        elif self.raw_type == "string" or self.raw_type == "bytes":
+            return decoder, "::proto_ng::view::string_view"
+        elif self.raw_type == "wstring":
+            return decoder, "protozero::data_view"
+        elif self.is_builtin:
+            return decoder, cpp_impl_type(self.raw_type)
+        elif self.is_enum:
+            return decoder, "::" + self.resolved_type.fq_cpp_ref()
+        return decoder, "::" + self.resolved_type.fq_cpp_ref() + "View"
+
+    def generate_view_accessor_declarations(self, file, indent):
+        _, value_type = self.view_types()
+        writeln(file, "// [" + str(self.id) + "] " + self.name, indent)
+        writeln(file, value_type + " " + self.name + "() const;", indent)
+        if not self.is_container():
+            writeln(file, "bool has_" + self.name + "() const;", indent)
+        writeln(file, "")
+
+    def generate_view_accessor_definitions(self, file):
+        decoder, value_type = self.view_types()
+        view = self.parent.impl_cpp_type + "View"
+        writeln(file, value_type + " " + view + "::" + self.name + "() const {")
+        if self.is_container():
+            writeln(file, "return " + value_type + "(data_, " + str(self.id) + ");", 1)
+        else:
+            default = "{}"
+            if self.is_enum:
+                default = self.initializer()
+            writeln(file,
+                    "return ::proto_ng::view::Get<" + decoder + ">(data_, " + str(self.id) +
+                        ", " + default + ");",
+                    1)
+        writeln(file, "}")
+        if not self.is_container():
+            writeln(file, "bool " + view + "::has_" + self.name + "() const {")
+            writeln(file, "return ::proto_ng::view::Has(data_, " + str(self.id) + ");", 1)
+            writeln(file, "}")
         writeln(file, "")
 
+    def generate_compare(self, file, indent):
+        if self.oneof:
+            if self.oneof_index() == 1:
+                self.oneof.generate_compare(file, indent)
+            return
+        writeln(file, "// [" + str(self.id) + "] " + self.name, indent)
+        compare = "CompareContainers" if self.is_container() else "CompareValues"
+        writeln(file,
+                "if (int rv = " + compare + "(" + self.member() + ", " +
+                    self.member("arg.rep_") + "))",
+                indent)
+        writeln(file, "return rv;", indent + 1)
+
+    def generate_hash(self, file, indent):
+        if self.oneof:
+            if self.oneof_index() == 1:
+                self.oneof.generate_hash(file, indent)
+            return
+        writeln(file, "// [" + str(self.id) + "] " + self.name, indent)
+        hash = "HashContainers" if self.is_container() else "HashValues"
+        writeln(file, "hash = " + hash + "(hash, " + self.member() + ");", indent)
+
+    def generate_equality_check(self, file, indent):
+        if self.oneof:
+            if self.oneof_index() == 1:
+                self.oneof.generate_equality_check(file, indent)
+            return
+        writeln(file, "// [" + str(self.id) + "] " + self.name, indent)
+        writeln(file, "if (" + self.member("a.rep_") + " != " + self.member("b.rep_") + ")",
+                indent)
+        writeln(file, "return false;", indent + 1)
+
     def generate_debug_output(self, file, indent):
         writeln(file, "// " + self.as_string("ns"), indent)
 
+        is_message = self.resolved_type is not None and not self.is_enum
         if self.is_repeated:
-            # This is a vector of something
-            writeln(file, "for (const auto& entry : rep_->" + self.name + ") {", indent)
-            if self.is_builtin or self.is_enum:
-                if self.is_algebraic:
-                    entry = 'entry'
-                else:
-                    entry = 'Escape(entry)'
-                writeln(file,
-                        'ss << "' + self.name + ': " << ' + entry + ' << "\\n";',
-                        indent + 1)
-            else:
-                writeln(file, 'ss << prefix << "' + self.name + ' {\\n";', indent + 1)
-                writeln(file, 'ss << entry.DebugString(prefix + "  ");', indent + 1)
-                writeln(file, 'ss << prefix << "}\\n";', indent + 1)
-            writeln(file, '}', indent)
+            writeln(file, "for (const auto& entry : " + self.member() + ")", indent)
+            generate_debug_field(file, indent + 1, self.name, "entry", "depth", is_message)
         elif self.is_map:
-            # This is a map of something
-            writeln(file, "for (const auto& entry : rep_->" + self.name + ") {", indent)
-            writeln(file, 'ss << prefix << "' + self.name + ' {\\n";', indent + 1)
-            writeln(file, 'ss << prefix << "  key: " << entry.first << "\\n";', indent + 1)
-            writeln(file, 'ss << prefix << "  value {\\n";', indent + 1)
-            if self.resolved_type:
-                writeln(file, 'ss << entry.second.DebugString(prefix + "  ");', indent + 1)
-            else:
-                writeln(file, "ss << entry.second;", indent + 1)
-            writeln(file, 'ss << "}\\n";', indent + 1)
-            writeln(file, "}", indent)
-        elif self.is_builtin or self.is_enum:
-            # This is a singular built-in
-            writeln(file, "if (rep_->_Presence.test(" + str(self.id) + "))",
-                    indent)
-            if self.is_algebraic or self.is_enum:
-                value = 'rep_->' + self.name
+            # This is a map of something, in key order.
+            if self.map_container() == "unordered":
+                writeln(file,
+                        "for (const auto* sorted : ::proto_ng::SortedEntries(" + self.member() +
+                            ")) {",
+                        indent)
+                writeln(file, "const auto& entry = *sorted;", indent + 1)
             else:
-                value = 'Escape(rep_->' + self.name + ')'
+                writeln(file, "for (const auto& entry : " + self.member() + ") {", indent)
             writeln(file,
-                    'ss << prefix << "' + self.name + ': " << ' + value + ' << "\\n";',
+                    '::proto_ng::debug::Open(out, depth, single_line, "' + self.name + '");',
                     indent + 1)
+            generate_debug_field(file, indent + 1, "key", "entry.first", "depth + 1", False)
+            generate_debug_field(file, indent + 1, "value", "entry.second", "depth + 1",
+                                 is_message)
+            writeln(file, "::proto_ng::debug::Close(out, depth, single_line);", indent + 1)
+            writeln(file, "}", indent)
         else:
-            # This is a singular sub-message
-            writeln(file, "if (rep_->_Presence.test(" + str(self.id) + "))",
-                    indent)
-            writeln(file,
-                    "ss << prefix << \"" + self.name +
-                        ": \" << rep_->" + self.name + '.DebugString(prefix + "  ");',
-                    indent + 1)
+            writeln(file, "if (" + self.presence_test() + ")", indent)
+            generate_debug_field(file, indent + 1, self.name, self.member(), "depth", is_message)
         writeln(file, "")
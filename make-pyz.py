@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+#
+# Packs protoc-ng into a single-file, startup-optimized zipapp:
+#
+#   ./make-pyz.py [-o protoc-ng.pyz]
+#   ./make-pyz.py --check-startup
+#
+# Every module is stored uncompressed (zipimport then needs no zlib) and byte-compiled
+# for the building interpreter as an unchecked hash-based .pyc, so a cold start neither
+# recompiles nor re-validates anything. The sources ride along; zipimport falls back to
+# them under a different Python version.
+#
+# --check-startup compiles a tiny .proto with the archive and fails when that imports any
+# module beyond the compiler's own and the few standard ones it needs, or when "--help"
+# imports the compiler's. Wall time depends on the machine's load, so it is only reported.
+#
+import argparse, io, os, py_compile, subprocess, sys, tempfile, time, zipfile
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+modules = ["gen.py", "nodes.py", "profiler.py", "scanner.py", "template.py", "utils.py"]
+
+# The standard modules a compile may import on top of a bare interpreter start, along with
+# everything they import: runpy runs the archive and the scanner needs re. argparse (and
+# with it gettext and locale) is only for the command lines that parse_plain_args() leaves
+# to it.
+stdlib_modules = ["enum", "re", "runpy", "types"]
+
+def build(out_path):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as pyz, \
+            tempfile.TemporaryDirectory() as tmp_dir:
+        sources = [(name, name) for name in modules] + [("protoc-ng.py", "__main__.py")]
+        for src, dst in sources:
+            src_path = os.path.join(ROOT_DIR, src)
+            pyc_path = os.path.join(tmp_dir, dst + "c")
+            py_compile.compile(src_path, cfile=pyc_path, dfile=dst, doraise=True,
+                               invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+            pyz.write(src_path, dst)
+            pyz.write(pyc_path, dst + "c")
+
+    with open(out_path, "wb") as f:
+        f.write(b"#!/usr/bin/env python3\n")
+        f.write(buf.getvalue())
+    os.chmod(out_path, 0o755)
+
+# Best-of-N wall time of running 'cmd', in milliseconds.
+def measure(cmd, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        elapsed = (time.perf_counter() - start) * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+# The modules that running 'args' imports, from the interpreter's "-X importtime" report.
+def imported_modules(args):
+    result = subprocess.run([sys.executable, "-X", "importtime"] + args, check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    modules = set()
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            modules.add(fields[2].strip())
+    return modules
+
+def check_startup(pyz_path, runs):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        proto = os.path.join(tmp_dir, "startup.proto")
+        with open(proto, "w") as f:
+            f.write("package startup;\n\nmessage Probe {\n  int32 id = 1;\n}\n")
+
+        compile_args = ["-I", tmp_dir, "--cpp_out", os.path.join(tmp_dir, "out"), proto]
+        bare = measure([sys.executable, "-c", "pass"], runs)
+        sources = measure([sys.executable, os.path.join(ROOT_DIR, "protoc-ng.py")] + compile_args,
+                          runs)
+        pyz = measure([sys.executable, pyz_path] + compile_args, runs)
+
+        print("Bare interpreter:  %7.1fms" % bare)
+        print("protoc-ng.py:      %7.1fms (+%.1fms)" % (sources, sources - bare))
+        print("%-18s %7.1fms (+%.1fms)" % (os.path.basename(pyz_path) + ":", pyz, pyz - bare))
+
+        own = set(os.path.splitext(name)[0] for name in modules)
+        allowed = imported_modules(["-c", "import " + ", ".join(stdlib_modules)]) | own
+        unexpected = imported_modules([pyz_path] + compile_args) - allowed
+        if unexpected:
+            sys.exit("Error: compiling imports " + ", ".join(sorted(unexpected)) +
+                     " on top of the expected modules.")
+        eager = imported_modules([pyz_path, "--help"]) & own
+        if eager:
+            sys.exit("Error: \"--help\" imports " + ", ".join(sorted(eager)) + ".")
+        print("Imports: as expected.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds protoc-ng as a zipapp.")
+    parser.add_argument("-o", "--output", default="protoc-ng.pyz", help="Output file")
+    parser.add_argument("--check-startup", action="store_true",
+                        help="check the modules the archive imports and report its startup time")
+    parser.add_argument("--runs", type=int, default=10, help="runs per measurement")
+    args = parser.parse_args()
+
+    build(args.output)
+    print("Built " + args.output)
+    if args.check_startup:
+        check_startup(args.output, args.runs)
+
+if __name__ == "__main__":
+    main()
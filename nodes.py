@@ -1,6 +1,6 @@
 import sys
 
-import gen, utils
+import gen, profiler, utils
 from utils import indent_from_scope, writeln, log
 
 #
@@ -89,6 +89,7 @@ class File(Node, gen.File):
     # resolving every segment of the type's string.
     def resolve_type(self, source_ns, typename):
         assert(typename)
+        profiler.count("resolution_lookups")
 
         def search_file(ast, source_ns, typename):
             if typename in ast.typenames:
@@ -192,7 +193,9 @@ class Message(Node, gen.Message):
         self.enums = {}
         self.messages = {}
         self.extends = {}
-        self.min_extension_id = None    # set when extensions are enabled for is message
+        self.oneofs = {}
+        self.options = []
+        self.extension_ranges = []      # (first, last) ids of the "extensions" statements
 
         self.impl_cpp_type = None
         self.is_extend = False
@@ -307,6 +310,17 @@ class Message(Node, gen.Message):
         for _, sub_msg in self.messages.items():
             sub_msg.verify_type_references(file)
 
+# The fields of a oneof stay in their Message's 'fields', the Oneof groups them.
+class Oneof(Node, gen.Oneof):
+    def __init__(self, name, parent):
+        Node.__init__(self)
+        gen.Oneof.__init__(self)
+
+        self.parent = parent        # the Message
+        self.name = name
+        self.fields = []
+
+
 class Enum(Node, gen.Enum):
     def __init__(self, fq_name, is_package_global):
         Node.__init__(self)
@@ -356,7 +370,8 @@ class Enum(Node, gen.Enum):
 
 
 class Field(Node, gen.Field):
-    algebraic_types = ['int32', 'uint32', 'int64', 'uint64', 'double', 'float', 'bool']
+    algebraic_types = ['int32', 'uint32', 'int64', 'uint64', 'double', 'float', 'bool',
+                       'sint32', 'sint64', 'fixed32', 'fixed64', 'sfixed32', 'sfixed64']
     string_types = ['string', 'bytes', 'wstring']
 
     def __init__(self, name, id, raw_type, resolved_type, specifier, mapped_type = None):
@@ -373,6 +388,7 @@ class Field(Node, gen.Field):
         self.is_forward_decl = False
         self.is_map = False
         self.is_repeated = False
+        self.oneof = None               # the Oneof that the field belongs to, if any
 
         self.is_enum = False
         if self.raw_type in Field.algebraic_types:
@@ -427,7 +443,8 @@ class Field(Node, gen.Field):
 
         return rv + (" (enum)" if self.is_enum else "") + \
                 (" (repeated)" if self.is_repeated else "") + \
-                (" (map)" if self.is_map else "")
+                (" (map)" if self.is_map else "") + \
+                (" (oneof " + self.oneof.name + ")" if self.oneof else "")
 
     def verify_type_references(self, file_node):
         if self.is_builtin: return
@@ -459,6 +476,7 @@ class Field(Node, gen.Field):
 
         assert(resolved_type.fq_name[-len(self.raw_type):] == self.raw_type)
         self.resolved_type = resolved_type
+        self.is_enum = type(resolved_type) is Enum
         log(2, "[parser] resolved a forward-declared field: " + self.name + " to " +
             resolved_type.fq_name)
 
@@ -472,6 +490,7 @@ class Field(Node, gen.Field):
 def find_type(ast, typename):
     if not ast:
         return None
+    profiler.count("resolution_lookups")
 
     assert(typename.count("::") == 0)
     parts = typename.split(".")
@@ -502,3 +521,82 @@ def find_file_parent(ast):
     if type(ast) == File:
         return ast
     return find_file_parent(ast.parent)
+
+# Collects the enums/messages/extends that must be generated for the 'root' file to be
+# usable: the root's own types plus everything reachable from them through field types
+# (including the mapped types of maps), the base types of "extend" blocks and the
+# enclosing scopes of nested types. Imported files contribute their file-scope extends
+# once any of their types is reached.
+def find_reachable_types(root):
+    reachable = set()
+    reached_files = set()
+    queue = []
+
+    def mark(ast):
+        if ast is None or type(ast) is File or ast in reachable:
+            return
+        reachable.add(ast)
+        queue.append(ast)
+
+    def mark_file(file_ast):
+        if file_ast in reached_files:
+            return
+        reached_files.add(file_ast)
+        for _, extend in file_ast.extends.items():
+            mark(extend)
+
+    # Everything declared in the root file is generated as is.
+    mark_file(root)
+    for _, ast in root.typenames.items():
+        mark(ast)
+
+    while len(queue) > 0:
+        ast = queue.pop()
+        mark_file(find_file_parent(ast))
+
+        # C++ has no forward declarations for Outer::Inner, so a nested type drags in its
+        # enclosing message.
+        mark(ast.parent)
+        if type(ast) is Enum:
+            continue
+
+        if ast.is_extend:
+            mark(ast.base_type)
+        for _, field in ast.fields.items():
+            mark(field.resolved_type)
+        for _, extend in ast.extends.items():
+            mark(extend)
+
+    return reachable
+
+# Drops every enum/message/extend that is not in 'reachable' from the ASTs of 'files' and
+# returns a (generated, total) pair of type counts.
+def prune_unreachable_types(files, reachable):
+    def prune(ast):
+        kept = total = 0
+        for collection in [ast.enums, ast.messages, ast.extends]:
+            for name in list(collection.keys()):
+                node = collection[name]
+                if type(node) is Message:
+                    sub_kept, sub_total = prune(node)
+                    kept += sub_kept
+                    total += sub_total
+                total += 1
+                if node in reachable:
+                    kept += 1
+                else:
+                    del collection[name]
+        return kept, total
+
+    reachable_names = set(ast.fq_name for ast in reachable)
+
+    kept = total = 0
+    for file_ast in files:
+        file_kept, file_total = prune(file_ast)
+        kept += file_kept
+        total += file_total
+
+        # Imported types that are no longer referenced need no forward declarations.
+        file_ast.imported_type_names = set(
+            name for name in file_ast.imported_type_names if name in reachable_names)
+    return kept, total
@@ -0,0 +1,177 @@
+#
+# Profiling support for "--profile": wall/CPU time per phase and per file plus counters.
+# With "--trace-memory" the same phases also track the net memory allocated in them
+# (via tracemalloc) and the peak.
+#
+# The hooks are no-ops unless 'active' holds a Profile, so they can stay in the hot paths.
+# For the same reason the heavier modules are only imported once profiling is requested.
+#
+import time
+
+from utils import log
+
+active = None
+
+class Profile:
+    def __init__(self, trace_memory = False):
+        self.phases = {}            # phase -> [wall, cpu, memory]
+        self.files = {}             # path -> {"phases": {...}, "counters": {...}}
+        self.counters = {}
+        self.trace_memory = None
+        if trace_memory:
+            import tracemalloc
+            self.trace_memory = tracemalloc
+            tracemalloc.start()
+        self.start = self.now()
+
+        # Frames of the phases in progress: [name, path, [wall, cpu, memory],
+        # [wall, cpu, memory] at the last (re)start]. Phases nest (e.g. parsing an import
+        # while parsing the importer, or scanning while parsing), and only the innermost
+        # one is being charged at any time.
+        self.stack = []
+
+    def now(self):
+        memory = 0
+        if self.trace_memory:
+            memory = self.trace_memory.get_traced_memory()[0]
+        return [time.perf_counter(), time.process_time(), memory]
+
+    def file_entry(self, path):
+        if path not in self.files:
+            self.files[path] = {"phases": {}, "counters": {}}
+        return self.files[path]
+
+    def enter(self, name, path):
+        now = self.now()
+        if len(self.stack) > 0:
+            self.pause(self.stack[-1], now)
+        self.stack.append([name, path, [0.0, 0.0, 0], now])
+
+    def leave(self):
+        now = self.now()
+        frame = self.stack.pop()
+        self.pause(frame, now)
+        name, path, spent = frame[0], frame[1], frame[2]
+
+        def add(phases):
+            entry = phases.setdefault(name, [0.0, 0.0, 0])
+            for i in range(3):
+                entry[i] += spent[i]
+        add(self.phases)
+        if path:
+            add(self.file_entry(path)["phases"])
+
+        if len(self.stack) > 0:
+            self.stack[-1][3] = now
+
+    def pause(self, frame, now):
+        for i in range(3):
+            frame[2][i] += now[i] - frame[3][i]
+
+    # Counters are charged to the file of the innermost phase, if any.
+    def count(self, counter, n):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+        if len(self.stack) > 0 and self.stack[-1][1]:
+            counters = self.file_entry(self.stack[-1][1])["counters"]
+            counters[counter] = counters.get(counter, 0) + n
+
+    # Memory retained by every file: the net allocations of its scanning/parsing/resolution
+    # phases (i.e. its AST) and, separately, the total that its token queue allocated while
+    # scanning (the tokens are released as the parser consumes them).
+    def file_memory(self, path):
+        phases = self.files[path]["phases"]
+        retained = sum(t[2] for name, t in phases.items() if name != "codegen")
+        return {"retained": retained, "token_queue": phases.get("scanner", [0, 0, 0])[2]}
+
+    def report(self):
+        def timing(entry):
+            rv = {"wall": entry[0], "cpu": entry[1]}
+            if self.trace_memory:
+                rv["memory"] = entry[2]
+            return rv
+
+        total = self.now()
+        rv = {
+            "total": timing([total[i] - self.start[i] for i in range(3)]),
+            "phases": {name: timing(t) for name, t in self.phases.items()},
+            "counters": self.counters,
+            "files": {path: {"phases": {name: timing(t) for name, t in entry["phases"].items()},
+                             "counters": entry["counters"]}
+                      for path, entry in self.files.items()},
+        }
+        if self.trace_memory:
+            current, peak = self.trace_memory.get_traced_memory()
+            rv["memory"] = {"current": current, "peak": peak}
+            for path, entry in rv["files"].items():
+                entry["memory"] = self.file_memory(path)
+        return rv
+
+    # Logs the peak and the files that retain the most memory, and warns about every file
+    # that retains more than 'budget' bytes.
+    def log_memory(self, budget = None, top = 5):
+        def mib(size):
+            return "%.2f MiB" % (size / (1024.0 * 1024.0))
+
+        current, peak = self.trace_memory.get_traced_memory()
+        log(0, "Peak traced memory: " + mib(peak) + ", still allocated: " + mib(current))
+
+        files = sorted(self.files.keys(), key=lambda path: -self.file_memory(path)["retained"])
+        for path in files[0:top]:
+            memory = self.file_memory(path)
+            log(0, "    " + mib(memory["retained"]) + " retained by " + path +
+                " (token queue allocated: " + mib(memory["token_queue"]) + ")")
+
+        if budget is None:
+            return
+        for path in files:
+            memory = self.file_memory(path)
+            if memory["retained"] > budget:
+                log(0, "Warning: " + path + " retains " + mib(memory["retained"]) +
+                    ", over the budget of " + mib(budget))
+
+    def write(self, path):
+        import json
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+class Phase:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+    def __enter__(self):
+        active.enter(self.name, self.path)
+
+    def __exit__(self, *exc):
+        active.leave()
+
+
+class NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+no_phase = NoPhase()
+
+# Times the enclosed block as 'name', charged to the .proto file 'path' (if given).
+def phase(name, path = None):
+    if not active:
+        return no_phase
+    return Phase(name, path)
+
+def count(counter, n = 1):
+    if active:
+        active.count(counter, n)
+
+# Number of AST nodes (messages, extends, enums and fields) that make up a parsed file.
+def count_nodes(ast):
+    count = len(ast.enums)
+    if hasattr(ast, "fields"):
+        count += len(ast.fields)
+    for _, msg in list(ast.messages.items()) + list(ast.extends.items()):
+        count += 1 + count_nodes(msg)
+    return count
@@ -1,10 +1,14 @@
 #!/usr/bin/python3
 
-import gen, nodes, scanner, utils
-import sys
+import os, sys
 
-from scanner import Token
-from utils import indent_from_scope, log
+# The compiler's modules, imported by set_args(): "--help" and the command line errors
+# never load them.
+def import_modules():
+    global gen, nodes, profiler, scanner, utils, Token, indent_from_scope, log
+    import gen, nodes, profiler, scanner, utils
+    from scanner import Token
+    from utils import indent_from_scope, log
 
 #
 # The main parser: builds AST for a single file.
@@ -33,15 +37,20 @@ def parse_file(path, parent = None):
     if path in scanner.Context.global_file_dict.keys():
         return scanner.Context.global_file_dict[path]
 
-    s = scanner.Scanner(path)
-    if s.reached_eof():
-        raise ValueError("Nothing to parse!")
+    with profiler.phase("parser", path):
+        s = scanner.Scanner(path)
+        if s.reached_eof():
+            raise ValueError("Nothing to parse!")
 
-    ctx = scanner.Context(s)
-    file_ast = file(ctx, path, include, parent)
-    assert(ctx.scanner.reached_eof())
-    file_ast.set_cpp_type_names()
-    file_ast.build_typename_cache()
+        ctx = scanner.Context(s)
+        file_ast = file(ctx, path, include, parent)
+        assert(ctx.scanner.reached_eof())
+        profiler.count("nodes", profiler.count_nodes(file_ast))
+
+    with profiler.phase("set_cpp_type_names", path):
+        file_ast.set_cpp_type_names()
+    with profiler.phase("build_typename_cache", path):
+        file_ast.build_typename_cache()
 
     scanner.Context.global_file_dict[path] = file_ast
 
@@ -59,7 +68,8 @@ def file(ctx, full_fs_path, include, parent):
 
     # OK, this file has been parsed, but there may be unresolved (forward) references.
     log(1, "Parsed " + file.path + ", verifying type references...")
-    file.verify_type_references()
+    with profiler.phase("verify_type_references", full_fs_path):
+        file.verify_type_references()
 
     return file
 
@@ -124,9 +134,21 @@ def imports(ctx):
     return nodes.Import(fname.value)
 
 # Grammar:
-#  <option>     ::= OPTION identifier EQUALS (string | number | boolean) SEMI
+#  <option>     ::= OPTION <option-name> EQUALS (string | number | boolean) SEMI
+#  <option-name> ::= ( identifier | PAREN_OPEN identifier PAREN_CLOSE ) { DOT identifier }
 def option(ctx):
+    # User-defined options have parens.
+    user_defined = False
+    if ctx.scanner.next() == Token.Type.ParenOpen:
+        ctx.consume_paren_open(option)
+        user_defined = True
     name = ctx.consume_identifier(option)
+    if user_defined:
+        ctx.consume_paren_close(option)
+        name.value = "(" + name.value + ")"
+    while ctx.scanner.next() == Token.Type.Dot:
+        ctx.consume()
+        name.value += "." + ctx.consume_identifier(option).value
     ctx.consume_equals(option)
     if ctx.scanner.next() == Token.Type.String:
         value_tok = ctx.consume_string(option)
@@ -181,6 +203,20 @@ def decl_list(ctx, parent, scope):
             extend(ctx, parent, scope)
             continue
 
+        # Process oneofs.
+        if ctx.scanner.next() == Token.Type.Keyword and ctx.scanner.get().value == "oneof":
+            ctx.consume_keyword(decl_list)
+            oneof_decl(ctx, parent, scope)
+            continue
+
+        # Process message options.
+        if ctx.scanner.next() == Token.Type.Keyword and ctx.scanner.get().value == "option":
+            ctx.consume_keyword(decl_list)
+            parent.options.append(option(ctx))
+            log(2, "[parser] " + indent_from_scope(scope) + "consumed a message 'option': " +
+                parent.options[-1].name)
+            continue
+
         # This must be a normal field declaration.
         decl(ctx, parent, scope)
 
@@ -210,32 +246,28 @@ def decl(ctx, parent, scope):
         # extensions 100 to 199;
         # extensions 100 to max;
         ctx.consume_keyword(decl)
-        parent.min_extension_id = int(ctx.consume_number(decl).value)
+        start = int(ctx.consume_number(decl).value)
         tok = ctx.consume_identifier(decl)
         assert(tok.value == 'to')
         if ctx.scanner.next() == Token.Type.Keyword:
             end = ctx.consume_keyword(decl).value
             assert(end == 'max')
+            end = (1 << 29) - 1     # the largest field id
         else:
-            end = ctx.consume_number(decl)
+            end = int(ctx.consume_number(decl).value)
+        parent.extension_ranges.append((start, end))
         ctx.consume_semi(decl)
     else:
         ctx.throw(decl)
 
 
 # Grammar:
-#  <builtin-field-decl> ::= [ SPECIFIER ] BUILTIN-TYPE identifier EQUALS number
-#                           [ SQUARE_OPEN DEFAULT EQUALS builtin-value SQUARE_CLOSE ]
-#                           SEMI
-def builtin_field_decl(ctx, parent, spec, scope):
-    ftype = ctx.consume().value
-    fname = ctx.consume_identifier(builtin_field_decl)
-    ctx.consume_equals(builtin_field_decl)
-    fid = ctx.consume_number(builtin_field_decl)
-    log(2, "[parser] " + indent_from_scope(scope) + "consumed a built-in 'field' declaration: " + fname.value)
-
+#  <field-options> ::= SQUARE_OPEN <option> { COMA <option> } SQUARE_CLOSE
+#  <option>        ::= [ PAREN_OPEN ] identifier [ PAREN_CLOSE ] { DOT identifier } EQUALS value
+#
+# Returns the options of a field declaration, if any, as a dict.
+def field_options(ctx, scope):
     options = {}
-
     if ctx.scanner.next() == Token.Type.SquareOpen:
         ctx.consume()
 
@@ -243,20 +275,20 @@ def builtin_field_decl(ctx, parent, spec, scope):
             # User-defined options have parens.
             user_defined = False
             if ctx.scanner.next() == Token.Type.ParenOpen:
-                ctx.consume_paren_open(builtin_field_decl)
+                ctx.consume_paren_open(field_options)
                 user_defined = True
 
-            opt_tok = ctx.consume_identifier(builtin_field_decl)
+            opt_tok = ctx.consume_identifier(field_options)
             if user_defined:
-                ctx.consume_paren_close(builtin_field_decl)
+                ctx.consume_paren_close(field_options)
 
             while ctx.scanner.next() == Token.Type.Dot:
                 ctx.consume()
                 opt_tok.value += "."
-                tok = ctx.consume_identifier(builtin_field_decl)
+                tok = ctx.consume_identifier(field_options)
                 opt_tok.value += tok.value
 
-            ctx.consume_equals(message_field_decl)
+            ctx.consume_equals(field_options)
             opt_value_tok = ctx.consume()
             options[opt_tok.value] = opt_value_tok.value
             log(2, "[parser] " + indent_from_scope(scope + ".a") + "consumed an option: " + opt_tok.value)
@@ -264,9 +296,24 @@ def builtin_field_decl(ctx, parent, spec, scope):
             if ctx.scanner.next() == Token.Type.SquareClose:
                 break
 
-            ctx.consume_coma(message_field_decl)
+            ctx.consume_coma(field_options)
+
+        ctx.consume_square_close(field_options)
 
-        ctx.consume_square_close(builtin_field_decl)
+    return options
+
+
+# Grammar:
+#  <builtin-field-decl> ::= [ SPECIFIER ] BUILTIN-TYPE identifier EQUALS number
+#                           [ <field-options> ] SEMI
+def builtin_field_decl(ctx, parent, spec, scope):
+    ftype = ctx.consume().value
+    fname = ctx.consume_identifier(builtin_field_decl)
+    ctx.consume_equals(builtin_field_decl)
+    fid = ctx.consume_number(builtin_field_decl)
+    log(2, "[parser] " + indent_from_scope(scope) + "consumed a built-in 'field' declaration: " + fname.value)
+
+    options = field_options(ctx, scope)
 
     ctx.consume_semi(builtin_field_decl)
 
@@ -283,10 +330,12 @@ def builtin_field_decl(ctx, parent, spec, scope):
                  fid.value + '. It is already used by "' + parent.fields[int(fid.value)].name + '"')
 
     parent.fields[int(fid.value)] = field_ast
+    return field_ast
 
 
 # Grammar:
-#  <map-field-decl> ::= MAP ANGLE_OPEN BUILTIN-TYPE COMA identifier ANGLE_CLOSE identifier EQUALS number SEMI
+#  <map-field-decl> ::= MAP ANGLE_OPEN BUILTIN-TYPE COMA identifier ANGLE_CLOSE identifier EQUALS number
+#                       [ <field-options> ] SEMI
 def map_field_decl(ctx, parent, scope):
     spec = ctx.consume_specifier(map_field_decl).value
     assert(spec == "map")
@@ -314,6 +363,7 @@ def map_field_decl(ctx, parent, scope):
 
     ctx.consume_equals(map_field_decl)
     fid = ctx.consume_number(map_field_decl)
+    options = field_options(ctx, scope)
     ctx.consume_semi(map_field_decl)
 
     field_ast = nodes.Field(fname.value,
@@ -322,8 +372,12 @@ def map_field_decl(ctx, parent, scope):
                             spec,
                             mapped_type.value)
     field_ast.parent = parent
+    if len(options) > 0:
+        field_ast.options = options
     assert(field_ast.is_map)
     field_ast.resolved_type = resolved_mapped_type
+    if type(resolved_mapped_type) is nodes.Enum:
+        field_ast.is_enum = True
 
     if int(fid.value) in parent.fields.keys():
         sys.exit('Error: duplicate field identifier for ' + fname.value + ' : ' +
@@ -335,7 +389,7 @@ def map_field_decl(ctx, parent, scope):
 
 # Grammar:
 #  <message-field-decl> ::= identifier [ DOT identifier ] identifier EQALS number
-#                           [ SQUARE_OPEN <stuff> SQUARE_CLOSE ] SEMI
+#                           [ <field-options> ] SEMI
 def message_field_decl(ctx, parent, spec, scope):
     # 1. take the type name, possible fully qualified.
     ftype = ctx.consume_identifier(message_field_decl).value
@@ -350,19 +404,7 @@ def message_field_decl(ctx, parent, spec, scope):
     # 3. take the rest
     ctx.consume_equals(message_field_decl)
     fid = ctx.consume_number(message_field_decl)
-    if ctx.scanner.next() == Token.Type.SquareOpen:
-        ctx.consume()
-
-        paren = None
-        if ctx.scanner.next() == Token.Type.ParenOpen:
-            paren = ctx.consume()
-        stuff = ctx.consume_identifier(builtin_field_decl)
-        if paren:
-            ctx.consume_paren_close(builtin_field_decl)
-
-        ctx.consume_equals(message_field_decl)
-        value = ctx.consume()
-        ctx.consume_square_close(builtin_field_decl)
+    options = field_options(ctx, scope)
     ctx.consume_semi(message_field_decl)
 
     # 4. verify the type reference
@@ -393,6 +435,8 @@ def message_field_decl(ctx, parent, spec, scope):
         field_ast.is_forward_decl = resolved_type == None
 
     field_ast.parent = parent
+    if len(options) > 0:
+        field_ast.options = options
     if type(resolved_type) is nodes.Enum:
         field_ast.is_enum = True
 
@@ -402,6 +446,40 @@ def message_field_decl(ctx, parent, spec, scope):
 
     parent.fields[int(fid.value)] = field_ast
     log(2, "[parser] " + indent_from_scope(scope) + "consumed a message 'field' declaration: " + fname.value)
+    return field_ast
+
+
+# Grammar:
+#  <oneof-decl> ::= ONEOF identifier SCOPE_OPEN
+#                   { <builtin-field-decl> | <message-field-decl> | OPTION <option> } SCOPE_CLOSE
+def oneof_decl(ctx, parent, scope):
+    name = ctx.consume_identifier(oneof_decl).value
+    if name in parent.oneofs:
+        sys.exit('Error: duplicate oneof "' + name + '" in ' + parent.fq_name)
+    oneof_ast = nodes.Oneof(name, parent)
+    parent.oneofs[name] = oneof_ast
+
+    ctx.consume_scope_open(oneof_decl)
+    while ctx.scanner.next() != Token.Type.ScopeClose:
+        if ctx.scanner.next() == Token.Type.Keyword and ctx.scanner.get().value == "option":
+            # The oneof options make no difference to the generated code.
+            ctx.consume_keyword(oneof_decl)
+            option(ctx)
+            continue
+
+        if ctx.scanner.next() == Token.Type.DataType:
+            field_ast = builtin_field_decl(ctx, parent, None, scope)
+        elif ctx.scanner.next() == Token.Type.Identifier:
+            field_ast = message_field_decl(ctx, parent, None, scope)
+        else:
+            ctx.throw(oneof_decl, " Expected a singular field.")
+        field_ast.oneof = oneof_ast
+        oneof_ast.fields.append(field_ast)
+    ctx.consume_scope_close(oneof_decl)
+
+    if len(oneof_ast.fields) == 0:
+        sys.exit('Error: oneof "' + name + '" in ' + parent.fq_name + ' has no fields')
+    log(2, "[parser] " + indent_from_scope(scope) + "consumed a 'oneof' declaration: " + name)
 
 
 # Grammar:
@@ -502,49 +580,260 @@ def extend(ctx, parent, scope):
 #
 # the main() part
 #
-import argparse
-
-parser = argparse.ArgumentParser()
-
-group = parser.add_argument_group('Mandatory arguments')
-group.add_argument('-I', '--include', help='Include (search) directory', action='append')
-group.add_argument('--cpp_out', help='Output directory')
-group.add_argument('filename', metavar='filename', help='Input file name')
-
-group = parser.add_argument_group('Code generation options')
-group.add_argument('--file-extension', help='File extension for the generated C++ files. ' +
-                   'Defaults to "pbng" (which yields <fname>.pbng.h).',
-                   default="pbng")
-group.add_argument('--omit-deprecated', help='Omit the deprecated old-school accessors.',
-                   action='store_true')
-group.add_argument('--all', help='Generate C++ code for all imported .proto files.',
-                   action='store_true')
-
-group = parser.add_argument_group('Diagnostic options')
-group.add_argument("-v", "--verbosity", help="increase output verbosity",
-                   action="count", default=0)
-group.add_argument("--fq", help="print fully-qualified message and enum types in AST",
-                   action='store_true')
-group.add_argument("--with-verbose-imports", help="print AST for imported files",
-                   action='store_true')
-group.add_argument("-w", "--with-warnings", help="print warnings pertaining to the generated code's semantics",
-                   action='store_true')
-
-args = parser.parse_args()
-utils.args = args
-nodes.args = args
-gen.args = args
-
-assert(args.filename)
-if not args.cpp_out:
-    sys.exit("Error: missing the \"--cpp_out\" argument - please provide the output directory.")
-
-file = parse_file(args.filename)
-if args.verbosity >= 1:
-    log(1, file.as_string())
-
-if args.all:
-    for _, file in scanner.Context.global_file_dict.items():
-        file.generate(args.cpp_out)
-else:
-    file.generate(args.cpp_out)
+# The command line: the add_argument() flags and keyword arguments of every option, by group.
+options = [
+    ('Mandatory arguments', [
+        (['-I', '--include'], dict(help='Include (search) directory', action='append')),
+        (['--cpp_out'], dict(help='Output directory')),
+        (['filename'], dict(metavar='filename', help='Input file name')),
+    ]),
+    ('Code generation options', [
+        (['--file-extension'], dict(help='File extension for the generated C++ files. ' +
+                                    'Defaults to "pbng" (which yields <fname>.pbng.h).',
+                                    default="pbng")),
+        (['--omit-deprecated'], dict(help='Omit the deprecated old-school accessors.',
+                                     action='store_true')),
+        (['--all'], dict(help='Generate C++ code for all imported .proto files.',
+                         action='store_true')),
+        (['--only-reachable'], dict(help='Used with --all: generate C++ code only for ' +
+                                    'the types reachable from the input file.',
+                                    action='store_true')),
+        (['--table-driven'], dict(help='Generate compact field tables and drive parsing, ' +
+                                  'serialization, comparison, Clear() and DebugString() through a ' +
+                                  'shared engine (infra_table.h) instead of per-field code. Trades ' +
+                                  'speed for size.',
+                                  action='store_true')),
+        (['--views'], dict(help='Also generate <Message>View classes: read-only views ' +
+                           'that decode fields on demand from serialized messages, without ' +
+                           'copying or allocating. The headers then include protozero.',
+                           action='store_true')),
+        (['--lazy-submessages'], dict(help='Keep the encoded bytes of every sub-message ' +
+                                      'field at parse time and decode them on first access; ' +
+                                      'untouched ones are re-serialized by copying. The "lazy" ' +
+                                      'field option does it per field.',
+                                      action='store_true')),
+        (['--pmr'], dict(help='Generate allocator-aware messages: they take a ' +
+                         'std::pmr::memory_resource* and hold std::pmr strings and containers, ' +
+                         'which pass it on to the sub-messages. Requires C++17.',
+                         action='store_true')),
+        (['--string-view-getters'], dict(help='Make the getters of the singular ' +
+                                         'string and bytes fields return std::string_view ' +
+                                         '(std::wstring_view for wstring) rather than a const ' +
+                                         'reference. Requires C++17.',
+                                         action='store_true')),
+        (['--inline-representation'], dict(help='Hold the fields of every message ' +
+                                           'in the message object itself rather than behind a ' +
+                                           'heap-allocated pointer. The "inline" file or message ' +
+                                           'option does it selectively (but not with --pmr).',
+                                           action='store_true')),
+        (['--hot-fields'], dict(metavar='PROFILE', help='A field hotness profile: the ' +
+                                'fully-qualified names of the hot fields, one per line. The ' +
+                                'other fields of the listed messages go into a separate struct ' +
+                                'that is only allocated when they are written. The "cold" field ' +
+                                'option does it per field.')),
+    ]),
+    ('Diagnostic options', [
+        (["-v", "--verbosity"], dict(help="increase output verbosity", action="count",
+                                     default=0)),
+        (["--fq"], dict(help="print fully-qualified message and enum types in AST",
+                        action='store_true')),
+        (["--with-verbose-imports"], dict(help="print AST for imported files",
+                                          action='store_true')),
+        (["-w", "--with-warnings"], dict(help="print warnings pertaining to the generated " +
+                                         "code's semantics",
+                                         action='store_true')),
+        (["--profile"], dict(metavar="JSON_FILE",
+                             help="write per-phase and per-file timings and counters to " +
+                             "JSON_FILE")),
+        (["--trace-memory"], dict(action='store_true',
+                                  help="trace allocations: report the peak and the memory " +
+                                  "retained per file (adds per-phase allocation deltas to " +
+                                  "--profile)")),
+        (["--memory-budget"], dict(metavar="MIB", type=float,
+                                   help="warn about files retaining more than MIB megabytes " +
+                                   "(implies --trace-memory)")),
+        (["--cprofile"], dict(metavar="STATS_FILE",
+                              help="run under cProfile and dump the stats (pstats format) to " +
+                              "STATS_FILE")),
+    ]),
+]
+
+def parse_args(argv = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    return parse_plain_args(argv) or parse_args_with_argparse(argv)
+
+# The usual command lines (known options, each value in its own or in an "--option=" argument)
+# skip argparse, which with gettext and locale is a noticeable share of a cold start. Returns
+# None for anything else, which argparse then handles, "--help" and the errors included.
+def parse_plain_args(argv):
+    import types
+
+    values = {}
+    specs = {}
+    positional = None
+    for _, group in options:
+        for flags, kwargs in group:
+            action = kwargs.get('action')
+            if flags[0][0] != '-':
+                positional = flags[0]
+                values[positional] = None
+                continue
+            dest = [flag for flag in flags if flag.startswith('--')][0][2:].replace('-', '_')
+            values[dest] = kwargs.get('default', False if action == 'store_true' else None)
+            for flag in flags:
+                specs[flag] = (dest, action, kwargs.get('type'))
+
+    positionals = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        if not arg.startswith('-') or arg == '-':
+            positionals.append(arg)
+            continue
+        flag, equals, value = arg.partition('=') if arg.startswith('--') else (arg, '', '')
+        if flag not in specs:
+            return None
+        dest, action, value_type = specs[flag]
+        if action == 'store_true' or action == 'count':
+            if equals:
+                return None
+            values[dest] = True if action == 'store_true' else values[dest] + 1
+            continue
+        if not equals:
+            if i == len(argv) or argv[i].startswith('-'):
+                return None
+            value = argv[i]
+            i += 1
+        if value_type:
+            try:
+                value = value_type(value)
+            except ValueError:
+                return None
+        if action == 'append':
+            values[dest] = (values[dest] or []) + [value]
+        else:
+            values[dest] = value
+
+    if len(positionals) != 1:
+        return None
+    values[positional] = positionals[0]
+    return types.SimpleNamespace(**values)
+
+def parse_args_with_argparse(argv):
+    import argparse
+
+    # The stock formatter imports shutil (and its compression modules) just to learn the
+    # terminal width.
+    def help_formatter(prog):
+        try:
+            width = os.get_terminal_size().columns
+        except OSError:
+            width = 80
+        return argparse.HelpFormatter(prog, width=width - 2)
+
+    parser = argparse.ArgumentParser(formatter_class=help_formatter)
+    for title, group_options in options:
+        group = parser.add_argument_group(title)
+        for flags, kwargs in group_options:
+            group.add_argument(*flags, **kwargs)
+
+    return parser.parse_args(argv)
+
+# Makes the parsed options visible to every module. This is also the entry point for the
+# tools that drive the parser/generator without going through main().
+def set_args(new_args):
+    global args
+    import_modules()
+    args = new_args
+    utils.args = args
+    nodes.args = args
+    gen.args = args
+
+def run():
+    file = parse_file(args.filename)
+    if args.verbosity >= 1:
+        log(1, file.as_string())
+
+    files = [file]
+    if args.all:
+        if args.only_reachable:
+            with profiler.phase("prune_unreachable_types"):
+                reachable = nodes.find_reachable_types(file)
+                kept, total = nodes.prune_unreachable_types(
+                    scanner.Context.global_file_dict.values(), reachable)
+            log(0, "Only reachable types: generating " + str(kept) + " of " + str(total) +
+                " types, pruned " + str(total - kept) + ".")
+        files = scanner.Context.global_file_dict.values()
+
+    for file in files:
+        with profiler.phase("codegen", file.path):
+            file.generate(args.cpp_out)
+            if profiler.active:
+                fname = gen.get_cpp_file_paths(file, args.cpp_out)
+                profiler.count("bytes_emitted",
+                               os.path.getsize(fname.h) + os.path.getsize(fname.cc))
+
+# Reads a "--hot-fields" profile ('#' starts a comment) into {message: [field names]}.
+def read_hot_fields(path):
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except OSError as e:
+        sys.exit("Error: cannot read the hot fields from " + path + ": " + e.strerror)
+
+    hot_fields = {}
+    for line in lines:
+        name = line.split("#")[0].strip()
+        if name:
+            message, _, field = name.rpartition(".")
+            hot_fields.setdefault(message, []).append(field)
+    return hot_fields
+
+# Exits on the invalid combinations of options.
+def check_args(args):
+    assert(args.filename)
+    if not args.cpp_out:
+        sys.exit("Error: missing the \"--cpp_out\" argument - please provide the output directory.")
+    if args.only_reachable and not args.all:
+        sys.exit("Error: \"--only-reachable\" requires \"--all\".")
+    if args.pmr and args.table_driven:
+        sys.exit("Error: \"--pmr\" is not supported with \"--table-driven\".")
+    if args.pmr and args.inline_representation:
+        sys.exit("Error: \"--pmr\" is not supported with \"--inline-representation\".")
+    if args.hot_fields and (args.pmr or args.table_driven):
+        sys.exit("Error: \"--hot-fields\" is not supported with \"--pmr\" or \"--table-driven\".")
+    if args.hot_fields:
+        args.hot_fields = read_hot_fields(args.hot_fields)
+
+def main():
+    new_args = parse_args()
+    check_args(new_args)
+    set_args(new_args)
+
+    trace_memory = args.trace_memory or args.memory_budget is not None
+    if args.profile or trace_memory:
+        profiler.active = profiler.Profile(trace_memory)
+    if args.cprofile:
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+
+    run()
+
+    if args.cprofile:
+        cprofile.disable()
+        cprofile.dump_stats(args.cprofile)
+        log(0, "Wrote cProfile stats to " + args.cprofile)
+    if trace_memory:
+        budget = None
+        if args.memory_budget is not None:
+            budget = int(args.memory_budget * 1024 * 1024)
+        profiler.active.log_memory(budget)
+    if args.profile:
+        profiler.active.write(args.profile)
+        log(0, "Wrote the profile to " + args.profile)
+
+if __name__ == "__main__":
+    main()
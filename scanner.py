@@ -1,6 +1,8 @@
 from enum import Enum
 from utils import log
 
+import profiler
+
 import sys
 
 class Token:
@@ -42,49 +44,63 @@ class Token:
 
 class Scanner:
     keywords = {'package', 'syntax', 'import', 'option',
-                           'message', 'enum', 'extend',
+                           'message', 'enum', 'extend', 'oneof',
                            'reserved', 'extensions', 'max', 'to'}
     data_types = ['int32', 'uint32', 'int64', 'uint64', 'double', 'float',
+                 'sint32', 'sint64', 'fixed32', 'fixed64', 'sfixed32', 'sfixed64',
                  'string', 'bytes', "wstring",
                  'bool']
     specifiers = ['repeated', 'optional', 'required', 'map']
     known_field_options = ["default", "deprecated", "packed", "include_in_hash"]
 
-    def __init__(self, file_path, flags = 0):
-        import collections, re
+    # Token types of the reserved identifiers, so that the scanner classifies an identifier
+    # with a single lookup. Keywords take precedence over data types and specifiers.
+    reserved_words = {}
+    reserved_words.update((word, Token.Type.Specifier) for word in specifiers)
+    reserved_words.update((word, Token.Type.DataType) for word in data_types)
+    reserved_words.update((word, Token.Type.Keyword) for word in keywords)
+
+    token_patterns = [
+        ("Whitespace", r'[ \t\r\n]+|//.*$|/\*.*\*/'),
+
+        ("Equals", r'='),
+        ("Number", r'-?\d+(\.\d*)?'),
+        ("ParenOpen", r'\('),
+        ("ParenClose", r'\)'),
+        ("SquareOpen", r'\['),
+        ("SquareClose", r'\]'),
+        ("AngleOpen", r'<'),
+        ("AngleClose", r'>'),
+        ("ScopeOpen", r'{'),
+        ("ScopeClose", r'}'),
+        ("Semi", r';'),
+        ("Dot", r'\.'),
+        ("Coma", r','),
+
+        ("Boolean", r'true|false'),
+        ("Identifier", r'[A-Za-z][A-Za-z0-9_]*'),
+        ("String", r'"[^"]*"|\'[^\']*\''),
+    ]
+
+    # The master regex is compiled once per process, by the first Scanner.
+    run_regex = None
+
+    non_terminals = {
+        Token.Type.Identifier, Token.Type.Specifier,
+        Token.Type.Keyword, Token.Type.DataType, Token.Type.Number, Token.Type.String,
+        Token.Type.Boolean}
 
+    def __init__(self, file_path, flags = 0):
         self.__reached_eof = False
         self.__queue = []
         self.file_path = file_path
         self.line_num = 0
-        self.non_terminals = [
-            Token.Type.Identifier, Token.Type.Specifier,
-            Token.Type.Keyword, Token.Type.DataType, Token.Type.Number, Token.Type.String]
-
-        tokens = [
-            ("Whitespace", r'[ \t\r\n]+|//.*$|/\*.*\*/'),
-
-            ("Equals", r'='),
-            ("Number", r'-?\d+(\.\d*)?'),
-            ("ParenOpen", r'\('),
-            ("ParenClose", r'\)'),
-            ("SquareOpen", r'\['),
-            ("SquareClose", r'\]'),
-            ("AngleOpen", r'<'),
-            ("AngleClose", r'>'),
-            ("ScopeOpen", r'{'),
-            ("ScopeClose", r'}'),
-            ("Semi", r';'),
-            ("Dot", r'\.'),
-            ("Coma", r','),
-
-            ("Boolean", r'true|false'),
-            ("Identifier", r'[A-Za-z][A-Za-z0-9_]*'),
-            ("String", r'"[^"]*"|\'[^\']*\''),
-        ]
-
-        tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in tokens)
-        self.__run_regex = re.compile(tok_regex).match
+
+        if not Scanner.run_regex:
+            import re
+            tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in Scanner.token_patterns)
+            Scanner.run_regex = re.compile(tok_regex).match
+        self.__run_regex = Scanner.run_regex
 
         log(1, "Opening file: " + file_path)
         self.__file = open(file_path, "r")
@@ -93,9 +109,12 @@ class Scanner:
         while idx >= len(self.__queue):
             # Consume the current logical block of input. Usually it's just one line, yet
             # it gets longer when multi-line comments are present.
-            for token in self.__scan(lambda self : self.__file.readline()):
-                log(3, "[scanner] got token: " + str(token))
-                self.__queue.append(token)
+            with profiler.phase("scanner", self.file_path):
+                queued = len(self.__queue)
+                for token in self.__scan(lambda self : self.__file.readline()):
+                    log(3, "[scanner] got token: " + str(token))
+                    self.__queue.append(token)
+                profiler.count("tokens", len(self.__queue) - queued)
         return self.__queue[idx]
 
     def next(self):
@@ -144,12 +163,8 @@ class Scanner:
                 ttype = Token.Type[match.lastgroup]
                 if ttype != Token.Type.Whitespace:
                     val = match.group(match.lastgroup)
-                    if ttype == Token.Type.Identifier and val in Scanner.keywords:
-                        ttype = Token.Type.Keyword
-                    elif ttype == Token.Type.Identifier and val in Scanner.data_types:
-                        ttype = Token.Type.DataType
-                    elif ttype == Token.Type.Identifier and val in Scanner.specifiers:
-                        ttype = Token.Type.Specifier
+                    if ttype == Token.Type.Identifier:
+                        ttype = Scanner.reserved_words.get(val, ttype)
                     tok = Token(ttype)
                     tok.line = self.line_num
                     tok.pos = match.start()
@@ -1,62 +1,2962 @@
-class Templates:
-    infra = '''#pragma once
-#include <functional>
-
-namespace proto_ng {
-
-// Support for extensions
-namespace detail {
-template<typename Extension>
-struct Helper {};
-template<typename Extension>
-inline int ResolveField(Extension) { return -1; }
-}  // detail
-
-// Support for hashing, comes from Boost.
-template <typename T>
-inline void hash_combine(std::size_t& seed, const T& v) {
-    seed ^= std::hash<T>()(v) + 0x9e3779b9 + (seed << 6) + (seed >> 2);
-}
-
-}  // proto_ng
-'''
-
-    impl = r'''#include <bitset>
-#include <sstream>
-
-#include <protozero/pbf_reader.hpp>
-
-namespace {
-
-std::string Escape(const std::string& data) {
-    char buf[16];
-
-    std::string rv = "\"";
-    rv.resize(data.size() + data.size() / 10);
-    for (char c : data) {
-        if (!isprint(c)) {
-            sprintf(buf, "\\x%02x", c);
-            rv += buf;
-            continue;
-        }
-
-        switch (c) {
-        case '\\':
-        case '"':
-            rv += '\\';
-        default:
-            rv += c;
-        }
-    }
-    rv += "\"";
-    return rv;
-}
-
-std::string Escape(const std::wstring& data) {
-    return Escape(
-        std::string(reinterpret_cast<const char*>(data.data()),
-                    data.size() * sizeof(wchar_t)));
-}
-
-}
-'''
+class Templates:
+    infra = '''#pragma once
+#include <algorithm>
+#include <atomic>
+#include <cstddef>
+#include <cstdint>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <functional>
+#include <limits>
+#include <memory>
+#include <new>
+#include <ostream>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <tuple>
+#include <type_traits>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+#if __cplusplus >= 201703L
+#include <memory_resource>
+#endif
+
+namespace proto_ng {
+
+// The field tables of the "--table-driven" code, see infra_table.h.
+namespace table {
+struct Message;
+}  // table
+
+// Support for extensions
+namespace detail {
+template<typename Extension>
+struct Helper {};
+template<typename Extension>
+inline int ResolveField(Extension) { return -1; }
+}  // detail
+
+#if __cplusplus >= 201703L
+// Allocator-aware ("--pmr") messages allocate their Representations, and everything in
+// them, from a memory resource.
+using Allocator = std::pmr::polymorphic_allocator<char>;
+
+template<class T>
+struct ResourceDeleter {
+    std::pmr::memory_resource* resource;
+
+    void operator()(T* ptr) const {
+        std::pmr::polymorphic_allocator<T> allocator(resource);
+        allocator.destroy(ptr);
+        allocator.deallocate(ptr, 1);
+    }
+};
+
+template<class T>
+using ResourcePtr = std::unique_ptr<T, ResourceDeleter<T>>;
+
+// Constructs a T that uses 'allocator' (i.e. with it as the last argument).
+template<class T, class... Args>
+ResourcePtr<T> MakeResourcePtr(const Allocator& allocator, Args&&... args) {
+    std::pmr::polymorphic_allocator<T> typed(allocator.resource());
+    T* ptr = typed.allocate(1);
+    try {
+        typed.construct(ptr, std::forward<Args>(args)...);
+    } catch (...) {
+        typed.deallocate(ptr, 1);
+        throw;
+    }
+    return ResourcePtr<T>(ptr, ResourceDeleter<T>{allocator.resource()});
+}
+#endif
+
+// Inline ("--inline-representation") messages hold their Representation by value. It is
+// accessed like the pointer it replaces, with the same shallow constness (const methods
+// may update the caches in it).
+template<class T>
+class Inline {
+public:
+    T* operator->() const { return &value_; }
+    T& operator*() const { return value_; }
+    T* get() const { return &value_; }
+
+private:
+    mutable T value_;
+};
+
+// A value that const methods cache in the Representation, e.g. the size or the hash. It
+// is a relaxed atomic, so that concurrent readers of a message may each store it (the
+// same value). Zero means "not cached"; moves take the value and leave zero behind.
+template<class T>
+class Cached {
+public:
+    Cached() = default;
+    Cached(const Cached& arg) : value_(arg.load()) {}
+    Cached(Cached&& arg) noexcept : value_(arg.load()) { arg.store(0); }
+    Cached& operator=(const Cached& arg) {
+        store(arg.load());
+        return *this;
+    }
+    Cached& operator=(Cached&& arg) noexcept {
+        store(arg.load());
+        arg.store(0);
+        return *this;
+    }
+
+    T load() const { return value_.load(std::memory_order_relaxed); }
+    void store(T value) const { value_.store(value, std::memory_order_relaxed); }
+
+private:
+    mutable std::atomic<T> value_{0};
+};
+
+// Lazy sub-message fields ("--lazy-submessages" or the "lazy" option) keep their encoded
+// occurrences (keys included) until the first access decodes them. The const accessors
+// decode at most once, under an atomic state, so concurrent readers need no locking. The
+// bytes stay until a mutable access, so that untouched values serialize (and copy) as they
+// came. T is a message or a vector of them.
+template<class T, class Bytes = std::string>
+class Lazy {
+public:
+    using allocator_type = typename Bytes::allocator_type;
+
+    Lazy() = default;
+    explicit Lazy(const allocator_type& allocator) : value_(allocator), bytes_(allocator) {}
+    Lazy(const Lazy& arg) : bytes_(arg.bytes_) { CopyValue(arg); }
+    Lazy(Lazy&& arg) noexcept
+        : value_(std::move(arg.value_)), bytes_(std::move(arg.bytes_)),
+          state_(arg.state_.load(std::memory_order_relaxed)) {
+        arg.bytes_.clear();
+        arg.state_.store(kDecoded, std::memory_order_relaxed);
+    }
+    Lazy& operator=(const Lazy& arg) {
+        if (this != &arg) {
+            bytes_ = arg.bytes_;
+            CopyValue(arg);
+        }
+        return *this;
+    }
+    Lazy& operator=(Lazy&& arg) noexcept {
+        if (this != &arg) {
+            value_ = std::move(arg.value_);
+            bytes_ = std::move(arg.bytes_);
+            state_.store(arg.state_.load(std::memory_order_relaxed), std::memory_order_relaxed);
+            arg.bytes_.clear();
+            arg.state_.store(kDecoded, std::memory_order_relaxed);
+        }
+        return *this;
+    }
+
+    const T& get() const {
+        if (state_.load(std::memory_order_acquire) != kDecoded)
+            Decode();
+        return value_;
+    }
+
+    // The value may change, so the bytes go.
+    T& mutable_get() {
+        get();
+        bytes_.clear();
+        return value_;
+    }
+
+    // The encoded occurrences, empty once changed.
+    const Bytes& bytes() const { return bytes_; }
+
+    // For parsing, which appends the new occurrences. The value is decoded from all of
+    // them on the next access.
+    Bytes& pending_bytes() {
+        if (state_.load(std::memory_order_relaxed) == kDecoded && !bytes_.empty())
+            Reset(value_);
+        state_.store(kPending, std::memory_order_relaxed);
+        return bytes_;
+    }
+
+    // Keeps the capacity.
+    void clear() {
+        bytes_.clear();
+        Reset(value_);
+        state_.store(kDecoded, std::memory_order_relaxed);
+    }
+
+private:
+    enum : uint32_t { kDecoded, kPending, kDecoding };
+
+    void Decode() const {
+        for (uint32_t state = kPending;
+             !state_.compare_exchange_weak(state, kDecoding, std::memory_order_acquire);
+             state = kPending) {
+            if (state == kDecoded)
+                return;
+            std::this_thread::yield();  // another reader is decoding them
+        }
+        try {
+            const char* data = bytes_.data();
+            const char* end = data + bytes_.size();
+            while (data != end) {
+                ReadVarint(data);  // the key
+                size_t size = ReadVarint(data);
+                Merge(value_, data, size);
+                data += size;
+            }
+        } catch (...) {
+            Reset(value_);
+            state_.store(kPending, std::memory_order_release);
+            throw;
+        }
+        state_.store(kDecoded, std::memory_order_release);
+    }
+
+    // A value being decoded by another thread is not copied: the copy decodes its own.
+    void CopyValue(const Lazy& arg) {
+        if (arg.state_.load(std::memory_order_acquire) == kDecoded) {
+            value_ = arg.value_;
+            state_.store(kDecoded, std::memory_order_relaxed);
+        } else {
+            Reset(value_);
+            state_.store(kPending, std::memory_order_relaxed);
+        }
+    }
+
+    // The bytes were validated by the parser.
+    static uint64_t ReadVarint(const char*& data) {
+        uint64_t value = 0;
+        for (int shift = 0;; shift += 7) {
+            uint8_t byte = static_cast<uint8_t>(*data++);
+            value |= static_cast<uint64_t>(byte & 0x7f) << shift;
+            if (byte < 0x80)
+                return value;
+        }
+    }
+
+    template<class Message>
+    static void Merge(Message& value, const char* data, size_t size) {
+        value._MergeFromArray(data, size);
+    }
+    template<class Message, class Allocator>
+    static void Merge(std::vector<Message, Allocator>& value, const char* data, size_t size) {
+        value.emplace_back();
+        value.back()._MergeFromArray(data, size);
+    }
+
+    template<class Message>
+    static void Reset(Message& value) { value.Clear(); }
+    template<class Message, class Allocator>
+    static void Reset(std::vector<Message, Allocator>& value) { value.clear(); }
+
+    mutable T value_;
+    Bytes bytes_;
+    mutable std::atomic<uint32_t> state_{kDecoded};
+};
+
+// The encoders write to an array that the size pass (ByteSizeLong()) made large enough:
+// the caller's one, or the tail of a resized string. The interface follows
+// protozero::pbf_writer; the fixed-size values are little-endian, as on the host.
+class ArrayWriter {
+public:
+    explicit ArrayWriter(char* data) : data_(data) {}
+
+    // Past the last byte written.
+    char* data() const { return data_; }
+
+    void append(const char* data, size_t size) {
+        if (size > 0) {
+            memcpy(data_, data, size);
+            data_ += size;
+        }
+    }
+
+    void add_varint(uint64_t value) {
+        for (; value >= 0x80; value >>= 7)
+            *data_++ = static_cast<char>((value & 0x7f) | 0x80);
+        *data_++ = static_cast<char>(value);
+    }
+
+    // Negative values are sign-extended to 64 bits.
+    void add_int32(uint32_t tag, int32_t value) { add_int64(tag, value); }
+    void add_enum(uint32_t tag, int32_t value) { add_int64(tag, value); }
+    void add_int64(uint32_t tag, int64_t value) {
+        add_key(tag, kVarint);
+        add_varint(static_cast<uint64_t>(value));
+    }
+    void add_uint32(uint32_t tag, uint32_t value) { add_uint64(tag, value); }
+    void add_uint64(uint32_t tag, uint64_t value) {
+        add_key(tag, kVarint);
+        add_varint(value);
+    }
+    void add_sint32(uint32_t tag, int32_t value) { add_sint64(tag, value); }
+    void add_sint64(uint32_t tag, int64_t value) {
+        add_key(tag, kVarint);
+        add_varint((static_cast<uint64_t>(value) << 1) ^ static_cast<uint64_t>(value >> 63));
+    }
+    void add_bool(uint32_t tag, bool value) {
+        add_key(tag, kVarint);
+        *data_++ = value ? 1 : 0;
+    }
+
+    void add_fixed32(uint32_t tag, uint32_t value) { add_fixed(tag, kFixed32, value); }
+    void add_sfixed32(uint32_t tag, int32_t value) { add_fixed(tag, kFixed32, value); }
+    void add_float(uint32_t tag, float value) { add_fixed(tag, kFixed32, value); }
+    void add_fixed64(uint32_t tag, uint64_t value) { add_fixed(tag, kFixed64, value); }
+    void add_sfixed64(uint32_t tag, int64_t value) { add_fixed(tag, kFixed64, value); }
+    void add_double(uint32_t tag, double value) { add_fixed(tag, kFixed64, value); }
+
+    // Appends the key and the length of a length-delimited value; the value must follow.
+    void add_length_prefix(uint32_t tag, size_t size) {
+        add_key(tag, kLengthDelimited);
+        add_varint(size);
+    }
+    void add_bytes(uint32_t tag, const char* data, size_t size) {
+        add_length_prefix(tag, size);
+        append(data, size);
+    }
+    void add_string(uint32_t tag, const char* data, size_t size) { add_bytes(tag, data, size); }
+
+private:
+    enum WireType : uint32_t { kVarint = 0, kFixed64 = 1, kLengthDelimited = 2, kFixed32 = 5 };
+
+    void add_key(uint32_t tag, WireType wire_type) { add_varint((tag << 3) | wire_type); }
+
+    template<class T>
+    void add_fixed(uint32_t tag, WireType wire_type, T value) {
+        add_key(tag, wire_type);
+        memcpy(data_, &value, sizeof(value));
+        data_ += sizeof(value);
+    }
+
+    char* data_;
+};
+
+// The cold fields ("--hot-fields" or the "cold" option) are allocated on the first write
+// and read from a shared default instance until then. Copies are deep.
+template<class T>
+class ColdPtr {
+public:
+    ColdPtr() = default;
+    ColdPtr(const ColdPtr& arg) : ptr_(arg.ptr_ ? new T(*arg.ptr_) : nullptr) {}
+    ColdPtr(ColdPtr&&) noexcept = default;
+
+    ColdPtr& operator=(const ColdPtr& arg) {
+        if (!arg.ptr_)
+            ptr_.reset();
+        else if (ptr_)
+            *ptr_ = *arg.ptr_;
+        else
+            ptr_.reset(new T(*arg.ptr_));
+        return *this;
+    }
+    ColdPtr& operator=(ColdPtr&&) noexcept = default;
+
+    bool has_value() const { return ptr_ != nullptr; }
+
+    const T& value() const {
+        static const T default_value;
+        return ptr_ ? *ptr_ : default_value;
+    }
+
+    T& mutable_value() {
+        if (!ptr_)
+            ptr_.reset(new T());
+        return *ptr_;
+    }
+
+private:
+    std::unique_ptr<T> ptr_;
+};
+
+// A map in a sorted vector (the "map_container = FLAT" option): contiguous entries, binary
+// search and iteration in key order. The entries arrive sorted from the wire as a rule, so
+// the insertions at the end take a shortcut; the others shift the tail.
+template<class Key, class T, class Allocator = std::allocator<std::pair<Key, T>>>
+class FlatMap {
+    using Vector = std::vector<std::pair<Key, T>, Allocator>;
+
+public:
+    using key_type = Key;
+    using mapped_type = T;
+    using value_type = std::pair<Key, T>;
+    using size_type = size_t;
+    using allocator_type = Allocator;
+    using iterator = typename Vector::iterator;
+    using const_iterator = typename Vector::const_iterator;
+
+    FlatMap() = default;
+    explicit FlatMap(const Allocator& allocator) : entries_(allocator) {}
+
+    allocator_type get_allocator() const { return entries_.get_allocator(); }
+
+    iterator begin() { return entries_.begin(); }
+    iterator end() { return entries_.end(); }
+    const_iterator begin() const { return entries_.begin(); }
+    const_iterator end() const { return entries_.end(); }
+
+    size_type size() const { return entries_.size(); }
+    bool empty() const { return entries_.empty(); }
+    void clear() { entries_.clear(); }
+    void reserve(size_type n) { entries_.reserve(n); }
+
+    iterator find(const Key& key) {
+        auto it = lower_bound(key);
+        return it != end() && !(key < it->first) ? it : end();
+    }
+    const_iterator find(const Key& key) const {
+        return const_cast<FlatMap*>(this)->find(key);
+    }
+    size_type count(const Key& key) const { return find(key) != end() ? 1 : 0; }
+
+    T& at(const Key& key) {
+        auto it = find(key);
+        if (it == end())
+            throw std::out_of_range("FlatMap::at");
+        return it->second;
+    }
+    const T& at(const Key& key) const { return const_cast<FlatMap*>(this)->at(key); }
+
+    T& operator[](const Key& key) { return try_emplace(key).first->second; }
+    T& operator[](Key&& key) { return try_emplace(std::move(key)).first->second; }
+
+    template<class K, class... Args>
+    std::pair<iterator, bool> try_emplace(K&& key, Args&&... args) {
+        auto it = lower_bound(key);
+        if (it != end() && !(key < it->first))
+            return {it, false};
+        it = entries_.emplace(it, std::piecewise_construct,
+                              std::forward_as_tuple(std::forward<K>(key)),
+                              std::forward_as_tuple(std::forward<Args>(args)...));
+        return {it, true};
+    }
+    std::pair<iterator, bool> insert(const value_type& value) {
+        return try_emplace(value.first, value.second);
+    }
+    std::pair<iterator, bool> insert(value_type&& value) {
+        return try_emplace(std::move(value.first), std::move(value.second));
+    }
+
+    iterator erase(const_iterator pos) { return entries_.erase(pos); }
+    size_type erase(const Key& key) {
+        auto it = find(key);
+        if (it == end())
+            return 0;
+        entries_.erase(it);
+        return 1;
+    }
+
+    friend bool operator==(const FlatMap& a, const FlatMap& b) {
+        return a.entries_ == b.entries_;
+    }
+    friend bool operator!=(const FlatMap& a, const FlatMap& b) { return !(a == b); }
+
+private:
+    iterator lower_bound(const Key& key) {
+        if (entries_.empty() || entries_.back().first < key)
+            return end();
+        return std::lower_bound(
+            begin(), end(), key, [](const value_type& e, const Key& k) { return e.first < k; });
+    }
+
+    Vector entries_;
+};
+
+#if __cplusplus >= 201703L
+namespace pmr {
+template<class Key, class T>
+using FlatMap =
+    ::proto_ng::FlatMap<Key, T, std::pmr::polymorphic_allocator<std::pair<Key, T>>>;
+}  // pmr
+#endif
+
+// The storage of a oneof: its fields share the memory of the largest one. index() tells
+// the set field by its position, counting from 1, or is 0 when none is. The "--pmr" ones
+// construct the fields that take allocators with theirs.
+struct NoAllocator {};
+
+template<class Allocator, class... Ts>
+class BasicOneOf : private Allocator {
+    template<uint32_t I>
+    using Type = typename std::tuple_element<I - 1, std::tuple<Ts...>>::type;
+
+public:
+    BasicOneOf() = default;
+    explicit BasicOneOf(const Allocator& allocator) : Allocator(allocator) {}
+    BasicOneOf(const BasicOneOf& arg) : Allocator(arg) {
+        *this = arg;
+    }
+    BasicOneOf(BasicOneOf&& arg) noexcept : Allocator(arg) {
+        *this = std::move(arg);
+    }
+    ~BasicOneOf() { reset(); }
+
+    BasicOneOf& operator=(const BasicOneOf& arg) {
+        if (index_ == arg.index_) {
+            if (index_ && this != &arg)
+                OpsAt(index_).assign(storage_, arg.storage_);
+        } else {
+            reset();
+            if (arg.index_) {
+                OpsAt(arg.index_).copy(storage_, arg.storage_, allocator());
+                index_ = arg.index_;
+            }
+        }
+        return *this;
+    }
+
+    BasicOneOf& operator=(BasicOneOf&& arg) noexcept {
+        if (index_ == arg.index_) {
+            if (index_ && this != &arg)
+                OpsAt(index_).move_assign(storage_, arg.storage_);
+        } else {
+            reset();
+            if (arg.index_) {
+                OpsAt(arg.index_).move(storage_, arg.storage_, allocator());
+                index_ = arg.index_;
+            }
+        }
+        return *this;
+    }
+
+    uint32_t index() const { return index_; }
+
+    // The I-th field, which must be the set one.
+    template<uint32_t I>
+    const Type<I>& get() const { return *reinterpret_cast<const Type<I>*>(storage_); }
+    template<uint32_t I>
+    Type<I>& get() { return *reinterpret_cast<Type<I>*>(storage_); }
+
+    // Makes the I-th field the set one, default-constructed unless it already was.
+    template<uint32_t I>
+    Type<I>& emplace() { return *static_cast<Type<I>*>(emplace(I)); }
+
+    void* emplace(uint32_t index) {
+        if (index_ != index) {
+            reset();
+            OpsAt(index).construct(storage_, allocator());
+            index_ = index;
+        }
+        return storage_;
+    }
+
+    const void* data() const { return storage_; }
+
+    void reset() {
+        if (index_) {
+            uint32_t index = index_;
+            index_ = 0;
+            OpsAt(index).destroy(storage_);
+        }
+    }
+
+    // Calls 'f' with the index of the set field as a std::integral_constant, if any.
+    template<class F>
+    void visit(F&& f) const {
+        Visit(f, std::integral_constant<uint32_t, 1>());
+    }
+
+    friend bool operator==(const BasicOneOf& a, const BasicOneOf& b) {
+        if (a.index_ != b.index_)
+            return false;
+        bool rv = true;
+        a.visit([&](auto i) {
+            rv = a.template get<decltype(i)::value>() == b.template get<decltype(i)::value>();
+        });
+        return rv;
+    }
+    friend bool operator!=(const BasicOneOf& a, const BasicOneOf& b) { return !(a == b); }
+
+private:
+    struct Ops {
+        void (*construct)(void* value, const Allocator& allocator);
+        void (*copy)(void* value, const void* arg, const Allocator& allocator);
+        void (*move)(void* value, void* arg, const Allocator& allocator);
+        void (*assign)(void* value, const void* arg);
+        void (*move_assign)(void* value, void* arg);
+        void (*destroy)(void* value);
+    };
+
+    // The uses-allocator construction: the allocator goes last.
+    template<class T, class... Args>
+    static void Construct(std::true_type, void* value, const Allocator& allocator,
+                          Args&&... args) {
+        new (value) T(std::forward<Args>(args)..., allocator);
+    }
+    template<class T, class... Args>
+    static void Construct(std::false_type, void* value, const Allocator&, Args&&... args) {
+        new (value) T(std::forward<Args>(args)...);
+    }
+
+    template<class T>
+    struct OpsOf {
+        using UsesAllocator = typename std::uses_allocator<T, Allocator>::type;
+
+        static void Construct(void* value, const Allocator& allocator) {
+            BasicOneOf::Construct<T>(UsesAllocator(), value, allocator);
+        }
+        static void Copy(void* value, const void* arg, const Allocator& allocator) {
+            BasicOneOf::Construct<T>(UsesAllocator(), value, allocator,
+                                     *static_cast<const T*>(arg));
+        }
+        static void Move(void* value, void* arg, const Allocator& allocator) {
+            BasicOneOf::Construct<T>(UsesAllocator(), value, allocator,
+                                     std::move(*static_cast<T*>(arg)));
+        }
+        static void Assign(void* value, const void* arg) {
+            *static_cast<T*>(value) = *static_cast<const T*>(arg);
+        }
+        static void MoveAssign(void* value, void* arg) {
+            *static_cast<T*>(value) = std::move(*static_cast<T*>(arg));
+        }
+        static void Destroy(void* value) {
+            static_cast<T*>(value)->~T();
+        }
+    };
+
+    static const Ops& OpsAt(uint32_t index) {
+        static const Ops ops[] = {{&OpsOf<Ts>::Construct, &OpsOf<Ts>::Copy, &OpsOf<Ts>::Move,
+                                   &OpsOf<Ts>::Assign, &OpsOf<Ts>::MoveAssign,
+                                   &OpsOf<Ts>::Destroy}...};
+        return ops[index - 1];
+    }
+
+    const Allocator& allocator() const { return *this; }
+
+    template<class F, uint32_t I>
+    void Visit(F& f, std::integral_constant<uint32_t, I> i) const {
+        if (index_ == I)
+            f(i);
+        else
+            Visit(f, std::integral_constant<uint32_t, I + 1>());
+    }
+    template<class F>
+    void Visit(F&, std::integral_constant<uint32_t, sizeof...(Ts) + 1>) const {}
+
+    alignas(Ts...) unsigned char storage_[std::max({sizeof(Ts)...})];
+    uint32_t index_ = 0;
+};
+
+template<class... Ts>
+using OneOf = BasicOneOf<NoAllocator, Ts...>;
+
+// What the getters of the oneof fields return when another one (or none) is set.
+template<class T>
+const T& DefaultValue() {
+    static const T value;
+    return value;
+}
+
+#if __cplusplus >= 201703L
+namespace pmr {
+template<class... Ts>
+using OneOf = BasicOneOf<Allocator, Ts...>;
+}  // pmr
+#endif
+
+// The maps that iterate in key order: all but the "map_container = UNORDERED" ones.
+template<class Map>
+struct IsOrderedMap : std::true_type {};
+
+template<class Key, class T, class Hash, class KeyEqual, class Allocator>
+struct IsOrderedMap<std::unordered_map<Key, T, Hash, KeyEqual, Allocator>> : std::false_type {};
+
+// The entries of any map in key order, for the ordering and the debug output.
+template<class Map>
+std::vector<const typename Map::value_type*> SortedEntries(const Map& map) {
+    std::vector<const typename Map::value_type*> entries;
+    entries.reserve(map.size());
+    for (const auto& entry : map)
+        entries.push_back(&entry);
+    if (!IsOrderedMap<Map>::value) {
+        std::sort(entries.begin(), entries.end(),
+                  [](const typename Map::value_type* a, const typename Map::value_type* b) {
+                      return a->first < b->first;
+                  });
+    }
+    return entries;
+}
+
+// Support for hashing, comes from Boost.
+template <typename T>
+inline void hash_combine(std::size_t& seed, const T& v) {
+    seed ^= std::hash<T>()(v) + 0x9e3779b9 + (seed << 6) + (seed >> 2);
+}
+
+// Fast, non-cryptographic hashing of whole messages (Hash()): every value is folded into
+// the seed and the result goes through the SplitMix64 finalizer.
+inline uint64_t HashMix(uint64_t seed, uint64_t value) {
+    uint64_t h = seed ^ (value + 0x9e3779b97f4a7c15ULL + (seed << 6) + (seed >> 2));
+    h = (h ^ (h >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    h = (h ^ (h >> 27)) * 0x94d049bb133111ebULL;
+    return h ^ (h >> 31);
+}
+
+// Eight bytes at a time, then the tail and the size.
+inline uint64_t HashBytes(uint64_t seed, const void* data, size_t size) {
+    const char* p = static_cast<const char*>(data);
+    for (; size >= 8; p += 8, size -= 8) {
+        uint64_t word;
+        memcpy(&word, p, 8);
+        seed = HashMix(seed, word);
+    }
+    uint64_t tail = 0;
+    memcpy(&tail, p, size);
+    return HashMix(seed, tail ^ (static_cast<uint64_t>(size) << 56));
+}
+
+// The floating point values that compare equal hash the same: 0.0 and -0.0.
+inline uint64_t HashFloat(uint64_t seed, double value) {
+    uint64_t bits = 0;
+    if (value != 0)
+        memcpy(&bits, &value, sizeof(value));
+    return HashMix(seed, bits);
+}
+
+// For the hashed containers, e.g. std::unordered_set<Message, proto_ng::MessageHash>.
+struct MessageHash {
+    template<class Message>
+    size_t operator()(const Message& message) const {
+        return static_cast<size_t>(message.Hash());
+    }
+};
+
+
+//
+// The text format of DebugString() (a field per line, indented by the nesting depth) and
+// ShortDebugString() (all the fields on a single line). Everything is appended to a single
+// string; every field ends with a separator and ShortDebugString() drops the last one.
+//
+namespace debug {
+
+// Where the text goes: the end of a string, or straight into a stream.
+class Output {
+public:
+    Output(std::string& string) : string_(&string) {}
+    Output(std::ostream& stream) : stream_(&stream) {}
+
+    void append(const char* data, size_t size) {
+        if (string_)
+            string_->append(data, size);
+        else
+            stream_->write(data, static_cast<std::streamsize>(size));
+    }
+    void append(const char* first, const char* last) { append(first, last - first); }
+    void append(size_t count, char c) {
+        if (string_) {
+            string_->append(count, c);
+        } else {
+            for (; count > 0; --count)
+                stream_->put(c);
+        }
+    }
+
+    Output& operator+=(char c) {
+        append(1, c);
+        return *this;
+    }
+    Output& operator+=(const char* text) {
+        append(text, strlen(text));
+        return *this;
+    }
+
+private:
+    std::string* string_ = nullptr;
+    std::ostream* stream_ = nullptr;
+};
+
+inline void Indent(Output& out, int depth, bool single_line) {
+    if (!single_line)
+        out.append(2 * depth, ' ');
+}
+
+inline void Separator(Output& out, bool single_line) {
+    out += single_line ? ' ' : '\\n';
+}
+
+// "name: ", followed by the value and the separator.
+inline void Name(Output& out, int depth, bool single_line, const char* name) {
+    Indent(out, depth, single_line);
+    out += name;
+    out += ": ";
+}
+
+// "name {", followed by the fields one level deeper and Close().
+inline void Open(Output& out, int depth, bool single_line, const char* name) {
+    Indent(out, depth, single_line);
+    out += name;
+    out += " {";
+    Separator(out, single_line);
+}
+
+inline void Close(Output& out, int depth, bool single_line) {
+    Indent(out, depth, single_line);
+    out += '}';
+    Separator(out, single_line);
+}
+
+// How every byte prints within the quotes: as itself (0), as a backslash and the given
+// character, or as "\\x" and two hex digits ('x').
+inline const char* Escapes() {
+    static const struct Table {
+        char escapes[256];
+        Table() {
+            for (int c = 0; c < 256; ++c)
+                escapes[c] = c < 0x20 || c >= 0x7f ? 'x' : 0;
+            escapes[int{'\\n'}] = 'n';
+            escapes[int{'\\r'}] = 'r';
+            escapes[int{'\\t'}] = 't';
+            escapes[int{'"'}] = '"';
+            escapes[int{'\\\\'}] = '\\\\';
+        }
+    } table;
+    return table.escapes;
+}
+
+// Appends 'data' quoted, copying the runs that need no escaping at once.
+inline void AppendEscaped(Output& out, const char* data, size_t size) {
+    static const char digits[] = "0123456789abcdef";
+    const char* escapes = Escapes();
+    const char* end = data + size;
+    const char* run = data;
+    out += '"';
+    for (const char* p = data; p != end; ++p) {
+        unsigned char c = *p;
+        if (!escapes[c])
+            continue;
+        out.append(run, p);
+        out += '\\\\';
+        out += escapes[c];
+        if (escapes[c] == 'x') {
+            out += digits[c >> 4];
+            out += digits[c & 0xf];
+        }
+        run = p + 1;
+    }
+    out.append(run, end);
+    out += '"';
+}
+
+inline void AppendValue(Output& out, uint64_t value) {
+    char buf[20];
+    char* p = buf + sizeof(buf);
+    do {
+        *--p = static_cast<char>('0' + value % 10);
+        value /= 10;
+    } while (value);
+    out.append(p, buf + sizeof(buf));
+}
+
+inline void AppendValue(Output& out, int64_t value) {
+    if (value < 0) {
+        out += '-';
+        AppendValue(out, 0 - static_cast<uint64_t>(value));
+    } else {
+        AppendValue(out, static_cast<uint64_t>(value));
+    }
+}
+
+inline void AppendValue(Output& out, uint32_t value) {
+    AppendValue(out, static_cast<uint64_t>(value));
+}
+
+inline void AppendValue(Output& out, int32_t value) {
+    AppendValue(out, static_cast<int64_t>(value));
+}
+
+inline void AppendValue(Output& out, bool value) {
+    out += value ? "true" : "false";
+}
+
+// The shortest "%g" that reads back as 'value': digits10 digits mostly, up to max_digits10.
+template<class T>
+void AppendFloatingPoint(Output& out, T value) {
+    char buf[32];
+    int size = 0;
+    for (int digits = std::numeric_limits<T>::digits10;
+         digits <= std::numeric_limits<T>::max_digits10; ++digits) {
+        size = snprintf(buf, sizeof(buf), "%.*g", digits, static_cast<double>(value));
+        if (static_cast<T>(strtod(buf, nullptr)) == value)
+            break;
+    }
+    out.append(buf, size);
+}
+
+inline void AppendValue(Output& out, double value) {
+    AppendFloatingPoint(out, value);
+}
+
+inline void AppendValue(Output& out, float value) {
+    AppendFloatingPoint(out, value);
+}
+
+template<class Allocator>
+void AppendValue(Output& out,
+                 const std::basic_string<char, std::char_traits<char>, Allocator>& value) {
+    AppendEscaped(out, value.data(), value.size());
+}
+
+// wstring values print as their raw wchar_t bytes.
+template<class Allocator>
+void AppendValue(Output& out,
+                 const std::basic_string<wchar_t, std::char_traits<wchar_t>, Allocator>& value) {
+    AppendEscaped(out, reinterpret_cast<const char*>(value.data()),
+                  value.size() * sizeof(wchar_t));
+}
+
+// Enums print by name (the generated EnumName()), or by number when unknown.
+template<class Enum>
+typename std::enable_if<std::is_enum<Enum>::value>::type AppendValue(Output& out,
+                                                                     Enum value) {
+    if (const char* name = EnumName(value))
+        out += name;
+    else
+        AppendValue(out, static_cast<int32_t>(value));
+}
+
+// "name: value" for the scalars, enums and strings.
+template<class T>
+void Field(Output& out, int depth, bool single_line, const char* name, const T& value) {
+    Name(out, depth, single_line, name);
+    AppendValue(out, value);
+    Separator(out, single_line);
+}
+
+// "name { ... }" for the sub-messages.
+template<class Message>
+void SubMessage(Output& out, int depth, bool single_line, const char* name,
+                const Message& value) {
+    Open(out, depth, single_line, name);
+    value._PrintDebugTo(out, depth + 1, single_line);
+    Close(out, depth, single_line);
+}
+
+}  // debug
+
+//
+// Extensions: the fields of the "extensions N to M" ranges, which other files define. Only
+// the messages with such ranges hold an ExtensionSet: the present extensions sorted by id,
+// each one as parsed (the encoded bytes) and, from its first typed access on, as a value.
+// Only sub-message extensions are supported.
+//
+template<class T>
+struct ExtensionOps;
+
+class ExtensionRegistry;
+
+class ExtensionSet {
+public:
+    // The type-specific parts of the values, see ExtensionOps.
+    struct Ops {
+        void* (*create)();
+        void* (*copy)(const void* value);
+        void (*destroy)(void* value);
+        void (*merge)(void* value, const char* data, size_t size);
+        size_t (*byte_size)(const void* value);
+        size_t (*cached_size)(const void* value);
+        void (*append)(const void* value, ArrayWriter& output);
+        int (*compare)(const void* a, const void* b);
+        void (*print)(const void* value, debug::Output& out, int depth, bool single_line);
+    };
+
+    bool empty() const { return entries_.empty(); }
+
+    bool Has(uint32_t id) const { return Find(id) != nullptr; }
+
+    // The value of the extension, decoded on the first access, or nullptr when absent.
+    template<class T>
+    const T* Get(uint32_t id) const {
+        const Entry* entry = Find(id);
+        return entry ? static_cast<const T*>(entry->Decode(ExtensionOps<T>::ops)) : nullptr;
+    }
+
+    // Adds the extension unless present. The value may change, so the bytes go.
+    template<class T>
+    T* Mutable(uint32_t id) {
+        Entry& entry = Insert(id);
+        void* value = entry.Decode(ExtensionOps<T>::ops);
+        entry.bytes.clear();
+        return static_cast<T*>(value);
+    }
+
+    void Clear(uint32_t id) {
+        auto it = LowerBound(entries_, id);
+        if (it != entries_.end() && it->id == id)
+            entries_.erase(it);
+    }
+
+    void Clear() { entries_.clear(); }
+
+    // Parsing: an occurrence of the extension, sans the key and length. The occurrences of
+    // a sub-message merge, so the undecoded ones simply concatenate.
+    void Merge(uint32_t id, const char* data, size_t size) {
+        Entry& entry = Insert(id);
+        if (entry.Changed()) {
+            entry.ops->merge(entry.value, data, size);
+        } else {
+            entry.Reset();
+            entry.bytes.append(data, size);
+        }
+    }
+
+    // The size pass caches the sizes of the values, which Encode() then uses.
+    size_t ByteSize() const {
+        size_t size = 0;
+        for (const Entry& entry : entries_) {
+            size_t value_size = entry.Changed() ? entry.ops->byte_size(entry.value) :
+                                                  entry.bytes.size();
+            size += VarintSize(entry.id << 3) + VarintSize(value_size) + value_size;
+        }
+        return size;
+    }
+
+    void Encode(ArrayWriter& output) const {
+        for (const Entry& entry : entries_) {
+            if (entry.Changed()) {
+                output.add_length_prefix(entry.id, entry.ops->cached_size(entry.value));
+                entry.ops->append(entry.value, output);
+            } else {
+                output.add_bytes(entry.id, entry.bytes.data(), entry.bytes.size());
+            }
+        }
+    }
+
+    // By id, as the fields, then by value. The values that neither set has decoded yet
+    // are decoded into temporaries, with the Ops that 'registry' has for the id: only the
+    // unknown extensions compare by their bytes.
+    int Compare(const ExtensionSet& arg, const ExtensionRegistry& registry) const;
+
+    // Only the ids: the decoded and undecoded values that compare equal must hash the same.
+    uint64_t Hash(uint64_t seed) const {
+        for (const Entry& entry : entries_)
+            seed = HashMix(seed, entry.id);
+        return HashMix(seed, entries_.size());
+    }
+
+    // "[id] { ... }", or the escaped bytes until decoded.
+    void Print(debug::Output& out, int depth, bool single_line) const {
+        for (const Entry& entry : entries_) {
+            char name[16];
+            snprintf(name, sizeof(name), "[%u]", entry.id);
+            if (const void* value = entry.Decoded()) {
+                debug::Open(out, depth, single_line, name);
+                entry.ops->print(value, out, depth + 1, single_line);
+                debug::Close(out, depth, single_line);
+            } else {
+                debug::Name(out, depth, single_line, name);
+                debug::AppendEscaped(out, entry.bytes.data(), entry.bytes.size());
+                debug::Separator(out, single_line);
+            }
+        }
+    }
+
+private:
+    // The bytes stay when a const access decodes the value, as with proto_ng::Lazy, and
+    // go once it may change: the value replaces them when they are empty and decoded.
+    struct Entry {
+        enum : uint32_t { kDecoded, kPending, kDecoding };
+
+        uint32_t id;
+        std::string bytes;
+        mutable const Ops* ops = nullptr;   // of the decoded value
+        mutable void* value = nullptr;
+        mutable std::atomic<uint32_t> state{kPending};
+
+        explicit Entry(uint32_t id) : id(id) {}
+        Entry(const Entry& arg) : id(arg.id), bytes(arg.bytes) {
+            // A value being decoded by another thread is not copied: the copy decodes its own.
+            if (const void* decoded = arg.Decoded()) {
+                value = arg.ops->copy(decoded);
+                ops = arg.ops;
+                state.store(kDecoded, std::memory_order_relaxed);
+            }
+        }
+        Entry(Entry&& arg) noexcept
+            : id(arg.id), bytes(std::move(arg.bytes)), ops(arg.ops), value(arg.value),
+              state(arg.state.load(std::memory_order_relaxed)) {
+            arg.value = nullptr;
+            arg.state.store(kPending, std::memory_order_relaxed);
+        }
+        ~Entry() { Reset(); }
+
+        Entry& operator=(const Entry& arg) { return *this = Entry(arg); }
+        Entry& operator=(Entry&& arg) noexcept {
+            std::swap(id, arg.id);
+            bytes.swap(arg.bytes);
+            std::swap(ops, arg.ops);
+            std::swap(value, arg.value);
+            uint32_t arg_state = arg.state.load(std::memory_order_relaxed);
+            arg.state.store(state.load(std::memory_order_relaxed), std::memory_order_relaxed);
+            state.store(arg_state, std::memory_order_relaxed);
+            return *this;
+        }
+
+        // The value, or nullptr until decoded.
+        const void* Decoded() const {
+            return state.load(std::memory_order_acquire) == kDecoded ? value : nullptr;
+        }
+
+        // The value is what the message holds: it may differ from the bytes. Only for
+        // the non-const paths and the serialization, which may not race with them.
+        bool Changed() const { return Decoded() && bytes.empty(); }
+
+        // Once, by the first of the concurrent readers.
+        void* Decode(const Ops& decoder) const {
+            for (uint32_t expected = kPending;
+                 !state.compare_exchange_weak(expected, kDecoding, std::memory_order_acquire);
+                 expected = kPending) {
+                if (expected == kDecoded)
+                    return value;
+                std::this_thread::yield();  // another reader is decoding the bytes
+            }
+            try {
+                value = DecodeBytes(decoder, bytes);
+            } catch (...) {
+                state.store(kPending, std::memory_order_release);
+                throw;
+            }
+            ops = &decoder;
+            state.store(kDecoded, std::memory_order_release);
+            return value;
+        }
+
+        // Back to the bytes.
+        void Reset() {
+            if (value)
+                ops->destroy(value);
+            value = nullptr;
+            state.store(kPending, std::memory_order_relaxed);
+        }
+    };
+
+    // A value decoded for Compare(), or the decoded one.
+    class Temporary {
+    public:
+        Temporary(const Ops& ops, const Entry& entry) : ops_(ops), value_(entry.Decoded()) {
+            if (!value_)
+                value_ = temporary_ = DecodeBytes(ops, entry.bytes);
+        }
+        ~Temporary() {
+            if (temporary_)
+                ops_.destroy(temporary_);
+        }
+        Temporary(const Temporary&) = delete;
+        Temporary& operator=(const Temporary&) = delete;
+
+        const void* get() const { return value_; }
+
+    private:
+        const Ops& ops_;
+        const void* value_;
+        void* temporary_ = nullptr;
+    };
+
+    static void* DecodeBytes(const Ops& decoder, const std::string& bytes) {
+        void* decoded = decoder.create();
+        try {
+            decoder.merge(decoded, bytes.data(), bytes.size());
+        } catch (...) {
+            decoder.destroy(decoded);
+            throw;
+        }
+        return decoded;
+    }
+
+    static size_t VarintSize(uint64_t value) {
+        size_t size = 1;
+        for (; value >= 0x80; value >>= 7)
+            ++size;
+        return size;
+    }
+
+    template<class Entries>
+    static auto LowerBound(Entries& entries, uint32_t id) -> decltype(entries.begin()) {
+        return std::lower_bound(entries.begin(), entries.end(), id,
+                                [](const Entry& entry, uint32_t key) { return entry.id < key; });
+    }
+
+    const Entry* Find(uint32_t id) const {
+        auto it = LowerBound(entries_, id);
+        return it != entries_.end() && it->id == id ? &*it : nullptr;
+    }
+
+    Entry& Insert(uint32_t id) {
+        auto it = LowerBound(entries_, id);
+        if (it == entries_.end() || it->id != id)
+            it = entries_.insert(it, Entry(id));
+        return *it;
+    }
+
+    std::vector<Entry> entries_;
+};
+
+// The extensions of a message type that the linked-in files define, by id. Each one is
+// added during the static initialization of its file, and only read afterwards.
+class ExtensionRegistry {
+public:
+    // Returns 'id', for the initializer of the extension's id.
+    int Add(int id, const ExtensionSet::Ops& ops) {
+        ops_[static_cast<uint32_t>(id)] = &ops;
+        return id;
+    }
+
+    // The registry of the messages of type 'Message'.
+    template<class Message>
+    static ExtensionRegistry& Of() {
+        static ExtensionRegistry registry;
+        return registry;
+    }
+
+    const ExtensionSet::Ops* Find(uint32_t id) const {
+        auto it = ops_.find(id);
+        return it != ops_.end() ? it->second : nullptr;
+    }
+
+private:
+    std::unordered_map<uint32_t, const ExtensionSet::Ops*> ops_;
+};
+
+inline int ExtensionSet::Compare(const ExtensionSet& arg,
+                                 const ExtensionRegistry& registry) const {
+    size_t count = std::min(entries_.size(), arg.entries_.size());
+    for (size_t i = 0; i < count; ++i) {
+        const Entry& a = entries_[i];
+        const Entry& b = arg.entries_[i];
+        if (a.id != b.id)
+            return a.id < b.id ? 1 : -1;  // 'a' has an extension that 'b' lacks
+        const Ops* ops = a.Decoded() ? a.ops : b.Decoded() ? b.ops : nullptr;
+        if (!ops && a.bytes == b.bytes)
+            continue;
+        if (!ops)
+            ops = registry.Find(a.id);
+        int rv;
+        if (ops) {
+            Temporary a_value(*ops, a);
+            Temporary b_value(*ops, b);
+            rv = ops->compare(a_value.get(), b_value.get());
+        } else {
+            rv = a.bytes.compare(b.bytes);
+        }
+        if (rv)
+            return rv < 0 ? -1 : 1;
+    }
+    if (entries_.size() != arg.entries_.size())
+        return entries_.size() < arg.entries_.size() ? -1 : 1;
+    return 0;
+}
+
+// The sub-message extensions.
+template<class T>
+struct ExtensionOps {
+    static void* Create() { return new T(); }
+    static void* Copy(const void* value) { return new T(*static_cast<const T*>(value)); }
+    static void Destroy(void* value) { delete static_cast<T*>(value); }
+    static void Merge(void* value, const char* data, size_t size) {
+        static_cast<T*>(value)->_MergeFromArray(data, size);
+    }
+    static size_t ByteSize(const void* value) {
+        return static_cast<const T*>(value)->ByteSizeLong();
+    }
+    static size_t CachedSize(const void* value) {
+        return static_cast<const T*>(value)->_CachedSize();
+    }
+    static void Append(const void* value, ArrayWriter& output) {
+        static_cast<const T*>(value)->_AppendTo(output);
+    }
+    static int Compare(const void* a, const void* b) {
+        return static_cast<const T*>(a)->Compare(*static_cast<const T*>(b));
+    }
+    static void Print(const void* value, debug::Output& out, int depth, bool single_line) {
+        static_cast<const T*>(value)->_PrintDebugTo(out, depth, single_line);
+    }
+
+    static const ExtensionSet::Ops ops;
+};
+
+template<class T>
+const ExtensionSet::Ops ExtensionOps<T>::ops = {
+    &Create, &Copy, &Destroy, &Merge, &ByteSize, &CachedSize, &Append, &Compare, &Print
+};
+
+}  // proto_ng
+'''
+
+    impl = r'''#include <bitset>
+#include <cstring>
+#include <iterator>
+#include <ostream>
+#include <type_traits>
+#include <utility>
+#include <vector>
+
+#include <infra.h>
+#include <protozero/exception.hpp>
+#include <protozero/pbf_reader.hpp>
+#include <protozero/varint.hpp>
+
+namespace {
+
+using WireType = protozero::pbf_wire_type;
+
+// A field's tag and wire type as a single switch key.
+constexpr uint32_t FieldKey(uint32_t tag, WireType type) {
+    return (tag << 3) | static_cast<uint32_t>(type);
+}
+
+inline uint32_t FieldKey(const protozero::pbf_reader& reader) {
+    return FieldKey(reader.tag(), reader.wire_type());
+}
+
+// Decoding of the length-delimited values. Strings reuse their capacity, sub-messages
+// are merged into.
+template<class Allocator>
+inline void Decode(std::basic_string<char, std::char_traits<char>, Allocator>& target,
+                   protozero::data_view view) {
+    target.assign(view.data(), view.size());
+}
+
+// wstring values travel as their raw wchar_t bytes.
+template<class Allocator>
+inline void Decode(std::basic_string<wchar_t, std::char_traits<wchar_t>, Allocator>& target,
+                   protozero::data_view view) {
+    target.resize(view.size() / sizeof(wchar_t));
+    memcpy(&target[0], view.data(), target.size() * sizeof(wchar_t));
+}
+
+template<class Message>
+inline void Decode(Message& target, protozero::data_view view) {
+    target._MergeFromArray(view.data(), view.size());
+}
+
+// Three-way comparison of the field values: <0, 0 or >0.
+template<class T>
+inline typename std::enable_if<!std::is_class<T>::value, int>::type CompareValues(T a, T b) {
+    return a < b ? -1 : (b < a ? 1 : 0);
+}
+
+template<class Char, class Allocator>
+inline int CompareValues(const std::basic_string<Char, std::char_traits<Char>, Allocator>& a,
+                         const std::basic_string<Char, std::char_traits<Char>, Allocator>& b) {
+    return a.compare(b);
+}
+
+template<class Message>
+inline auto CompareValues(const Message& a, const Message& b) -> decltype(a.Compare(b)) {
+    return a.Compare(b);
+}
+
+// Map entries.
+template<class Key, class Value>
+inline int CompareValues(const std::pair<Key, Value>& a, const std::pair<Key, Value>& b) {
+    int rv = CompareValues(a.first, b.first);
+    return rv ? rv : CompareValues(a.second, b.second);
+}
+
+// Hashing of the field values, consistent with ==, see proto_ng::HashMix.
+template<class T>
+inline typename std::enable_if<std::is_integral<T>::value || std::is_enum<T>::value,
+                               uint64_t>::type HashValues(uint64_t seed, T value) {
+    return ::proto_ng::HashMix(seed, static_cast<uint64_t>(value));
+}
+
+inline uint64_t HashValues(uint64_t seed, double value) {
+    return ::proto_ng::HashFloat(seed, value);
+}
+
+template<class Char, class Allocator>
+inline uint64_t HashValues(uint64_t seed,
+                           const std::basic_string<Char, std::char_traits<Char>, Allocator>& a) {
+    return ::proto_ng::HashBytes(seed, a.data(), a.size() * sizeof(Char));
+}
+
+template<class Message>
+inline auto HashValues(uint64_t seed, const Message& a) -> decltype(a.Hash()) {
+    return ::proto_ng::HashMix(seed, a.Hash());
+}
+
+template<class Key, class Value>
+inline uint64_t HashValues(uint64_t seed, const std::pair<Key, Value>& a) {
+    return HashValues(HashValues(seed, a.first), a.second);
+}
+
+template<class Container>
+inline uint64_t HashContainers(uint64_t seed, const Container& a) {
+    for (const auto& value : a)
+        seed = HashValues(seed, value);
+    return ::proto_ng::HashMix(seed, a.size());
+}
+
+// The unordered maps hash regardless of the order of the entries.
+template<class Key, class T, class Hash, class KeyEqual, class Allocator>
+inline uint64_t HashContainers(uint64_t seed,
+                               const std::unordered_map<Key, T, Hash, KeyEqual, Allocator>& a) {
+    uint64_t sum = 0;
+    for (const auto& entry : a)
+        sum += HashValues(0, entry);
+    return ::proto_ng::HashMix(::proto_ng::HashMix(seed, sum), a.size());
+}
+
+// Containers compare lexicographically.
+template<class Container>
+inline int CompareContainers(const Container& a, const Container& b) {
+    auto i = a.begin();
+    auto j = b.begin();
+    for (; i != a.end() && j != b.end(); ++i, ++j) {
+        if (int rv = CompareValues(*i, *j))
+            return rv;
+    }
+    return CompareValues(a.size(), b.size());
+}
+
+// ... and the unordered maps in key order.
+template<class Key, class T, class Hash, class KeyEqual, class Allocator>
+inline int CompareContainers(const std::unordered_map<Key, T, Hash, KeyEqual, Allocator>& a,
+                             const std::unordered_map<Key, T, Hash, KeyEqual, Allocator>& b) {
+    auto x = ::proto_ng::SortedEntries(a);
+    auto y = ::proto_ng::SortedEntries(b);
+    for (size_t i = 0; i < x.size() && i < y.size(); ++i) {
+        if (int rv = CompareValues(*x[i], *y[i]))
+            return rv;
+    }
+    return CompareValues(a.size(), b.size());
+}
+
+// Oneofs: by the set field, then by its value.
+template<class Allocator, class... Ts>
+inline int CompareValues(const ::proto_ng::BasicOneOf<Allocator, Ts...>& a,
+                         const ::proto_ng::BasicOneOf<Allocator, Ts...>& b) {
+    int rv = CompareValues(a.index(), b.index());
+    if (rv == 0) {
+        a.visit([&](auto i) {
+            rv = CompareValues(a.template get<decltype(i)::value>(),
+                               b.template get<decltype(i)::value>());
+        });
+    }
+    return rv;
+}
+
+template<class Allocator, class... Ts>
+inline uint64_t HashValues(uint64_t seed, const ::proto_ng::BasicOneOf<Allocator, Ts...>& a) {
+    seed = ::proto_ng::HashMix(seed, a.index());
+    a.visit([&](auto i) { seed = HashValues(seed, a.template get<decltype(i)::value>()); });
+    return seed;
+}
+
+// Encoded sizes.
+inline size_t VarintSize(uint64_t value) {
+    size_t size = 1;
+    for (; value >= 0x80; value >>= 7)
+        ++size;
+    return size;
+}
+
+inline size_t LengthDelimitedSize(size_t size) {
+    return VarintSize(size) + size;
+}
+
+// Appends the key and the length of a length-delimited value; the value must follow.
+inline void AppendLengthPrefix(::proto_ng::ArrayWriter& output, uint32_t tag, size_t size) {
+    output.add_length_prefix(tag, size);
+}
+
+// Sub-messages are encoded with the sizes cached by the size pass.
+template<class Message>
+inline void AppendMessage(::proto_ng::ArrayWriter& output, uint32_t tag, const Message& value) {
+    AppendLengthPrefix(output, tag, value._CachedSize());
+    value._AppendTo(output);
+}
+
+// Packed repeated scalars: all the values in a single length-delimited record, varints or
+// little-endian fixed-size ones. Parsing reserves the capacity for them up front.
+template<class Vector, class Range>
+inline void AppendPacked(Vector& target, const Range& values) {
+    target.reserve(target.size() + values.size());
+    for (auto value : values)
+        target.push_back(static_cast<typename Vector::value_type>(value));
+}
+
+// Negative values are sign-extended to 64 bits.
+template<class Vector>
+inline size_t PackedVarintSize(const Vector& values) {
+    size_t size = 0;
+    for (auto value : values)
+        size += VarintSize(static_cast<int64_t>(value));
+    return size;
+}
+
+template<class Vector>
+inline void AppendPackedVarints(::proto_ng::ArrayWriter& output, uint32_t tag,
+                                const Vector& values) {
+    if (values.empty())
+        return;
+    AppendLengthPrefix(output, tag, PackedVarintSize(values));
+    for (auto value : values)
+        output.add_varint(static_cast<int64_t>(value));
+}
+
+// The sint values are zigzag-encoded.
+template<class Vector>
+inline size_t PackedZigZagSize(const Vector& values) {
+    size_t size = 0;
+    for (auto value : values)
+        size += VarintSize(protozero::encode_zigzag64(value));
+    return size;
+}
+
+template<class Vector>
+inline void AppendPackedZigZag(::proto_ng::ArrayWriter& output, uint32_t tag,
+                               const Vector& values) {
+    if (values.empty())
+        return;
+    AppendLengthPrefix(output, tag, PackedZigZagSize(values));
+    for (auto value : values)
+        output.add_varint(protozero::encode_zigzag64(value));
+}
+
+// The fixed-size values are copied as a block, both ways.
+template<class Vector>
+inline void DecodePackedFixed(Vector& target, protozero::data_view view) {
+    using Value = typename Vector::value_type;
+    if (view.size() % sizeof(Value) != 0)
+        throw protozero::end_of_buffer_exception();
+    if (view.empty())
+        return;
+    size_t count = target.size();
+    target.resize(count + view.size() / sizeof(Value));
+    memcpy(&target[count], view.data(), view.size());
+}
+
+template<class Vector>
+inline void AppendPackedFixed(::proto_ng::ArrayWriter& output, uint32_t tag,
+                              const Vector& values) {
+    if (values.empty())
+        return;
+    size_t size = values.size() * sizeof(typename Vector::value_type);
+    AppendLengthPrefix(output, tag, size);
+    output.append(reinterpret_cast<const char*>(values.data()), size);
+}
+
+// Lazy sub-message fields keep their encoded occurrences, see proto_ng::Lazy.
+template<class Bytes>
+inline void AppendLazy(Bytes& bytes, uint32_t tag, protozero::data_view view) {
+    protozero::write_varint(std::back_inserter(bytes), FieldKey(tag, WireType::length_delimited));
+    protozero::write_varint(std::back_inserter(bytes), view.size());
+    bytes.append(view.data(), view.size());
+}
+
+}
+'''
+
+    # The generic engine behind the "--table-driven" code: every message describes its
+    # fields with a table and these functions interpret it.
+    infra_table = r'''#pragma once
+#include <algorithm>
+#include <cstddef>
+#include <cstdint>
+#include <cstring>
+#include <string>
+
+#include <infra.h>
+#include <protozero/pbf_reader.hpp>
+#include <protozero/varint.hpp>
+
+// The field tables take offsetof() the Representations, which hold library types that need
+// not be standard-layout. That is conditionally-supported and works for anything without
+// virtual bases.
+#pragma GCC diagnostic ignored "-Winvalid-offsetof"
+
+namespace proto_ng {
+namespace table {
+
+enum Kind : uint8_t {
+    kInt32, kUInt32, kInt64, kUInt64, kSInt32, kSInt64, kFixed32, kFixed64, kSFixed32, kSFixed64,
+    kBool, kDouble, kFloat, kEnum, kString, kBytes, kWString, kMessage
+};
+
+// kPacked fields are repeated ones encoded packed (either encoding is accepted).
+enum Label : uint8_t { kSingular, kRepeated, kPacked, kMap };
+
+struct Container;
+struct OneOf;
+struct LazyOps;
+
+// The containers and the oneof fields have no presence bits (unless lazy).
+const uint32_t kNoPresence = ~0u;
+
+// The messages without the "cache_hash" option.
+const uint32_t kNoHash = ~0u;
+
+// The messages without "extensions" ranges.
+const uint32_t kNoExtensions = ~0u;
+
+struct Field {
+    uint32_t id;
+    uint32_t presence;              // the index of the presence bit, or kNoPresence
+    uint32_t offset;                // in the Representation
+    Kind kind;                      // of the values (the mapped values for maps)
+    Kind key_kind;                  // maps only
+    Label label;
+    int32_t default_value;          // enums only
+    const char* name;
+    const Message* sub;             // sub-messages only
+    const Container* container;     // repeated and map fields only
+    void (*append_enum)(debug::Output&, int32_t);
+    const LazyOps* lazy;            // lazy sub-messages only, 'offset' is the proto_ng::Lazy's
+    const OneOf* oneof;             // oneof fields only, 'offset' is the oneof's
+    uint32_t oneof_index;           // of the field in its oneof, from 1
+};
+
+// The fields are sorted by id.
+struct Message {
+    const Field* fields;
+    uint32_t field_count;
+    uint32_t presence_offset;
+    uint32_t presence_size;
+    uint32_t cached_size_offset;
+    uint32_t hash_offset;           // of the cached Hash(), or kNoHash
+    uint32_t extensions_offset;     // of the ExtensionSet, or kNoExtensions
+    const uint32_t* extension_ranges;   // the first and the last id of every range
+    uint32_t extension_range_count;
+    ExtensionRegistry& (*extension_registry)();
+    void* (*rep)(const void* message);
+};
+
+// The std::bitset of the table-driven messages, with a known layout. The bits are indexed
+// by Field::presence.
+template<size_t N>
+struct Presence {
+    uint32_t words[(N + 31) / 32] = {};
+
+    bool test(size_t bit) const { return (words[bit / 32] >> (bit % 32)) & 1; }
+    void set(size_t bit) { words[bit / 32] |= 1u << (bit % 32); }
+    void reset(size_t bit) { words[bit / 32] &= ~(1u << (bit % 32)); }
+    void reset() { memset(words, 0, sizeof(words)); }
+};
+
+inline void Merge(const Message& table, void* rep, const char* data, size_t size);
+inline size_t ByteSize(const Message& table, const void* rep);
+inline void Encode(const Message& table, const void* rep, ArrayWriter& output);
+inline int Compare(const Message& table, const void* a, const void* b);
+inline uint64_t Hash(const Message& table, const void* rep);
+inline void Clear(const Message& table, void* rep);
+inline void Print(const Message& table, const void* rep, debug::Output& out, int depth,
+                  bool single_line);
+
+//
+// Wire format helpers
+//
+inline size_t VarintSize(uint64_t value) {
+    size_t size = 1;
+    for (; value >= 0x80; value >>= 7)
+        ++size;
+    return size;
+}
+
+inline size_t LengthDelimitedSize(size_t size) {
+    return VarintSize(size) + size;
+}
+
+inline size_t KeySize(uint32_t id) {
+    return VarintSize(id << 3);
+}
+
+// The keys of the lazy bytes.
+inline void AppendLengthPrefix(std::string& output, uint32_t id, size_t size) {
+    protozero::add_varint_to_buffer(
+        &output, (id << 3) | static_cast<uint32_t>(protozero::pbf_wire_type::length_delimited));
+    protozero::add_varint_to_buffer(&output, size);
+}
+
+inline protozero::pbf_wire_type WireType(Kind kind) {
+    switch (kind) {
+    case kFixed64:
+    case kSFixed64:
+    case kDouble:
+        return protozero::pbf_wire_type::fixed64;
+    case kFixed32:
+    case kSFixed32:
+    case kFloat:
+        return protozero::pbf_wire_type::fixed32;
+    case kString:
+    case kBytes:
+    case kWString:
+    case kMessage:
+        return protozero::pbf_wire_type::length_delimited;
+    default:
+        return protozero::pbf_wire_type::varint;
+    }
+}
+
+// Repeated scalars and enums may come packed: all the values in one length-delimited record.
+inline bool IsPackable(const Field& field) {
+    return (field.label == kRepeated || field.label == kPacked) &&
+        WireType(field.kind) != protozero::pbf_wire_type::length_delimited;
+}
+
+inline protozero::pbf_wire_type WireType(const Field& field) {
+    if (field.label == kMap)
+        return protozero::pbf_wire_type::length_delimited;
+    return WireType(field.kind);
+}
+
+//
+// Field and message layout
+//
+
+// The lazy fields: the proto_ng::Lazy holds the value.
+struct LazyOps {
+    const void* (*get)(const void* lazy);
+    void* (*mutable_get)(void* lazy);
+    const std::string& (*bytes)(const void* lazy);
+    std::string& (*pending_bytes)(void* lazy);
+    void (*clear)(void* lazy);
+};
+
+template<class T>
+struct LazyField {
+    static const LazyOps ops;
+
+    static const void* Get(const void* lazy) { return &static_cast<const T*>(lazy)->get(); }
+    static void* MutableGet(void* lazy) { return &static_cast<T*>(lazy)->mutable_get(); }
+    static const std::string& Bytes(const void* lazy) {
+        return static_cast<const T*>(lazy)->bytes();
+    }
+    static std::string& PendingBytes(void* lazy) {
+        return static_cast<T*>(lazy)->pending_bytes();
+    }
+    static void Clear(void* lazy) { static_cast<T*>(lazy)->clear(); }
+};
+
+template<class T>
+const LazyOps LazyField<T>::ops = {
+    &LazyField::Get, &LazyField::MutableGet, &LazyField::Bytes, &LazyField::PendingBytes,
+    &LazyField::Clear
+};
+
+// The values of the lazy fields are decoded on the way.
+inline void* At(void* rep, const Field& field) {
+    void* member = static_cast<char*>(rep) + field.offset;
+    return field.lazy ? field.lazy->mutable_get(member) : member;
+}
+
+inline const void* At(const void* rep, const Field& field) {
+    const void* member = static_cast<const char*>(rep) + field.offset;
+    return field.lazy ? field.lazy->get(member) : member;
+}
+
+inline const std::string& LazyBytes(const Field& field, const void* rep) {
+    return field.lazy->bytes(static_cast<const char*>(rep) + field.offset);
+}
+
+inline uint32_t* PresenceWords(const Message& table, const void* rep) {
+    return reinterpret_cast<uint32_t*>(
+        const_cast<char*>(static_cast<const char*>(rep)) + table.presence_offset);
+}
+
+// The type-specific parts of the oneofs (see proto_ng::BasicOneOf).
+struct OneOf {
+    uint32_t (*index)(const void* oneof);
+    const void* (*get)(const void* oneof);
+    void* (*emplace)(void* oneof, uint32_t index);
+    void (*reset)(void* oneof);
+};
+
+template<class T>
+struct Union {
+    static const OneOf ops;
+
+    static uint32_t Index(const void* oneof) { return static_cast<const T*>(oneof)->index(); }
+    static const void* Get(const void* oneof) { return static_cast<const T*>(oneof)->data(); }
+    static void* Emplace(void* oneof, uint32_t index) {
+        return static_cast<T*>(oneof)->emplace(index);
+    }
+    static void Reset(void* oneof) { static_cast<T*>(oneof)->reset(); }
+};
+
+template<class T>
+const OneOf Union<T>::ops = {&Union::Index, &Union::Get, &Union::Emplace, &Union::Reset};
+
+inline bool Has(const Message& table, const void* rep, const Field& field) {
+    if (field.oneof)
+        return field.oneof->index(At(rep, field)) == field.oneof_index;
+    return (PresenceWords(table, rep)[field.presence / 32] >> (field.presence % 32)) & 1;
+}
+
+// The value of a singular field: the oneof fields are in their oneof's storage.
+inline const void* Get(const void* rep, const Field& field) {
+    return field.oneof ? field.oneof->get(At(rep, field)) : At(rep, field);
+}
+
+// ... and for writing, which makes the oneof fields the set ones.
+inline void* Mutable(void* rep, const Field& field) {
+    return field.oneof ? field.oneof->emplace(At(rep, field), field.oneof_index) : At(rep, field);
+}
+
+// The set field of the oneof of 'field', or nullptr.
+inline const Field* SetField(const Message& table, const void* rep, const Field& field) {
+    uint32_t index = field.oneof->index(At(rep, field));
+    for (uint32_t i = 0; index && i < table.field_count; ++i) {
+        const Field& other = table.fields[i];
+        if (other.oneof && other.offset == field.offset && other.oneof_index == index)
+            return &other;
+    }
+    return nullptr;
+}
+
+inline void SetPresent(const Message& table, void* rep, const Field& field) {
+    if (field.presence != kNoPresence)
+        PresenceWords(table, rep)[field.presence / 32] |= 1u << (field.presence % 32);
+}
+
+// The size is cached by the size pass and consumed by the encoding one.
+inline const Cached<size_t>& CachedSize(const Message& table, const void* rep) {
+    return *reinterpret_cast<const Cached<size_t>*>(
+        static_cast<const char*>(rep) + table.cached_size_offset);
+}
+
+// Every change to the message drops the hash cached by Hash().
+inline void ResetHash(const Message& table, void* rep) {
+    if (table.hash_offset != kNoHash)
+        reinterpret_cast<const Cached<uint64_t>*>(static_cast<char*>(rep) + table.hash_offset)
+            ->store(0);
+}
+
+inline ExtensionSet& Extensions(const Message& table, const void* rep) {
+    return *reinterpret_cast<ExtensionSet*>(
+        const_cast<char*>(static_cast<const char*>(rep)) + table.extensions_offset);
+}
+
+inline bool IsExtension(const Message& table, uint32_t id) {
+    for (uint32_t i = 0; i < table.extension_range_count; ++i) {
+        if (id >= table.extension_ranges[2 * i] && id <= table.extension_ranges[2 * i + 1])
+            return true;
+    }
+    return false;
+}
+
+inline int32_t EnumValue(const void* value) {
+    int32_t rv;
+    memcpy(&rv, value, sizeof(rv));
+    return rv;
+}
+
+template<class T>
+inline int Compare(const T& a, const T& b) {
+    return a < b ? -1 : (b < a ? 1 : 0);
+}
+
+template<class Enum>
+void AppendEnum(debug::Output& out, int32_t value) {
+    debug::AppendValue(out, static_cast<Enum>(value));
+}
+
+//
+// Values of every kind: 'field' only matters to the sub-messages and enums
+//
+inline void DecodeValue(const Field& field, Kind kind, void* value,
+                        protozero::pbf_reader& reader) {
+    switch (kind) {
+    case kInt32:
+        *static_cast<int32_t*>(value) = reader.get_int32();
+        break;
+    case kUInt32:
+        *static_cast<uint32_t*>(value) = reader.get_uint32();
+        break;
+    case kInt64:
+        *static_cast<int64_t*>(value) = reader.get_int64();
+        break;
+    case kUInt64:
+        *static_cast<uint64_t*>(value) = reader.get_uint64();
+        break;
+    case kSInt32:
+        *static_cast<int32_t*>(value) = reader.get_sint32();
+        break;
+    case kSInt64:
+        *static_cast<int64_t*>(value) = reader.get_sint64();
+        break;
+    case kFixed32:
+        *static_cast<uint32_t*>(value) = reader.get_fixed32();
+        break;
+    case kFixed64:
+        *static_cast<uint64_t*>(value) = reader.get_fixed64();
+        break;
+    case kSFixed32:
+        *static_cast<int32_t*>(value) = reader.get_sfixed32();
+        break;
+    case kSFixed64:
+        *static_cast<int64_t*>(value) = reader.get_sfixed64();
+        break;
+    case kBool:
+        *static_cast<bool*>(value) = reader.get_bool();
+        break;
+    case kDouble:
+        *static_cast<double*>(value) = reader.get_double();
+        break;
+    case kFloat:
+        *static_cast<float*>(value) = reader.get_float();
+        break;
+    case kEnum: {
+        int32_t v = reader.get_enum();
+        memcpy(value, &v, sizeof(v));
+        break;
+    }
+    case kString:
+    case kBytes: {
+        auto view = reader.get_view();
+        static_cast<std::string*>(value)->assign(view.data(), view.size());
+        break;
+    }
+    case kWString: {
+        // wstring values travel as their raw wchar_t bytes.
+        auto view = reader.get_view();
+        auto& target = *static_cast<std::wstring*>(value);
+        target.resize(view.size() / sizeof(wchar_t));
+        memcpy(&target[0], view.data(), target.size() * sizeof(wchar_t));
+        break;
+    }
+    case kMessage: {
+        auto view = reader.get_view();
+        Merge(*field.sub, field.sub->rep(value), view.data(), view.size());
+        break;
+    }
+    }
+}
+
+// The encoded size sans the key. Sub-messages either compute (and cache) their sizes or
+// return the cached ones.
+inline size_t ValueSize(const Field& field, Kind kind, const void* value, bool cached) {
+    switch (kind) {
+    case kInt32:
+        return VarintSize(static_cast<int64_t>(*static_cast<const int32_t*>(value)));
+    case kUInt32:
+        return VarintSize(*static_cast<const uint32_t*>(value));
+    case kInt64:
+        return VarintSize(*static_cast<const int64_t*>(value));
+    case kUInt64:
+        return VarintSize(*static_cast<const uint64_t*>(value));
+    case kSInt32:
+        return VarintSize(protozero::encode_zigzag32(*static_cast<const int32_t*>(value)));
+    case kSInt64:
+        return VarintSize(protozero::encode_zigzag64(*static_cast<const int64_t*>(value)));
+    case kBool:
+        return 1;
+    case kFixed64:
+    case kSFixed64:
+    case kDouble:
+        return 8;
+    case kFixed32:
+    case kSFixed32:
+    case kFloat:
+        return 4;
+    case kEnum:
+        return VarintSize(static_cast<int64_t>(EnumValue(value)));
+    case kString:
+    case kBytes:
+        return LengthDelimitedSize(static_cast<const std::string*>(value)->size());
+    case kWString:
+        return LengthDelimitedSize(
+            static_cast<const std::wstring*>(value)->size() * sizeof(wchar_t));
+    case kMessage: {
+        const void* rep = field.sub->rep(value);
+        return LengthDelimitedSize(cached ? CachedSize(*field.sub, rep).load()
+                                          : ByteSize(*field.sub, rep));
+    }
+    }
+    return 0;
+}
+
+inline void EncodeValue(const Field& field, Kind kind, uint32_t id, const void* value,
+                        ArrayWriter& output) {
+    switch (kind) {
+    case kInt32:
+        output.add_int32(id, *static_cast<const int32_t*>(value));
+        break;
+    case kUInt32:
+        output.add_uint32(id, *static_cast<const uint32_t*>(value));
+        break;
+    case kInt64:
+        output.add_int64(id, *static_cast<const int64_t*>(value));
+        break;
+    case kUInt64:
+        output.add_uint64(id, *static_cast<const uint64_t*>(value));
+        break;
+    case kSInt32:
+        output.add_sint32(id, *static_cast<const int32_t*>(value));
+        break;
+    case kSInt64:
+        output.add_sint64(id, *static_cast<const int64_t*>(value));
+        break;
+    case kFixed32:
+        output.add_fixed32(id, *static_cast<const uint32_t*>(value));
+        break;
+    case kFixed64:
+        output.add_fixed64(id, *static_cast<const uint64_t*>(value));
+        break;
+    case kSFixed32:
+        output.add_sfixed32(id, *static_cast<const int32_t*>(value));
+        break;
+    case kSFixed64:
+        output.add_sfixed64(id, *static_cast<const int64_t*>(value));
+        break;
+    case kBool:
+        output.add_bool(id, *static_cast<const bool*>(value));
+        break;
+    case kDouble:
+        output.add_double(id, *static_cast<const double*>(value));
+        break;
+    case kFloat:
+        output.add_float(id, *static_cast<const float*>(value));
+        break;
+    case kEnum:
+        output.add_enum(id, EnumValue(value));
+        break;
+    case kString:
+    case kBytes: {
+        auto& str = *static_cast<const std::string*>(value);
+        output.add_string(id, str.data(), str.size());
+        break;
+    }
+    case kWString: {
+        auto& str = *static_cast<const std::wstring*>(value);
+        output.add_bytes(id, reinterpret_cast<const char*>(str.data()),
+                         str.size() * sizeof(wchar_t));
+        break;
+    }
+    case kMessage: {
+        const void* rep = field.sub->rep(value);
+        output.add_length_prefix(id, CachedSize(*field.sub, rep).load());
+        Encode(*field.sub, rep, output);
+        break;
+    }
+    }
+}
+
+//
+// Packed values: varints or little-endian fixed-size ones, without keys
+//
+inline size_t FixedWidth(Kind kind) {
+    switch (kind) {
+    case kFixed64:
+    case kSFixed64:
+    case kDouble:
+        return 8;
+    case kFixed32:
+    case kSFixed32:
+    case kFloat:
+        return 4;
+    default:
+        return 0;
+    }
+}
+
+// The number of values in the record, for reserving the capacity.
+inline size_t PackedCount(Kind kind, const char* data, const char* end) {
+    if (size_t width = FixedWidth(kind))
+        return (end - data) / width;
+    size_t count = 0;
+    for (; data < end; ++data)
+        count += (*data & 0x80) == 0;
+    return count;
+}
+
+inline void DecodePackedValue(Kind, bool* value, const char** data, const char* end) {
+    *value = protozero::decode_varint(data, end) != 0;
+}
+
+inline void DecodePackedValue(Kind kind, void* value, const char** data, const char* end) {
+    if (size_t width = FixedWidth(kind)) {
+        if (static_cast<size_t>(end - *data) < width)
+            throw protozero::end_of_buffer_exception();
+        memcpy(value, *data, width);
+        *data += width;
+        return;
+    }
+    uint64_t raw = protozero::decode_varint(data, end);
+    switch (kind) {
+    case kInt32:
+    case kUInt32:
+    case kEnum: {
+        uint32_t v = static_cast<uint32_t>(raw);
+        memcpy(value, &v, sizeof(v));
+        break;
+    }
+    case kSInt32: {
+        int32_t v = protozero::decode_zigzag32(static_cast<uint32_t>(raw));
+        memcpy(value, &v, sizeof(v));
+        break;
+    }
+    case kSInt64: {
+        int64_t v = protozero::decode_zigzag64(raw);
+        memcpy(value, &v, sizeof(v));
+        break;
+    }
+    default:
+        memcpy(value, &raw, sizeof(raw));
+        break;
+    }
+}
+
+// Negative values are sign-extended to 64 bits, the sint ones are zigzag-encoded.
+inline uint64_t VarintValue(Kind kind, const void* value) {
+    switch (kind) {
+    case kInt32:
+    case kEnum:
+        return static_cast<uint64_t>(static_cast<int64_t>(EnumValue(value)));
+    case kUInt32:
+        return *static_cast<const uint32_t*>(value);
+    case kSInt32:
+        return protozero::encode_zigzag32(*static_cast<const int32_t*>(value));
+    case kSInt64:
+        return protozero::encode_zigzag64(*static_cast<const int64_t*>(value));
+    case kBool:
+        return *static_cast<const bool*>(value);
+    default:
+        return *static_cast<const uint64_t*>(value);
+    }
+}
+
+inline void EncodePackedValue(Kind, const bool* value, ArrayWriter& output) {
+    output.add_varint(*value);
+}
+
+inline void EncodePackedValue(Kind kind, const void* value, ArrayWriter& output) {
+    if (size_t width = FixedWidth(kind)) {
+        output.append(static_cast<const char*>(value), width);
+    } else {
+        output.add_varint(VarintValue(kind, value));
+    }
+}
+
+inline int CompareValue(const Field& field, Kind kind, const void* a, const void* b) {
+    switch (kind) {
+    case kInt32:
+    case kSInt32:
+    case kSFixed32:
+        return Compare(*static_cast<const int32_t*>(a), *static_cast<const int32_t*>(b));
+    case kUInt32:
+    case kFixed32:
+        return Compare(*static_cast<const uint32_t*>(a), *static_cast<const uint32_t*>(b));
+    case kInt64:
+    case kSInt64:
+    case kSFixed64:
+        return Compare(*static_cast<const int64_t*>(a), *static_cast<const int64_t*>(b));
+    case kUInt64:
+    case kFixed64:
+        return Compare(*static_cast<const uint64_t*>(a), *static_cast<const uint64_t*>(b));
+    case kBool:
+        return Compare(*static_cast<const bool*>(a), *static_cast<const bool*>(b));
+    case kDouble:
+        return Compare(*static_cast<const double*>(a), *static_cast<const double*>(b));
+    case kFloat:
+        return Compare(*static_cast<const float*>(a), *static_cast<const float*>(b));
+    case kEnum:
+        return Compare(EnumValue(a), EnumValue(b));
+    case kString:
+    case kBytes: {
+        int rv = static_cast<const std::string*>(a)->compare(*static_cast<const std::string*>(b));
+        return Compare(rv, 0);
+    }
+    case kWString: {
+        int rv =
+            static_cast<const std::wstring*>(a)->compare(*static_cast<const std::wstring*>(b));
+        return Compare(rv, 0);
+    }
+    case kMessage:
+        return table::Compare(*field.sub, field.sub->rep(a), field.sub->rep(b));
+    }
+    return 0;
+}
+
+// Consistent with CompareValue(): the values that compare equal hash the same.
+inline uint64_t HashValue(const Field& field, Kind kind, const void* value, uint64_t seed) {
+    switch (kind) {
+    case kInt32:
+    case kSInt32:
+    case kSFixed32:
+        return HashMix(seed, static_cast<uint64_t>(*static_cast<const int32_t*>(value)));
+    case kUInt32:
+    case kFixed32:
+        return HashMix(seed, *static_cast<const uint32_t*>(value));
+    case kInt64:
+    case kSInt64:
+    case kSFixed64:
+        return HashMix(seed, static_cast<uint64_t>(*static_cast<const int64_t*>(value)));
+    case kUInt64:
+    case kFixed64:
+        return HashMix(seed, *static_cast<const uint64_t*>(value));
+    case kBool:
+        return HashMix(seed, *static_cast<const bool*>(value));
+    case kDouble:
+        return HashFloat(seed, *static_cast<const double*>(value));
+    case kFloat:
+        return HashFloat(seed, *static_cast<const float*>(value));
+    case kEnum:
+        return HashMix(seed, static_cast<uint64_t>(EnumValue(value)));
+    case kString:
+    case kBytes: {
+        auto& s = *static_cast<const std::string*>(value);
+        return HashBytes(seed, s.data(), s.size());
+    }
+    case kWString: {
+        auto& s = *static_cast<const std::wstring*>(value);
+        return HashBytes(seed, s.data(), s.size() * sizeof(wchar_t));
+    }
+    case kMessage:
+        return HashMix(seed, table::Hash(*field.sub, field.sub->rep(value)));
+    }
+    return seed;
+}
+
+// Appends the value of anything but a sub-message.
+inline void AppendValue(const Field& field, Kind kind, const void* value, debug::Output& out) {
+    switch (kind) {
+    case kInt32:
+    case kSInt32:
+    case kSFixed32:
+        debug::AppendValue(out, *static_cast<const int32_t*>(value));
+        break;
+    case kUInt32:
+    case kFixed32:
+        debug::AppendValue(out, *static_cast<const uint32_t*>(value));
+        break;
+    case kInt64:
+    case kSInt64:
+    case kSFixed64:
+        debug::AppendValue(out, *static_cast<const int64_t*>(value));
+        break;
+    case kUInt64:
+    case kFixed64:
+        debug::AppendValue(out, *static_cast<const uint64_t*>(value));
+        break;
+    case kBool:
+        debug::AppendValue(out, *static_cast<const bool*>(value));
+        break;
+    case kDouble:
+        debug::AppendValue(out, *static_cast<const double*>(value));
+        break;
+    case kFloat:
+        debug::AppendValue(out, *static_cast<const float*>(value));
+        break;
+    case kEnum:
+        field.append_enum(out, EnumValue(value));
+        break;
+    case kString:
+    case kBytes:
+        debug::AppendValue(out, *static_cast<const std::string*>(value));
+        break;
+    case kWString:
+        debug::AppendValue(out, *static_cast<const std::wstring*>(value));
+        break;
+    case kMessage:
+        break;
+    }
+}
+
+// Prints "name: value", or "name { ... }" for the sub-messages.
+inline void PrintField(const Field& field, Kind kind, const void* value, const char* name,
+                       debug::Output& out, int depth, bool single_line) {
+    if (kind == kMessage) {
+        debug::Open(out, depth, single_line, name);
+        Print(*field.sub, field.sub->rep(value), out, depth + 1, single_line);
+        debug::Close(out, depth, single_line);
+        return;
+    }
+    debug::Name(out, depth, single_line, name);
+    AppendValue(field, kind, value, out);
+    debug::Separator(out, single_line);
+}
+
+//
+// Containers: the type-specific parts of the repeated and map fields
+//
+struct Container {
+    // Decodes one element (or map entry).
+    void (*merge)(const Field& field, void* container, protozero::pbf_reader& reader);
+    // Decodes a packed record of elements.
+    void (*merge_packed)(const Field& field, void* container, protozero::pbf_reader& reader);
+    size_t (*byte_size)(const Field& field, const void* container);
+    void (*encode)(const Field& field, const void* container, ArrayWriter& output);
+    int (*compare)(const Field& field, const void* a, const void* b);
+    uint64_t (*hash)(const Field& field, const void* container, uint64_t seed);
+    void (*print)(const Field& field, const void* container, debug::Output& out, int depth,
+                  bool single_line);
+    void (*clear)(void* container);
+};
+
+template<class Vector>
+struct Repeated {
+    static const Container ops;
+
+    static void Merge(const Field& field, void* container, protozero::pbf_reader& reader) {
+        typename Vector::value_type value{};
+        DecodeValue(field, field.kind, &value, reader);
+        static_cast<Vector*>(container)->push_back(std::move(value));
+    }
+
+    static void MergePacked(const Field& field, void* container, protozero::pbf_reader& reader) {
+        auto view = reader.get_view();
+        const char* data = view.data();
+        const char* end = data + view.size();
+        auto& values = *static_cast<Vector*>(container);
+        values.reserve(values.size() + PackedCount(field.kind, data, end));
+        while (data < end) {
+            typename Vector::value_type value{};
+            DecodePackedValue(field.kind, &value, &data, end);
+            values.push_back(std::move(value));
+        }
+    }
+
+    static size_t PackedSize(const Field& field, const Vector& values) {
+        if (size_t width = FixedWidth(field.kind))
+            return values.size() * width;
+        size_t size = 0;
+        for (typename Vector::value_type value : values)
+            size += ValueSize(field, field.kind, &value, false);
+        return size;
+    }
+
+    static size_t ByteSize(const Field& field, const void* container) {
+        auto& values = *static_cast<const Vector*>(container);
+        if (field.label == kPacked)
+            return values.empty() ? 0 :
+                KeySize(field.id) + LengthDelimitedSize(PackedSize(field, values));
+        if (size_t width = FixedWidth(field.kind))
+            return values.size() * (KeySize(field.id) + width);
+        size_t size = 0;
+        for (auto&& value : values)
+            size += KeySize(field.id) + ValueSize(field, field.kind, &value, false);
+        return size;
+    }
+
+    static void Encode(const Field& field, const void* container, ArrayWriter& output) {
+        auto& values = *static_cast<const Vector*>(container);
+        if (field.label == kPacked) {
+            if (values.empty())
+                return;
+            output.add_length_prefix(field.id, PackedSize(field, values));
+            for (typename Vector::value_type value : values)
+                EncodePackedValue(field.kind, &value, output);
+            return;
+        }
+        for (auto&& value : values)
+            EncodeValue(field, field.kind, field.id, &value, output);
+    }
+
+    static int Compare(const Field& field, const void* a, const void* b) {
+        auto& x = *static_cast<const Vector*>(a);
+        auto& y = *static_cast<const Vector*>(b);
+        for (size_t i = 0; i < x.size() && i < y.size(); ++i) {
+            auto&& x_value = x[i];
+            auto&& y_value = y[i];
+            if (int rv = CompareValue(field, field.kind, &x_value, &y_value))
+                return rv;
+        }
+        return table::Compare(x.size(), y.size());
+    }
+
+    static uint64_t Hash(const Field& field, const void* container, uint64_t seed) {
+        for (auto&& value : *static_cast<const Vector*>(container))
+            seed = HashValue(field, field.kind, &value, seed);
+        return HashMix(seed, static_cast<const Vector*>(container)->size());
+    }
+
+    static void Print(const Field& field, const void* container, debug::Output& out, int depth,
+                      bool single_line) {
+        for (auto&& value : *static_cast<const Vector*>(container))
+            PrintField(field, field.kind, &value, field.name, out, depth, single_line);
+    }
+
+    static void Clear(void* container) {
+        static_cast<Vector*>(container)->clear();
+    }
+};
+
+template<class Vector>
+const Container Repeated<Vector>::ops = {
+    &Repeated::Merge, &Repeated::MergePacked, &Repeated::ByteSize, &Repeated::Encode,
+    &Repeated::Compare, &Repeated::Hash, &Repeated::Print, &Repeated::Clear
+};
+
+// Map entries are sub-messages with the key as field 1 and the value as field 2.
+template<class Map>
+struct Mapped {
+    static const Container ops;
+
+    static size_t EntrySize(const Field& field, const typename Map::value_type& entry,
+                            bool cached) {
+        return KeySize(1) + ValueSize(field, field.key_kind, &entry.first, cached) +
+            KeySize(2) + ValueSize(field, field.kind, &entry.second, cached);
+    }
+
+    static void Merge(const Field& field, void* container, protozero::pbf_reader& reader) {
+        typename Map::key_type key{};
+        typename Map::mapped_type value{};
+        protozero::pbf_reader entry = reader.get_message();
+        while (entry.next()) {
+            if (entry.tag() == 1 && entry.wire_type() == WireType(field.key_kind)) {
+                DecodeValue(field, field.key_kind, &key, entry);
+            } else if (entry.tag() == 2 && entry.wire_type() == WireType(field.kind)) {
+                DecodeValue(field, field.kind, &value, entry);
+            } else {
+                entry.skip();
+            }
+        }
+        (*static_cast<Map*>(container))[std::move(key)] = std::move(value);
+    }
+
+    static size_t ByteSize(const Field& field, const void* container) {
+        size_t size = 0;
+        for (const auto& entry : *static_cast<const Map*>(container))
+            size += KeySize(field.id) + LengthDelimitedSize(EntrySize(field, entry, false));
+        return size;
+    }
+
+    static void Encode(const Field& field, const void* container, ArrayWriter& output) {
+        for (const auto& entry : *static_cast<const Map*>(container)) {
+            output.add_length_prefix(field.id, EntrySize(field, entry, true));
+            EncodeValue(field, field.key_kind, 1, &entry.first, output);
+            EncodeValue(field, field.kind, 2, &entry.second, output);
+        }
+    }
+
+    static int CompareEntries(const Field& field, const typename Map::value_type& x,
+                              const typename Map::value_type& y) {
+        if (int rv = CompareValue(field, field.key_kind, &x.first, &y.first))
+            return rv;
+        return CompareValue(field, field.kind, &x.second, &y.second);
+    }
+
+    static int Compare(const Field& field, const void* a, const void* b) {
+        auto& x = *static_cast<const Map*>(a);
+        auto& y = *static_cast<const Map*>(b);
+        if (!IsOrderedMap<Map>::value) {
+            auto x_entries = SortedEntries(x), y_entries = SortedEntries(y);
+            for (size_t i = 0; i < x_entries.size() && i < y_entries.size(); ++i) {
+                if (int rv = CompareEntries(field, *x_entries[i], *y_entries[i]))
+                    return rv;
+            }
+            return table::Compare(x.size(), y.size());
+        }
+        auto x_it = x.begin(), y_it = y.begin();
+        for (; x_it != x.end() && y_it != y.end(); ++x_it, ++y_it) {
+            if (int rv = CompareEntries(field, *x_it, *y_it))
+                return rv;
+        }
+        return table::Compare(x.size(), y.size());
+    }
+
+    // Regardless of the order of the entries.
+    static uint64_t Hash(const Field& field, const void* container, uint64_t seed) {
+        uint64_t sum = 0;
+        for (const auto& entry : *static_cast<const Map*>(container))
+            sum += HashValue(field, field.kind, &entry.second,
+                             HashValue(field, field.key_kind, &entry.first, 0));
+        return HashMix(HashMix(seed, sum), static_cast<const Map*>(container)->size());
+    }
+
+    static void Print(const Field& field, const void* container, debug::Output& out, int depth,
+                      bool single_line) {
+        for (const auto* sorted : SortedEntries(*static_cast<const Map*>(container))) {
+            const auto& entry = *sorted;
+            debug::Open(out, depth, single_line, field.name);
+            PrintField(field, field.key_kind, &entry.first, "key", out, depth + 1, single_line);
+            PrintField(field, field.kind, &entry.second, "value", out, depth + 1, single_line);
+            debug::Close(out, depth, single_line);
+        }
+    }
+
+    static void Clear(void* container) {
+        static_cast<Map*>(container)->clear();
+    }
+};
+
+template<class Map>
+const Container Mapped<Map>::ops = {
+    &Mapped::Merge, nullptr, &Mapped::ByteSize, &Mapped::Encode,
+    &Mapped::Compare, &Mapped::Hash, &Mapped::Print, &Mapped::Clear
+};
+
+//
+// Messages
+//
+
+// Fields mostly arrive in order, so the one after the last match ('hint') goes first.
+inline const Field* FindField(const Message& table, uint32_t id, uint32_t& hint) {
+    if (hint < table.field_count && table.fields[hint].id == id)
+        return &table.fields[hint++];
+
+    const Field* end = table.fields + table.field_count;
+    const Field* field = std::lower_bound(
+        table.fields, end, id, [](const Field& f, uint32_t id) { return f.id < id; });
+    if (field == end || field->id != id)
+        return nullptr;
+    hint = static_cast<uint32_t>(field - table.fields) + 1;
+    return field;
+}
+
+inline void Merge(const Message& table, void* rep, const char* data, size_t size) {
+    ResetHash(table, rep);
+    protozero::pbf_reader reader(data, size);
+    uint32_t hint = 0;
+    while (reader.next()) {
+        const Field* field = FindField(table, reader.tag(), hint);
+        if (field && reader.wire_type() == protozero::pbf_wire_type::length_delimited &&
+            IsPackable(*field)) {
+            field->container->merge_packed(*field, At(rep, *field), reader);
+            continue;
+        }
+        if (!field && reader.wire_type() == protozero::pbf_wire_type::length_delimited &&
+            IsExtension(table, reader.tag())) {
+            // Only the sub-message extensions are kept.
+            auto view = reader.get_view();
+            Extensions(table, rep).Merge(reader.tag(), view.data(), view.size());
+            continue;
+        }
+        if (!field || reader.wire_type() != WireType(*field)) {
+            reader.skip();
+            continue;
+        }
+
+        if (field->lazy &&
+            (!Has(table, rep, *field) || !LazyBytes(*field, rep).empty())) {
+            // Once decoded (or set), the field merges the new occurrences right away.
+            auto view = reader.get_view();
+            std::string& bytes =
+                field->lazy->pending_bytes(static_cast<char*>(rep) + field->offset);
+            AppendLengthPrefix(bytes, field->id, view.size());
+            bytes.append(view.data(), view.size());
+        } else if (field->container) {
+            field->container->merge(*field, At(rep, *field), reader);
+        } else {
+            DecodeValue(*field, field->kind, Mutable(rep, *field), reader);
+        }
+        SetPresent(table, rep, *field);
+    }
+}
+
+inline size_t ByteSize(const Message& table, const void* rep) {
+    size_t size = 0;
+    for (uint32_t i = 0; i < table.field_count; ++i) {
+        const Field& field = table.fields[i];
+        if (field.lazy && !LazyBytes(field, rep).empty()) {
+            size += LazyBytes(field, rep).size();
+        } else if (field.container) {
+            size += field.container->byte_size(field, At(rep, field));
+        } else if (Has(table, rep, field)) {
+            size += KeySize(field.id) + ValueSize(field, field.kind, Get(rep, field), false);
+        }
+    }
+    if (table.extensions_offset != kNoExtensions)
+        size += Extensions(table, rep).ByteSize();
+    CachedSize(table, rep).store(size);
+    return size;
+}
+
+inline void Encode(const Message& table, const void* rep, ArrayWriter& output) {
+    for (uint32_t i = 0; i < table.field_count; ++i) {
+        const Field& field = table.fields[i];
+        if (field.lazy && !LazyBytes(field, rep).empty()) {
+            // Untouched sub-messages are copied as they came.
+            output.append(LazyBytes(field, rep).data(), LazyBytes(field, rep).size());
+        } else if (field.container) {
+            field.container->encode(field, At(rep, field), output);
+        } else if (Has(table, rep, field)) {
+            EncodeValue(field, field.kind, field.id, Get(rep, field), output);
+        }
+    }
+    if (table.extensions_offset != kNoExtensions)
+        Extensions(table, rep).Encode(output);
+}
+
+inline int Compare(const Message& table, const void* a, const void* b) {
+    for (uint32_t i = 0; i < table.field_count; ++i) {
+        const Field& field = table.fields[i];
+        if (field.oneof) {
+            // A oneof compares at its first field: by the set field, then by its value.
+            if (field.oneof_index != 1)
+                continue;
+            const Field* x = SetField(table, a, field);
+            const Field* y = SetField(table, b, field);
+            int rv = Compare(x ? x->oneof_index : 0u, y ? y->oneof_index : 0u);
+            if (rv == 0 && x)
+                rv = CompareValue(*x, x->kind, Get(a, *x), Get(b, *x));
+            if (rv)
+                return rv;
+            continue;
+        }
+        int rv = field.container ?
+            field.container->compare(field, At(a, field), At(b, field)) :
+            CompareValue(field, field.kind, At(a, field), At(b, field));
+        if (rv)
+            return rv;
+    }
+    if (table.extensions_offset != kNoExtensions)
+        return Extensions(table, a).Compare(Extensions(table, b), table.extension_registry());
+    return 0;
+}
+
+inline uint64_t Hash(const Message& table, const void* rep) {
+    uint64_t hash = 0;
+    for (uint32_t i = 0; i < table.field_count; ++i) {
+        const Field& field = table.fields[i];
+        if (field.oneof) {
+            // At its first field, as the generated code does.
+            if (field.oneof_index == 1) {
+                const Field* set = SetField(table, rep, field);
+                hash = HashMix(hash, set ? set->oneof_index : 0);
+                if (set)
+                    hash = HashValue(*set, set->kind, Get(rep, *set), hash);
+            }
+            continue;
+        }
+        hash = field.container ?
+            field.container->hash(field, At(rep, field), hash) :
+            HashValue(field, field.kind, At(rep, field), hash);
+    }
+    if (table.extensions_offset != kNoExtensions)
+        hash = Extensions(table, rep).Hash(hash);
+    return hash;
+}
+
+// Keeps the capacity of the strings and containers.
+inline void Clear(const Message& table, void* rep) {
+    ResetHash(table, rep);
+    for (uint32_t i = 0; i < table.field_count; ++i) {
+        const Field& field = table.fields[i];
+        if (field.lazy) {
+            field.lazy->clear(static_cast<char*>(rep) + field.offset);
+            continue;
+        }
+        void* value = At(rep, field);
+        if (field.container) {
+            field.container->clear(value);
+            continue;
+        }
+        if (field.oneof) {
+            field.oneof->reset(value);
+            continue;
+        }
+
+        switch (field.kind) {
+        case kInt32:
+        case kUInt32:
+        case kSInt32:
+        case kFixed32:
+        case kSFixed32:
+        case kFloat:
+            memset(value, 0, 4);
+            break;
+        case kInt64:
+        case kUInt64:
+        case kSInt64:
+        case kFixed64:
+        case kSFixed64:
+        case kDouble:
+            memset(value, 0, 8);
+            break;
+        case kBool:
+            *static_cast<bool*>(value) = false;
+            break;
+        case kEnum:
+            memcpy(value, &field.default_value, sizeof(field.default_value));
+            break;
+        case kString:
+        case kBytes:
+            static_cast<std::string*>(value)->clear();
+            break;
+        case kWString:
+            static_cast<std::wstring*>(value)->clear();
+            break;
+        case kMessage:
+            if (Has(table, rep, field))
+                Clear(*field.sub, field.sub->rep(value));
+            break;
+        }
+    }
+    memset(PresenceWords(table, rep), 0, table.presence_size);
+    if (table.extensions_offset != kNoExtensions)
+        Extensions(table, rep).Clear();
+}
+
+inline void Print(const Message& table, const void* rep, debug::Output& out, int depth,
+                  bool single_line) {
+    for (uint32_t i = 0; i < table.field_count; ++i) {
+        const Field& field = table.fields[i];
+        if (field.container) {
+            field.container->print(field, At(rep, field), out, depth, single_line);
+        } else if (Has(table, rep, field)) {
+            PrintField(field, field.kind, Get(rep, field), field.name, out, depth,
+                       single_line);
+        }
+    }
+    if (table.extensions_offset != kNoExtensions)
+        Extensions(table, rep).Print(out, depth, single_line);
+}
+
+}  // table
+}  // proto_ng
+'''
+
+    # Support for the "--views" classes: lazily decoding, read-only views of serialized
+    # messages.
+    infra_view = r'''#pragma once
+#include <cstdint>
+#include <cstring>
+#include <iterator>
+#include <string>
+#include <type_traits>
+#include <utility>
+#if __cplusplus >= 201703L
+#include <string_view>
+#endif
+
+#include <protozero/pbf_reader.hpp>
+
+namespace proto_ng {
+namespace view {
+
+#if __cplusplus >= 201703L
+using string_view = std::string_view;
+#else
+using string_view = protozero::data_view;
+#endif
+
+// The values of the packed records: varints (zigzag-encoded for sint) or little-endian
+// fixed-size ones.
+template<class T>
+T DecodeVarint(const char** data, const char* end) {
+    return static_cast<T>(protozero::decode_varint(data, end));
+}
+
+template<class T>
+T DecodeZigZag(const char** data, const char* end) {
+    return static_cast<T>(protozero::decode_zigzag64(protozero::decode_varint(data, end)));
+}
+
+template<class T>
+T DecodeFixed(const char** data, const char* end) {
+    if (static_cast<size_t>(end - *data) < sizeof(T))
+        throw protozero::end_of_buffer_exception();
+    T value;
+    memcpy(&value, *data, sizeof(T));
+    *data += sizeof(T);
+    return value;
+}
+
+// Decoders: the value type, its wire type and the decoding function for every field type.
+// The scalars also decode the values of packed records.
+#define PROTO_NG_VIEW_DECODER(name, value_type, wire, getter, packed)                     \
+    struct name {                                                                         \
+        using type = value_type;                                                          \
+        static constexpr protozero::pbf_wire_type wire_type = protozero::pbf_wire_type::wire; \
+        static type get(protozero::pbf_reader& reader) { return reader.getter(); }       \
+        static type get_packed(const char** data, const char* end) {                      \
+            return packed<value_type>(data, end);                                         \
+        }                                                                                 \
+    };
+
+PROTO_NG_VIEW_DECODER(Int32, int32_t, varint, get_int32, DecodeVarint)
+PROTO_NG_VIEW_DECODER(UInt32, uint32_t, varint, get_uint32, DecodeVarint)
+PROTO_NG_VIEW_DECODER(Int64, int64_t, varint, get_int64, DecodeVarint)
+PROTO_NG_VIEW_DECODER(UInt64, uint64_t, varint, get_uint64, DecodeVarint)
+PROTO_NG_VIEW_DECODER(SInt32, int32_t, varint, get_sint32, DecodeZigZag)
+PROTO_NG_VIEW_DECODER(SInt64, int64_t, varint, get_sint64, DecodeZigZag)
+PROTO_NG_VIEW_DECODER(Fixed32, uint32_t, fixed32, get_fixed32, DecodeFixed)
+PROTO_NG_VIEW_DECODER(Fixed64, uint64_t, fixed64, get_fixed64, DecodeFixed)
+PROTO_NG_VIEW_DECODER(SFixed32, int32_t, fixed32, get_sfixed32, DecodeFixed)
+PROTO_NG_VIEW_DECODER(SFixed64, int64_t, fixed64, get_sfixed64, DecodeFixed)
+PROTO_NG_VIEW_DECODER(Bool, bool, varint, get_bool, DecodeVarint)
+PROTO_NG_VIEW_DECODER(Double, double, fixed64, get_double, DecodeFixed)
+PROTO_NG_VIEW_DECODER(Float, float, fixed32, get_float, DecodeFixed)
+#undef PROTO_NG_VIEW_DECODER
+
+// wstring values come as their raw wchar_t bytes.
+struct WString {
+    using type = protozero::data_view;
+    static constexpr protozero::pbf_wire_type wire_type =
+        protozero::pbf_wire_type::length_delimited;
+    static type get(protozero::pbf_reader& reader) { return reader.get_view(); }
+};
+
+struct String {
+    using type = string_view;
+    static constexpr protozero::pbf_wire_type wire_type =
+        protozero::pbf_wire_type::length_delimited;
+    static type get(protozero::pbf_reader& reader) {
+        auto view = reader.get_view();
+        return type(view.data(), view.size());
+    }
+};
+
+template<class Enum>
+struct EnumOf {
+    using type = Enum;
+    static constexpr protozero::pbf_wire_type wire_type = protozero::pbf_wire_type::varint;
+    static type get(protozero::pbf_reader& reader) {
+        return static_cast<Enum>(reader.get_enum());
+    }
+    static type get_packed(const char** data, const char* end) {
+        return static_cast<Enum>(DecodeVarint<int32_t>(data, end));
+    }
+};
+
+template<class View>
+struct MessageOf {
+    using type = View;
+    static constexpr protozero::pbf_wire_type wire_type =
+        protozero::pbf_wire_type::length_delimited;
+    static type get(protozero::pbf_reader& reader) { return View(reader.get_view()); }
+};
+
+inline bool Has(protozero::data_view data, uint32_t tag) {
+    protozero::pbf_reader reader(data);
+    return reader.next(tag);
+}
+
+// The last occurrence of a singular field wins, as with parsing.
+template<class Decoder>
+typename Decoder::type Get(protozero::data_view data, uint32_t tag,
+                           typename Decoder::type value) {
+    protozero::pbf_reader reader(data);
+    while (reader.next(tag)) {
+        if (reader.wire_type() == Decoder::wire_type) {
+            value = Decoder::get(reader);
+        } else {
+            reader.skip();
+        }
+    }
+    return value;
+}
+
+// Only the scalars come packed.
+template<class Decoder>
+using IsPackable = std::integral_constant<
+    bool, Decoder::wire_type != protozero::pbf_wire_type::length_delimited>;
+
+template<class Decoder>
+bool NextPacked(std::true_type, const char** data, const char* end,
+                typename Decoder::type& value) {
+    if (*data == end)
+        return false;
+    value = Decoder::get_packed(data, end);
+    return true;
+}
+
+template<class Decoder>
+bool NextPacked(std::false_type, const char**, const char*, typename Decoder::type&) {
+    return false;
+}
+
+// The occurrences of a repeated field, decoded while iterating. The scalars may come
+// packed, or even both ways.
+template<class Decoder>
+class Repeated {
+public:
+    using value_type = typename Decoder::type;
+
+    class iterator {
+    public:
+        using iterator_category = std::input_iterator_tag;
+        using value_type = typename Decoder::type;
+        using difference_type = std::ptrdiff_t;
+        using pointer = const value_type*;
+        using reference = const value_type&;
+
+        iterator() = default;
+        iterator(protozero::data_view data, uint32_t tag) : reader_(data), tag_(tag) {
+            ++*this;
+        }
+
+        reference operator*() const { return value_; }
+        pointer operator->() const { return &value_; }
+
+        iterator& operator++() {
+            if (NextPacked<Decoder>(IsPackable<Decoder>(), &packed_, packed_end_, value_))
+                return *this;
+            while (reader_.next(tag_)) {
+                if (reader_.wire_type() == Decoder::wire_type) {
+                    value_ = Decoder::get(reader_);
+                    return *this;
+                }
+                if (IsPackable<Decoder>::value &&
+                    reader_.wire_type() == protozero::pbf_wire_type::length_delimited) {
+                    auto record = reader_.get_view();
+                    packed_ = record.data();
+                    packed_end_ = record.data() + record.size();
+                    if (NextPacked<Decoder>(IsPackable<Decoder>(), &packed_, packed_end_, value_))
+                        return *this;
+                    continue;
+                }
+                reader_.skip();
+            }
+            at_end_ = true;
+            return *this;
+        }
+
+        iterator operator++(int) {
+            iterator rv = *this;
+            ++*this;
+            return rv;
+        }
+
+        // Iterators over the same data are equal when they are equally far from the end.
+        friend bool operator==(const iterator& a, const iterator& b) {
+            if (a.at_end_ || b.at_end_)
+                return a.at_end_ == b.at_end_;
+            return a.reader_.length() == b.reader_.length() && a.packed_ == b.packed_;
+        }
+        friend bool operator!=(const iterator& a, const iterator& b) { return !(a == b); }
+
+    private:
+        protozero::pbf_reader reader_;
+        uint32_t tag_ = 0;
+        const char* packed_ = nullptr;      // the rest of the current packed record
+        const char* packed_end_ = nullptr;
+        bool at_end_ = false;
+        value_type value_{};
+    };
+
+    Repeated(protozero::data_view data, uint32_t tag) : data_(data), tag_(tag) {}
+
+    iterator begin() const { return iterator(data_, tag_); }
+    iterator end() const {
+        iterator rv;
+        ++rv;
+        return rv;
+    }
+    bool empty() const { return begin() == end(); }
+    // Walks the whole message.
+    size_t size() const { return std::distance(begin(), end()); }
+
+private:
+    protozero::data_view data_;
+    uint32_t tag_;
+};
+
+// Map entries are sub-messages with the key as field 1 and the value as field 2.
+template<class KeyDecoder, class ValueDecoder>
+struct EntryOf {
+    using type = std::pair<typename KeyDecoder::type, typename ValueDecoder::type>;
+    static constexpr protozero::pbf_wire_type wire_type =
+        protozero::pbf_wire_type::length_delimited;
+
+    static type get(protozero::pbf_reader& reader) {
+        type entry{};
+        protozero::pbf_reader fields = reader.get_message();
+        while (fields.next()) {
+            if (fields.tag() == 1 && fields.wire_type() == KeyDecoder::wire_type) {
+                entry.first = KeyDecoder::get(fields);
+            } else if (fields.tag() == 2 && fields.wire_type() == ValueDecoder::wire_type) {
+                entry.second = ValueDecoder::get(fields);
+            } else {
+                fields.skip();
+            }
+        }
+        return entry;
+    }
+};
+
+template<class KeyDecoder, class ValueDecoder>
+using Map = Repeated<EntryOf<KeyDecoder, ValueDecoder>>;
+
+}  // view
+}  // proto_ng
+'''
@@ -0,0 +1,80 @@
+// Throughput of the generated codec: "make bench".
+#include <chrono>
+#include <cstdio>
+#include <string>
+
+#include <protozero/pbf_writer.hpp>
+
+#include <thing/thing.pbng.h>
+
+namespace {
+
+// An AddressBook with 'count' people, encoded by hand.
+std::string MakeAddressBook(int count) {
+  std::string data;
+  protozero::pbf_writer ab(data);
+  for (int i = 0; i < count; ++i) {
+    {
+      protozero::pbf_writer p(ab, 1);
+      p.add_string(1, "person #" + std::to_string(i));
+      p.add_int32(2, i);
+      p.add_string(3, "person" + std::to_string(i) + "@example.com");
+      for (int j = 0; j < 2; ++j) {
+        protozero::pbf_writer ph(p, 4);
+        ph.add_string(1, "+1-555-01" + std::to_string(i % 100));
+        ph.add_enum(2, j);
+      }
+      p.add_enum(11, 2);
+    }
+    ab.add_string(2, "tag" + std::to_string(i));
+    ab.add_int32(3, i * 7);
+    protozero::pbf_writer entry(ab, 4);
+    entry.add_int32(1, i);
+    entry.add_int64(2, i * 1000003LL);
+  }
+  return data;
+}
+
+template<class Fn>
+void Report(const char* name, size_t bytes, int iterations, Fn fn) {
+  fn();  // warm-up
+  auto start = std::chrono::steady_clock::now();
+  for (int i = 0; i < iterations; ++i)
+    fn();
+  std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+  printf("%-28s %8.1f MB/s %10.0f msg/s\n", name,
+         bytes * iterations / elapsed.count() / 1e6, iterations / elapsed.count());
+}
+
+}  // namespace
+
+int main() {
+  const std::string data = MakeAddressBook(1000);
+  printf("AddressBook: %zu bytes\n", data.size());
+
+  thing::AddressBook ab;
+  Report("ParseFromString", data.size(), 200, [&] {
+    if (!ab.ParseFromString(data))
+      abort();
+  });
+
+  Report("SerializeAsString", data.size(), 200, [&] {
+    if (ab.SerializeAsString().size() != data.size())
+      abort();
+  });
+  std::string output;
+  Report("SerializeToString (reused)", data.size(), 200, [&] {
+    if (!ab.SerializeToString(&output))
+      abort();
+  });
+
+  // Routing-style access: a single field of every person.
+  Report("View: every Person.id", data.size(), 200, [&] {
+    int64_t sum = 0;
+    for (const thing::PersonView& p : thing::AddressBookView(data).person_vec())
+      sum += p.id();
+    if (sum != 999 * 1000 / 2)
+      abort();
+  });
+  return 0;
+}
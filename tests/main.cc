@@ -1,15 +1,40 @@
+#include <atomic>
 #include <cassert>
+#include <cstdlib>
 #include <iostream>
+#if __cplusplus >= 201703L
+#include <memory_resource>
+#endif
+#include <new>
 #include <unordered_set>
+#include <vector>
 #include <set>
+#include <sstream>
+#include <thread>
 
 #include <protozero/pbf_reader.hpp>
+#include <protozero/pbf_writer.hpp>
 
+#include <thing/base.pbng.h>
 #include <thing/containers.pbng.h>
 #include <thing/ext.pbng.h>
 #include <thing/thing.pbng.h>
 #include <thing/foreign.pbng.h>
 
+// Counts the heap allocations to verify the allocation-free paths.
+std::atomic<size_t> allocations{0};
+
+void* operator new(size_t size) {
+  ++allocations;
+  if (void* ptr = malloc(size))
+    return ptr;
+  throw std::bad_alloc();
+}
+
+void operator delete(void* ptr) noexcept {
+  free(ptr);
+}
+
 namespace {
 
 void BasicAPI() {
@@ -32,6 +57,42 @@ void BasicAPI() {
   //assert(ab.person_vec().size() == ab.person_vec_size());
 }
 
+void StringAccessors() {
+  thing::Person p;
+  assert(p.email().empty() && !p.has_email());
+  using String = std::decay_t<decltype(p.mutable_email())>;  // std::pmr::string with --pmr
+
+  // The getter reads the field in place.
+  String email(100, 'x');
+  const char* data = email.data();
+  p.set_email(std::move(email));
+  assert(p.has_email() && p.email().data() == data && p.email().size() == 100);
+  p.mutable_email().resize(3);
+  assert(p.email() == "xxx" && p.email().data() == data);
+
+  const String copy = "bob@foobar";
+  p.set_email(copy);
+  assert(p.email() == copy);
+  p.set_email("alice@foobar");
+  assert(p.email() == "alice@foobar");
+#if __cplusplus >= 201703L
+  p.set_email(std::string_view("carol@foobar").substr(0, 5));
+  assert(p.email() == "carol");
+#endif
+
+  // Ownership transfer.
+  p.set_email("carol");
+  String released = p.release_email();
+  assert(released == "carol" && !p.has_email() && p.email().empty());
+  p.set_allocated_email(new String("dave@foobar"));
+  assert(p.has_email() && p.email() == "dave@foobar");
+  p.set_allocated_email(nullptr);
+  assert(!p.has_email());
+
+  p.set_wide_name(L"wide");
+  assert(p.wide_name() == L"wide" && p.release_wide_name() == L"wide" && !p.has_wide_name());
+}
+
 void Equality() {
   // Basic equality and total ordering.
   thing::Person p1, p2;
@@ -61,6 +122,23 @@ void Equality() {
   assert(m1 == m2);
   m1.member().set_field(0);
   assert(m1 == m2);
+
+  // The ordering is lexicographic, by field id.
+  thing::Person a, b;
+  a.set_name("b");
+  a.set_id(1);
+  b.set_name("a");
+  b.set_id(2);
+  assert(a.Compare(b) > 0 && b.Compare(a) < 0 && a.Compare(a) == 0);
+  assert(a > b && !(a < b) && b <= a && a != b);
+  b.set_name("b");
+  assert(a < b && !(b < a));
+  b.set_id(1);
+  assert(a == b && a.Compare(b) == 0);
+  a.add_phone_vec()->set_number("1");
+  assert(a > b);
+  b.add_phone_vec()->set_number("2");
+  assert(a < b);
 }
 
 void SetsHashes() {
@@ -102,14 +180,412 @@ void SetsHashes() {
   }
 }
 
+void FullHashes() {
+  // All the fields count, and equal messages hash the same.
+  thing::Person p1, p2;
+  assert(p1.Hash() == p2.Hash());
+  p1.set_email("a@b");
+  assert(p1.Hash() != p2.Hash());
+  p2.set_email("a@b");
+  assert(p1.Hash() == p2.Hash());
+  p1.phone_vec().emplace_back();
+  p1.phone_vec().back().set_number("555");
+  assert(p1.Hash() != p2.Hash());
+  p2.ParseFromString(p1.SerializeAsString());
+  assert(p1 == p2 && p1.Hash() == p2.Hash());
+
+  thing::AddressBook ab;
+  uint64_t empty = ab.Hash();
+  ab.person_map()[1] = p1;
+  assert(ab.Hash() != empty);
+  std::unordered_set<thing::AddressBook, proto_ng::MessageHash> dedup = {ab, ab};
+  assert(dedup.size() == 1);
+
+  // The cached hash follows the changes.
+  thing::Route r;
+  uint64_t h0 = r.Hash();
+  r.set_name("A7");
+  uint64_t h1 = r.Hash();
+  assert(h1 != h0 && r.Hash() == h1);
+  r.owner().set_id(3);
+  assert(r.Hash() != h1);
+  r.clear_owner();
+  assert(r.Hash() == h1);
+  r.stop_vec().emplace_back();
+  r.stop_vec().back().set_x(1);
+  uint64_t h2 = r.Hash();
+  assert(h2 != h1);
+  thing::Route copy;
+  assert(copy.Hash() == h0);
+  copy.ParseFromString(r.SerializeAsString());
+  assert(copy.Hash() == h2);
+  copy.Clear();
+  assert(copy.Hash() == h0);
+
+  // The writes through a reference kept across Hash() need an explicit invalidation.
+  thing::Route fresh = r;
+  auto& owner = r.owner();
+  auto& stops = r.stop_vec();
+  assert(r.Hash() == h2);
+  owner.set_id(3);
+  stops.back().set_y(2);
+  r.ClearCachedHash();
+  fresh.owner().set_id(3);
+  fresh.stop_vec().back().set_y(2);
+  assert(r == fresh && r.Hash() == fresh.Hash() && r.Hash() != h2);
+}
+
+void MapContainers() {
+  // A flat map iterates in key order, whatever the order of the insertions.
+  thing::Index index;
+  index.by_id()[3].set_x(3);
+  index.by_id()[1].set_x(1);
+  index.by_id()[2].set_x(2);
+  int32_t expected = 1;
+  for (const auto& entry : index.by_id()) {
+    assert(entry.first == expected && entry.second.x() == expected);
+    ++expected;
+  }
+  assert(index.by_id().count(2) == 1 && index.by_id().count(4) == 0);
+  assert(&index.by_id().begin()[1] == &*index.by_id().find(2));  // contiguous
+
+  // The unordered maps compare, hash and print regardless of the insertion order.
+  thing::Index other = index;
+  for (int i = 0; i < 20; ++i)
+    index.by_name()[("name" + std::to_string(i)).c_str()] = i;
+  for (int i = 19; i >= 0; --i)
+    other.by_name()[("name" + std::to_string(i)).c_str()] = i;
+  index.by_time()[7] = "seven";
+  other.by_time()[7] = "seven";
+  assert(index == other && index.Compare(other) == 0);
+  assert(index.Hash() == other.Hash());
+  assert(index.DebugString() == other.DebugString());
+  other.by_name()["name0"] = 100;
+  assert(index != other && index < other);
+
+  thing::Index parsed;
+  assert(parsed.ParseFromString(index.SerializeAsString()));
+  assert(parsed == index);
+  assert(parsed.by_name().at("name5") == 5 && parsed.by_id().at(3).x() == 3);
+}
+
+// The wire types under 'tag' in 'data'.
+std::vector<protozero::pbf_wire_type> WireTypes(const std::string& data, uint32_t tag) {
+  std::vector<protozero::pbf_wire_type> rv;
+  protozero::pbf_reader reader(data);
+  while (reader.next(tag)) {
+    rv.push_back(reader.wire_type());
+    reader.skip();
+  }
+  return rv;
+}
+
+void PackedFields() {
+  const auto packed = std::vector<protozero::pbf_wire_type>{
+      protozero::pbf_wire_type::length_delimited};
+
+  thing::Samples s;
+  s.value_vec() = {1, -2, 300};
+  s.weight_vec() = {0.5, 1.5};
+  s.kind_vec() = {thing::FLAT, thing::UNORDERED};
+  s.flag_vec() = {true, false, true};
+  s.plain_vec() = {7, 8};
+  const std::string data = s.SerializeAsString();
+  assert(data.size() == s.ByteSizeLong());
+  for (uint32_t tag = 1; tag <= 4; ++tag)
+    assert(WireTypes(data, tag) == packed);
+  assert(WireTypes(data, 5).size() == 2);
+
+  thing::Samples parsed;
+  assert(parsed.ParseFromString(data) && parsed == s);
+  assert(thing::SamplesView(data).value_vec().size() == 3);
+
+  // Either encoding is accepted, even both for the same field.
+  std::string mixed;
+  {
+    protozero::pbf_writer writer(mixed);
+    std::vector<int32_t> values = {4, 5};
+    writer.add_packed_int32(1, values.begin(), values.end());
+    writer.add_int32(1, 6);
+    std::vector<uint64_t> plain = {9, 10};
+    writer.add_packed_uint64(5, plain.begin(), plain.end());
+  }
+  assert(parsed.ParseFromString(mixed));
+  assert(parsed.value_vec().size() == 3 && parsed.value_vec()[0] == 4 &&
+         parsed.value_vec()[2] == 6);
+  assert(parsed.plain_vec().size() == 2 && parsed.plain_vec()[1] == 10);
+  int32_t sum = 0;
+  for (int32_t value : thing::SamplesView(mixed).value_vec())
+    sum += value;
+  assert(sum == 15);
+  assert(thing::SamplesView(mixed).plain_vec().size() == 2);
+
+  // proto3 packs by default.
+  a::b::c::d::Series series;
+  series.value_vec().push_back(1);
+  series.value_vec().push_back(-1);
+  series.ratio_vec().push_back(0.25f);
+  series.ratio_vec().push_back(0.5f);
+  const std::string encoded = series.SerializeAsString();
+  assert(series.ByteSizeLong() == encoded.size());
+  assert(encoded.size() == 2 + 11 + 2 * (1 + 4));  // the unpacked floats are 5 bytes each
+  assert(WireTypes(encoded, 1) == packed);
+  assert(WireTypes(encoded, 2).size() == 2 &&
+         WireTypes(encoded, 2)[0] == protozero::pbf_wire_type::fixed32);
+  a::b::c::d::Series series_copy;
+  assert(series_copy.ParseFromString(encoded) && series_copy == series);
+}
+
+void FixedAndZigZag() {
+  std::string data;
+  {
+    protozero::pbf_writer writer(data);
+    writer.add_fixed64(1, 0xfedcba9876543210ULL);
+    writer.add_sfixed32(2, -7);
+    writer.add_sint32(3, -1);
+    writer.add_sint64(4, -5000000000LL);
+    writer.add_fixed32(5, 0xdeadbeef);
+    writer.add_sfixed64(6, -3);
+    std::vector<int32_t> deltas = {-1, 1, -64, 64};
+    writer.add_packed_sint32(7, deltas.begin(), deltas.end());
+    std::vector<uint64_t> hashes = {1, ~0ULL};
+    writer.add_packed_fixed64(8, hashes.begin(), hashes.end());
+    writer.add_sint64(9, -2);
+    writer.add_sint64(9, 2);
+    protozero::pbf_writer entry(writer, 10);
+    entry.add_fixed32(1, 42);
+    entry.add_sint64(2, -42);
+  }
+
+  thing::Reading r;
+  assert(r.ParseFromString(data));
+  assert(r.hash() == 0xfedcba9876543210ULL && r.offset() == -7 && r.delta() == -1);
+  assert(r.drift() == -5000000000LL && r.crc() == 0xdeadbeef && r.stamp() == -3);
+  assert(r.delta_vec().size() == 4 && r.delta_vec()[2] == -64 && r.delta_vec()[3] == 64);
+  assert(r.hash_vec().size() == 2 && r.hash_vec()[1] == ~0ULL);
+  assert(r.drift_vec().size() == 2 && r.drift_vec()[0] == -2);
+  assert(r.drift_by_crc().at(42) == -42);
+
+  // Encoded exactly as protozero does.
+  assert(r.SerializeAsString() == data && r.ByteSizeLong() == data.size());
+  assert(WireTypes(data, 1)[0] == protozero::pbf_wire_type::fixed64);
+  assert(WireTypes(data, 2)[0] == protozero::pbf_wire_type::fixed32);
+
+  thing::Reading copy;
+  assert(copy.ParseFromString(r.SerializeAsString()) && copy == r && copy.Hash() == r.Hash());
+
+  thing::ReadingView view(data);
+  assert(view.hash() == 0xfedcba9876543210ULL && view.delta() == -1 && view.stamp() == -3);
+  int32_t sum = 0;
+  for (int32_t delta : view.delta_vec())
+    sum += delta;
+  assert(sum == 0);
+  assert(view.hash_vec().size() == 2);
+}
+
+void OneOfs() {
+  // As large as the largest field, plus the index.
+  static_assert(sizeof(proto_ng::OneOf<int32_t, std::string, thing::Point>) <=
+                    std::max(sizeof(std::string), sizeof(thing::Point)) + 8, "");
+
+  thing::Shape s;
+  assert(s.kind_case() == thing::Shape::KIND_NOT_SET && !s.has_radius() && !s.has_center());
+  assert(s.radius() == 0 && s.title().empty() && s.container() == thing::ORDERED);
+  assert(s.center().x() == 0);
+
+  // Setting a field unsets the previous one.
+  s.set_radius(5);
+  assert(s.kind_case() == thing::Shape::kRadius && s.has_radius() && s.radius() == 5);
+  s.set_title("circle");
+  assert(s.kind_case() == thing::Shape::kTitle && !s.has_radius() && s.radius() == 0);
+  assert(s.title() == "circle");
+  s.center().set_x(3);
+  assert(s.has_center() && !s.has_title() && s.title().empty() && s.center().x() == 3);
+  s.clear_title();
+  assert(s.has_center());
+  s.clear_center();
+  assert(s.kind_case() == thing::Shape::KIND_NOT_SET);
+
+  // The last one on the wire wins; the sub-messages merge.
+  std::string data;
+  {
+    protozero::pbf_writer writer(data);
+    writer.add_string(1, "shape");
+    writer.add_int32(2, 7);
+    writer.add_string(3, "seven");
+    {
+      protozero::pbf_writer center(writer, 5);
+      center.add_int32(1, 1);
+    }
+    {
+      protozero::pbf_writer center(writer, 5);
+      center.add_int32(2, 2);
+    }
+    writer.add_int32(6, 4);
+  }
+  assert(s.ParseFromString(data));
+  assert(s.name() == "shape" && s.side() == 4 && s.kind_case() == thing::Shape::kCenter);
+  assert(s.center().x() == 1 && s.center().y() == 2);
+
+  thing::Shape copy;
+  assert(copy.ParseFromString(s.SerializeAsString()) && copy == s && copy.Hash() == s.Hash());
+  assert(copy.Compare(s) == 0);
+  copy.set_container(thing::FLAT);
+  assert(copy != s && copy.Compare(s) != 0 && copy.container() == thing::FLAT);
+  thing::Shape other = copy;
+  assert(other == copy && other.container() == thing::FLAT);
+  other.set_radius(0);
+  assert(other != copy && other.has_radius());
+  other.Clear();
+  assert(other.kind_case() == thing::Shape::KIND_NOT_SET && other.SerializeAsString().empty());
+
+  // Equal values of different fields differ.
+  thing::Shape round, flat;
+  round.set_radius(thing::FLAT);
+  flat.set_container(thing::FLAT);
+  assert(round != flat && round.Compare(flat) != 0);
+  proto_ng::OneOf<int32_t, uint32_t> a, b;
+  a.emplace<1>() = 7;
+  b.emplace<2>() = 7;
+  assert(a != b && !(a == b));
+
+  thing::ShapeView view(data);
+  assert(view.has_center() && view.center().y() == 2 && view.side() == 4);
+}
+
+void DebugOutput() {
+  thing::Shape s;
+  s.set_name("a\"b\n\x01\xff");
+  s.center().set_x(1);
+  s.center().set_label("c");
+  s.set_side(-3);
+  assert(s.DebugString() ==
+         "name: \"a\\\"b\\n\\x01\\xff\"\n"
+         "center {\n"
+         "  x: 1\n"
+         "  label: \"c\"\n"
+         "}\n"
+         "side: -3\n");
+  assert(s.ShortDebugString() ==
+         "name: \"a\\\"b\\n\\x01\\xff\" center { x: 1 label: \"c\" } side: -3");
+  std::ostringstream os;
+  s.PrintDebugTo(os);
+  assert(os.str() == s.DebugString());
+  // Straight into the stream, after what it holds, nested one level deeper.
+  std::ostringstream nested;
+  nested << "shape {\n";
+  s.PrintDebugTo(nested, 1);
+  nested << "}\n";
+  assert(nested.str() ==
+         "shape {\n"
+         "  name: \"a\\\"b\\n\\x01\\xff\"\n"
+         "  center {\n"
+         "    x: 1\n"
+         "    label: \"c\"\n"
+         "  }\n"
+         "  side: -3\n"
+         "}\n");
+  std::ostringstream line;
+  s.center().PrintDebugTo(line, 0, true);
+  assert(line.str() == "x: 1 label: \"c\" ");
+  assert(thing::Shape().ShortDebugString().empty());
+
+  // Maps in key order, enums by name (or number), floating point and booleans.
+  thing::Index index;
+  index.by_name()["b"] = 2;
+  index.by_name()["a"] = 1;
+  assert(index.ShortDebugString() ==
+         "by_name { key: \"a\" value: 1 } by_name { key: \"b\" value: 2 }");
+  thing::Samples samples;
+  samples.kind_vec() = {thing::FLAT, static_cast<thing::MapContainer>(7)};
+  samples.weight_vec() = {0.5};
+  samples.flag_vec() = {true};
+  assert(samples.ShortDebugString() ==
+         "weight_vec: 0.5 kind_vec: FLAT kind_vec: 7 flag_vec: true");
+
+  // Floating point values read back exactly, in as few digits as that takes.
+  thing::Samples weights;
+  weights.weight_vec() = {0.1, 1 / 3.0};
+  assert(weights.ShortDebugString() == "weight_vec: 0.1 weight_vec: 0.3333333333333333");
+  a::b::c::d::Series ratios;
+  ratios.ratio_vec() = {0.1f, 1 / 3.0f};
+  assert(ratios.ShortDebugString() == "ratio_vec: 0.1 ratio_vec: 0.33333334");
+}
+
 void Extensions() {
   thing::Person p;
-  p.HasExtension(thing::ext100);
+  assert(!p.HasExtension(thing::ext100));
+  assert(p.GetExtension(thing::ext100).eg_field() == 0);
   thing::GlobalExtension *gext = p.MutableExtension(thing::ext100);
+  gext->set_eg_field(7);
+  assert(p.HasExtension(thing::ext100));
+  assert(!p.HasExtension(thing::NestedExtension::ext200));
 
-  p.HasExtension(thing::NestedExtension::ext200);
   thing::NestedExtension *next =
       p.MutableExtension(thing::NestedExtension::ext200);
+  next->set_en_field(8);
+  p.set_id(1);
+
+  // The parsed extensions stay as bytes until accessed.
+  thing::Person copy;
+  assert(copy.ParseFromString(p.SerializeAsString()));
+  assert(copy.HasExtension(thing::ext100));
+  assert(copy.ByteSizeLong() == p.ByteSizeLong());
+  assert(copy.SerializeAsString() == p.SerializeAsString());
+  assert(copy == p);
+  assert(copy.GetExtension(thing::ext100).eg_field() == 7);
+  assert(copy.GetExtension(thing::NestedExtension::ext200).en_field() == 8);
+  assert(copy == p);
+  assert(copy.ShortDebugString() == p.ShortDebugString());
+
+  // The undecoded values compare as values, however encoded: eg_field 7, and then 3 and 7.
+  thing::Person plain, twice, other;
+  assert(plain.ParseFromString(std::string("\xa2\x06\x02\x08\x07", 5)));
+  assert(twice.ParseFromString(std::string("\xa2\x06\x04\x08\x03\x08\x07", 7)));
+  assert(other.ParseFromString(std::string("\xa2\x06\x02\x08\x08", 5)));
+  assert(plain == twice && plain.Compare(twice) == 0);
+  assert(plain != other && plain.Compare(other) < 0);
+  // Neither side decoded its value, and the const accesses keep the bytes.
+  assert(twice.ShortDebugString() == "[100]: \"\\x08\\x03\\x08\\x07\"");
+  assert(twice.GetExtension(thing::ext100).eg_field() == 7);
+  assert(twice.SerializeAsString() == std::string("\xa2\x06\x04\x08\x03\x08\x07", 7));
+  twice.MutableExtension(thing::ext100);
+  assert(twice.SerializeAsString() == plain.SerializeAsString());
+
+  // Concurrent const readers decode the value once.
+  const thing::Person readers(other);
+  std::vector<std::thread> threads;
+  for (int i = 0; i < 4; ++i) {
+    threads.emplace_back([&readers, &plain] {
+      assert(readers.GetExtension(thing::ext100).eg_field() == 8);
+      assert(readers != plain);
+    });
+  }
+  thing::Person snapshot(readers);  // while being decoded, maybe
+  for (auto& thread : threads)
+    thread.join();
+  assert(snapshot == readers && snapshot.SerializeAsString() == other.SerializeAsString());
+
+  // Repeated occurrences merge.
+  thing::Person more;
+  more.MutableExtension(thing::NestedExtension::ext200);
+  more.set_name("x");
+  std::string data = p.SerializeAsString() + more.SerializeAsString();
+  assert(copy.ParseFromString(data));
+  assert(copy.GetExtension(thing::NestedExtension::ext200).en_field() == 8);
+  assert(copy.name() == "x");
+
+  copy.ClearExtension(thing::ext100);
+  assert(!copy.HasExtension(thing::ext100));
+  assert(copy != p);
+  copy.Clear();
+  assert(!copy.HasExtension(thing::NestedExtension::ext200));
+
+  thing::Person assigned = p;
+  assert(assigned == p);
+  assigned.MutableExtension(thing::ext100)->set_eg_field(9);
+  assert(assigned != p);
+  assert(p.GetExtension(thing::ext100).eg_field() == 7);
 }
 
 void Repeated() {
@@ -123,14 +599,384 @@ void Repeated() {
   std::cout << "AddressBook:\n" << ab.DebugString();
 }
 
+void Parsing() {
+  std::string data;
+  {
+    protozero::pbf_writer ab(data);
+    {
+      protozero::pbf_writer p(ab, 1);
+      p.add_string(1, "bob");
+      p.add_int32(2, 42);
+      std::wstring wide = L"(Олег)";
+      p.add_bytes(5, reinterpret_cast<const char*>(wide.data()),
+                  wide.size() * sizeof(wchar_t));
+      {
+        protozero::pbf_writer ph(p, 4);
+        ph.add_string(1, "111");
+        ph.add_enum(2, thing::Person::PhoneNumber::WORK);
+      }
+      p.add_enum(11, thing::Person::PhoneNumber::HOME);
+      p.add_fixed32(99, 12345);  // unknown, skipped
+    }
+    ab.add_string(2, "s1");
+    ab.add_string(2, "s2");
+    ab.add_int32(3, -1);
+    ab.add_int32(3, 7);
+    {
+      protozero::pbf_writer entry(ab, 4);
+      entry.add_int32(1, 10);
+      entry.add_int64(2, 1LL << 40);
+    }
+    {
+      protozero::pbf_writer entry(ab, 5);
+      entry.add_string(2, "value");  // the key goes last
+      entry.add_int32(1, 20);
+    }
+    {
+      protozero::pbf_writer entry(ab, 6);
+      entry.add_int32(1, 30);
+      protozero::pbf_writer p(entry, 2);
+      p.add_string(3, "carol@foobar");
+    }
+  }
+
+  thing::AddressBook ab;
+  assert(ab.ParseFromString(data));
+  assert(ab.person_vec().size() == 1);
+  const thing::Person& p = ab.person_vec()[0];
+  assert(p.name() == "bob");
+  assert(p.id() == 42);
+  assert(p.has_id() && !p.has_email());
+  assert(p.wide_name() == L"(Олег)");
+  assert(p.phone_vec().size() == 1);
+  assert(p.phone_vec()[0].number() == "111");
+  assert(p.phone_vec()[0].itype() == thing::Person::PhoneNumber::WORK);
+  assert(p.ph_type_v3() == thing::Person::PhoneNumber::HOME);
+  assert(ab.x().size() == 2 && ab.x()[0] == "s1" && ab.x()[1] == "s2");
+  assert(ab.y().size() == 2 && ab.y()[0] == -1 && ab.y()[1] == 7);
+  assert(ab.int_map().at(10) == 1LL << 40);
+  assert(ab.string_map().at(20) == "value");
+  assert(ab.person_map().at(30).email() == "carol@foobar");
+
+  // Parsing replaces the previous content.
+  assert(ab.ParseFromArray(data.data(), data.size()));
+  assert(ab.x().size() == 2);
+
+  // Truncated input fails.
+  assert(!ab.ParseFromArray(data.data(), data.size() - 1));
+}
+
+void Serialization() {
+  thing::AddressBook ab;
+  {
+    thing::Person p;
+    p.set_name("bob");
+    p.set_id(-42);
+    p.set_wide_name(L"(Олег)");
+    p.add_phone_vec()->set_number("111");
+    p.phone_vec().at(0).set_itype(thing::Person::PhoneNumber::WORK);
+    p.set_ph_type_v2(thing::Person::PhoneNumber::MOBILE);
+    ab.person_vec().push_back(p);
+    ab.person_map()[7] = std::move(p);
+  }
+  ab.x().push_back("s1");
+  ab.y().push_back(-1);
+  ab.int_map()[-5] = 1LL << 40;
+  ab.string_map()[3] = "three";
+
+  const std::string data = ab.SerializeAsString();
+  assert(data.size() == ab.ByteSizeLong());
+
+  thing::AddressBook copy;
+  assert(copy.ParseFromString(data));
+  assert(copy == ab);
+  assert(copy.person_vec()[0].has_ph_type_v2());
+  assert(!copy.person_vec()[0].has_email());
+  assert(copy.SerializeAsString() == data);
+
+  // Buffer reuse
+  std::string output = "prefix";
+  assert(ab.AppendToString(&output));
+  assert(output == "prefix" + data);
+  assert(ab.SerializeToString(&output));
+  assert(output == data);
+
+  std::vector<char> array(data.size());
+  assert(ab.SerializeToArray(array.data(), array.size()));
+  assert(std::string(array.data(), array.size()) == data);
+  assert(!ab.SerializeToArray(array.data(), array.size() - 1));
+
+  assert(thing::AddressBook().SerializeAsString().empty());
+}
+
+void Views() {
+  thing::AddressBook ab;
+  {
+    thing::Person p;
+    p.set_name("bob");
+    p.set_id(42);
+    p.add_phone_vec()->set_number("111");
+    p.add_phone_vec()->set_number("222");
+    p.phone_vec().at(1).set_itype(thing::Person::PhoneNumber::WORK);
+    ab.person_vec().push_back(p);
+    p.set_email("carol@foobar");
+    ab.person_map()[7] = std::move(p);
+  }
+  ab.y().push_back(-1);
+  ab.y().push_back(2);
+  ab.int_map()[10] = 1LL << 40;
+  const std::string data = ab.SerializeAsString();
+
+  const size_t allocations_before = allocations;
+  thing::AddressBookView view(data);
+  int count = 0;
+  for (const thing::PersonView& p : view.person_vec()) {
+    ++count;
+    assert(p.name() == "bob");
+    assert(p.id() == 42 && p.has_id());
+    assert(p.email().empty() && !p.has_email());
+    assert(p.ph_type_v3() == thing::Person::PhoneNumber::MOBILE);
+    assert(p.phone_vec().size() == 2);
+    auto it = p.phone_vec().begin();
+    assert(it->number() == "111");
+    ++it;
+    assert(it->itype() == thing::Person::PhoneNumber::WORK);
+    assert(++it == p.phone_vec().end());
+  }
+  assert(count == 1);
+
+  int32_t sum = 0;
+  for (int32_t y : view.y())
+    sum += y;
+  assert(sum == 1);
+  assert(view.x().empty());
+
+  for (const auto& entry : view.int_map())
+    assert(entry.first == 10 && entry.second == 1LL << 40);
+  for (const auto& entry : view.person_map())
+    assert(entry.first == 7 && entry.second.email() == "carol@foobar");
+  assert(allocations == allocations_before);
+}
+
+void LazySubMessages() {
+  std::string data;
+  {
+    protozero::pbf_writer env(data);
+    env.add_int32(1, 7);
+    {
+      protozero::pbf_writer b(env, 2);
+      b.add_int32(1, 1);
+      b.add_string(99, "unknown");  // dropped once decoded
+    }
+    for (int i = 2; i <= 3; ++i) {
+      protozero::pbf_writer b(env, 3);
+      b.add_int32(1, i);
+    }
+  }
+
+  // Untouched sub-messages go back out as they came in.
+  thing::Envelope env;
+  assert(env.ParseFromString(data));
+  assert(env.id() == 7 && env.has_block());
+  assert(env.ByteSizeLong() == data.size());
+  assert(env.SerializeAsString() == data);
+
+  // The first access decodes them.
+  assert(env.block().id() == 1);
+  assert(env.block_vec().size() == 2 && env.block_vec()[1].id() == 3);
+  assert(env.SerializeAsString().size() < data.size());
+
+  thing::Envelope copy;
+  assert(copy.ParseFromString(data));
+  assert(copy == env);
+  copy.block().set_name("bob");
+  copy.block_vec().emplace_back();
+  assert(copy.ParseFromString(copy.SerializeAsString()));
+  assert(copy.block().name() == "bob" && copy.block_vec().size() == 3);
+
+  // Merging into a decoded field.
+  assert(env.ParseFromString(data));
+  env.block_vec();
+  env._MergeFromArray(data.data(), data.size());
+  assert(env.block_vec().size() == 4);
+
+  // Concurrent readers of a freshly parsed message decode it once, and keep the bytes.
+  thing::Envelope shared;
+  assert(shared.ParseFromString(data));
+  const thing::Envelope& readers = shared;
+  std::vector<std::thread> threads;
+  for (int i = 0; i < 4; ++i) {
+    threads.emplace_back([&readers] {
+      assert(readers.block().id() == 1 && readers.block_vec().size() == 2);
+      assert(readers.block_vec()[1].id() == 3);
+    });
+  }
+  thing::Envelope snapshot(readers);  // while being decoded, maybe
+  for (auto& thread : threads)
+    thread.join();
+  assert(readers.SerializeAsString() == data && snapshot.SerializeAsString() == data);
+  assert(snapshot == readers && snapshot.block_vec().size() == 2);
+
+  // Merging after a const access decodes everything again.
+  shared._MergeFromArray(data.data(), data.size());
+  assert(readers.block_vec().size() == 4 && readers.block().id() == 1);
+}
+
+// Inline messages (the "inline_representation" option) hold their fields in place. With
+// --pmr the option is ignored.
+void InlineRepresentation() {
+  const bool is_inline = sizeof(thing::Point) > sizeof(std::string);  // holds its label
+  const size_t allocations_before = allocations;
+  thing::Segment s;
+  s.from().set_x(1);
+  s.to().set_y(2);
+  thing::Segment copy(s);
+  assert(copy == s && copy.to().y() == 2);
+  assert(!is_inline || allocations == allocations_before);
+
+  // A single allocation holds all the Points.
+  thing::Polygon polygon;
+  const size_t allocations_before_points = allocations;
+  polygon.point_vec().resize(100);
+  assert(!is_inline || allocations == allocations_before_points + 1);
+  polygon.point_vec()[99].set_label("a label that does not fit the small string buffer");
+  polygon.center().set_x(5);
+
+  thing::Polygon parsed;
+  assert(parsed.ParseFromString(polygon.SerializeAsString()));
+  assert(parsed == polygon);
+  assert(parsed.point_vec().size() == 100 && parsed.center().x() == 5);
+}
+
+void SparseIds() {
+  // A couple of words for the presence bits of 'low' and 'high', not 100000 bits.
+  static_assert(sizeof(thing::Sparse) < 128, "The presence bits should be dense");
+  thing::Sparse sparse;
+  sparse.set_high("high");
+  sparse.value_vec().push_back(7);
+  assert(!sparse.has_low() && sparse.has_high());
+
+  thing::Sparse parsed;
+  assert(parsed.ParseFromString(sparse.SerializeAsString()));
+  assert(parsed == sparse && parsed.has_high() && !parsed.has_low());
+  assert(parsed.value_vec().size() == 1 && parsed.value_vec()[0] == 7);
+  parsed.Clear();
+  assert(!parsed.has_high() && parsed.value_vec().empty());
+}
+
+// The cold fields of an Account are allocated on the first write.
+void ColdFields() {
+  // Inline and split (neither happens with --pmr, the latter not with --table-driven).
+  const bool is_split = sizeof(thing::Account) > sizeof(std::string) &&
+      sizeof(thing::Account) < 2 * sizeof(std::string) + sizeof(std::vector<int32_t>);
+  thing::Account().notes();  // allocates the shared defaults of the cold fields once
+  const size_t allocations_before = allocations;
+  thing::Account account;
+  account.set_id(7);
+  account.set_name("bob");
+  const thing::Account& const_account = account;
+  assert(const_account.notes().empty() && const_account.details().id() == 0);
+  assert(!is_split || allocations == allocations_before);
+  account.history().push_back(1);
+  account.set_notes("rarely read");
+  account.details().set_id(3);
+
+  thing::Account parsed;
+  assert(parsed.ParseFromString(account.SerializeAsString()));
+  assert(parsed == account && parsed.has_notes() && parsed.details().id() == 3);
+  thing::Account copy(parsed);
+  assert(copy == account && copy.history().size() == 1);
+  copy = thing::Account();
+  assert(copy.notes().empty() && copy.history().empty() && copy.id() == 0);
+}
+
+// Clear() keeps the capacity of the strings and containers (and the cold fields), so
+// reusing a message for similar input allocates nothing.
+void ClearKeepsCapacity() {
+  thing::Account account;
+  account.set_name("a name that does not fit the small string buffer");
+  account.set_notes("notes that do not fit the small string buffer either");
+  account.history().assign(100, 7);
+  account.details().set_email("an email that does not fit the small string buffer");
+  const std::string data = account.SerializeAsString();
+
+  thing::Account reused;
+  assert(reused.ParseFromString(data));
+  const size_t allocations_before = allocations;
+  for (int i = 0; i < 10; ++i) {
+    reused.Clear();
+    assert(!reused.has_name() && reused.history().empty() && !reused.has_details());
+    assert(reused.ParseFromString(data));
+  }
+  assert(allocations == allocations_before);
+  assert(reused == account);
+}
+
+#if __cplusplus >= 201703L
+// The allocator-aware messages (--pmr) take everything from their memory resource.
+template<class AddressBook>
+void MemoryResource(const std::string& data) {
+  if constexpr (std::uses_allocator<AddressBook, std::pmr::polymorphic_allocator<char>>::value) {
+    static char buffer[64 * 1024];
+    std::pmr::monotonic_buffer_resource pool(buffer, sizeof(buffer),
+                                             std::pmr::null_memory_resource());
+    AddressBook ab(&pool);
+    const size_t allocations_before = allocations;
+    assert(ab.ParseFromString(data));
+    assert(allocations == allocations_before);
+    assert(ab.person_vec()[0].get_allocator().resource() == &pool);
+    assert(ab.person_map().at(7).get_allocator().resource() == &pool);
+    assert(ab.person_map().at(7).phone_vec()[0].number().size() > 32);
+
+    // Copies use the default resource unless told otherwise.
+    AddressBook copy(ab);
+    assert(copy == ab);
+    assert(copy.get_allocator().resource() == std::pmr::get_default_resource());
+    assert(AddressBook(ab, &pool).get_allocator().resource() == &pool);
+  }
+}
+#endif
+
+void MemoryResources() {
+  thing::AddressBook ab;
+  {
+    thing::Person p;
+    p.set_name("a name that does not fit the small string buffer");
+    p.add_phone_vec()->set_number("+1-555-0100 (a number with a long comment)");
+    ab.person_vec().push_back(p);
+    ab.person_map()[7] = std::move(p);
+  }
+  ab.x().push_back("a string that does not fit the small string buffer");
+  ab.string_map()[1] = "a string that does not fit the small string buffer";
+#if __cplusplus >= 201703L
+  MemoryResource<thing::AddressBook>(ab.SerializeAsString());
+#endif
+}
+
 } // namespace
 
 int main() {
   BasicAPI();
+  StringAccessors();
   Extensions();
   Equality();
   SetsHashes();
+  FullHashes();
+  MapContainers();
+  PackedFields();
+  FixedAndZigZag();
+  OneOfs();
+  DebugOutput();
   Repeated();
+  Parsing();
+  Serialization();
+  Views();
+  LazySubMessages();
+  InlineRepresentation();
+  SparseIds();
+  ColdFields();
+  ClearKeepsCapacity();
+  MemoryResources();
 
   std::cout << "All good!\n";
   return 0;